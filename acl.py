@@ -0,0 +1,65 @@
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ManagerACL:
+    """In-memory view of the managers table.
+
+    Membership checks never touch sqlite. Changes made through add()/remove()
+    are written through to the database and applied to the in-memory set once
+    committed. Edits made to the database by other processes are picked up by
+    comparing PRAGMA data_version at most once every refresh_interval seconds.
+    """
+
+    def __init__(self, conn, admin_id, refresh_interval=5.0):
+        self._conn = conn
+        self._admin_id = admin_id
+        self._refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._managers = frozenset()
+        self._data_version = None
+        self._next_check = 0.0
+        self.reload()
+
+    def _current_data_version(self):
+        return self._conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def reload(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT user_id FROM managers').fetchall()
+            self._managers = frozenset(row[0] for row in rows)
+            self._data_version = self._current_data_version()
+            self._next_check = time.monotonic() + self._refresh_interval
+        logger.info(f'Loaded {len(self._managers)} managers into the ACL cache.')
+
+    def _refresh_if_changed(self, now):
+        self._next_check = now + self._refresh_interval
+        if self._current_data_version() != self._data_version:
+            logger.info('managers.db changed externally, reloading ACL cache.')
+            self.reload()
+
+    def is_manager(self, user_id):
+        if user_id == self._admin_id:
+            return True
+        now = time.monotonic()
+        if now >= self._next_check:
+            self._refresh_if_changed(now)
+        return user_id in self._managers
+
+    def add(self, user_id):
+        with self._lock:
+            self._conn.execute('INSERT OR IGNORE INTO managers (user_id) VALUES (?)', (user_id,))
+            self._conn.commit()
+            self._managers = self._managers | {user_id}
+
+    def remove(self, user_id):
+        with self._lock:
+            self._conn.execute('DELETE FROM managers WHERE user_id = ?', (user_id,))
+            self._conn.commit()
+            self._managers = self._managers - {user_id}
+
+    def __len__(self):
+        return len(self._managers)
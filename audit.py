@@ -0,0 +1,262 @@
+import asyncio
+import contextvars
+import functools
+import logging
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+AuditRecord = namedtuple('AuditRecord', 'id ts user_id username command args target result ok exit_code duration')
+
+PAGE_SIZE = 20
+# Most records written by the background thread in one transaction
+BATCH_SIZE = 500
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS audit (
+        id INTEGER PRIMARY KEY,
+        ts REAL NOT NULL,
+        user_id INTEGER,
+        username TEXT,
+        command TEXT NOT NULL,
+        args TEXT NOT NULL,
+        target TEXT,
+        result TEXT,
+        ok INTEGER,
+        exit_code INTEGER,
+        duration REAL
+    );
+    CREATE INDEX IF NOT EXISTS audit_ts ON audit (ts);
+    CREATE INDEX IF NOT EXISTS audit_user_ts ON audit (user_id, ts);
+    CREATE INDEX IF NOT EXISTS audit_target_ts ON audit (target, ts);
+'''
+
+_STOP = object()
+_action = contextvars.ContextVar('audit_action', default=None)
+
+
+class AuditError(Exception):
+    pass
+
+
+# Recorded for commands that return without calling note(), e.g. on a usage error
+NO_OUTCOME = 'no outcome recorded'
+
+
+class _Action:
+    __slots__ = ('result', 'ok', 'exit_code', 'target')
+
+    def __init__(self):
+        self.result = None
+        self.ok = None
+        self.exit_code = None
+        self.target = None
+
+
+def note(result, ok=True, target=None):
+    """Record the outcome of the command currently being handled.
+
+    `target` is what the command acted on (site, ports, VMs, ...), as the
+    handler resolved it from its arguments.
+    """
+    action = _action.get()
+    if action is not None:
+        action.result = result
+        action.ok = ok
+        if target is not None:
+            action.target = target
+
+
+def record_exit(returncode):
+    """Called by executor for every finished process; keeps the first failure."""
+    action = _action.get()
+    if action is not None and not action.exit_code:
+        action.exit_code = returncode
+
+
+def _connect(path):
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    return conn
+
+
+class AuditLog:
+    """Append-only audit trail of actions taken through the bot.
+
+    record() only puts the row on a queue. A background thread takes
+    everything queued so far and inserts it in a single transaction, so
+    bursts of commands cost one commit instead of one each. Queries use their
+    own connection; WAL mode lets them run alongside the writer.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        conn = _connect(path)
+        with conn:
+            conn.executescript(SCHEMA)
+        conn.close()
+        self._read_lock = threading.Lock()
+        self._reader = _connect(path)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+        self._thread.start()
+        logger.info(f'Audit log writing to {self.path}.')
+
+    def stop(self):
+        """Flush everything queued and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+
+    def record(self, user_id, username, command, args, result, ok=True, exit_code=None, duration=None, ts=None, target=None):
+        self._queue.put((
+            ts or time.time(), user_id, username, command, ' '.join(args), target,
+            result, None if ok is None else int(ok), exit_code, duration,
+        ))
+
+    def _run(self):
+        conn = _connect(self.path)
+        try:
+            stopping = False
+            while not stopping:
+                batch = []
+                item = self._queue.get()
+                while True:
+                    if item is _STOP:
+                        stopping = True
+                        break
+                    batch.append(item)
+                    if len(batch) >= BATCH_SIZE:
+                        break
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                if not batch:
+                    continue
+                try:
+                    with conn:
+                        conn.executemany(
+                            'INSERT INTO audit (ts, user_id, username, command, args, target, result, ok, exit_code, duration) '
+                            'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            batch,
+                        )
+                    logger.debug(f'Wrote {len(batch)} audit records.')
+                except sqlite3.Error as e:
+                    logger.error(f'Failed to write {len(batch)} audit records: {e}')
+        finally:
+            conn.close()
+
+    def query(self, user_id=None, command=None, target=None, since=None, failed=False, page=1, page_size=PAGE_SIZE):
+        """Return (records, total) for one page, newest first."""
+        where, params = [], []
+        if user_id is not None:
+            where.append('user_id = ?')
+            params.append(user_id)
+        if command:
+            where.append('command = ?')
+            params.append(command.lstrip('/'))
+        if target:
+            where.append('target GLOB ?')
+            params.append(target)
+        if since is not None:
+            where.append('ts >= ?')
+            params.append(since)
+        if failed:
+            where.append('ok = 0')
+        clause = f' WHERE {" AND ".join(where)}' if where else ''
+        with self._read_lock:
+            total = self._reader.execute(f'SELECT COUNT(*) FROM audit{clause}', params).fetchone()[0]
+            rows = self._reader.execute(
+                f'SELECT id, ts, user_id, username, command, args, target, result, ok, exit_code, duration '
+                f'FROM audit{clause} ORDER BY ts DESC, id DESC LIMIT ? OFFSET ?',
+                params + [page_size, (page - 1) * page_size],
+            ).fetchall()
+        return [AuditRecord(*row) for row in rows], total
+
+    async def query_async(self, **filters):
+        return await asyncio.to_thread(self.query, **filters)
+
+    def track(self, command, callback):
+        """Wrap a handler so every call is recorded, with the outcome it reports via note()."""
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            action = _Action()
+            token = _action.set(action)
+            started = time.monotonic()
+            try:
+                return await callback(update, context)
+            except Exception as e:
+                action.result, action.ok = f'{type(e).__name__}: {e}', False
+                raise
+            finally:
+                _action.reset(token)
+                user = update.effective_user
+                self.record(
+                    user.id if user else None, user.username if user else None, command,
+                    list(context.args or ()), NO_OUTCOME if action.result is None else action.result,
+                    action.ok, action.exit_code, time.monotonic() - started, target=action.target,
+                )
+        return wrapper
+
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400, 'w': 604800}
+
+
+def parse_filters(args):
+    """Parse /audit arguments: user=ID command=NAME target=GLOB since=2h failed page=N."""
+    filters = {}
+    for arg in args:
+        key, sep, value = arg.partition('=')
+        key = key.lower()
+        if not sep and key == 'failed':
+            filters['failed'] = True
+        elif key == 'user' and value.lstrip('-').isdigit():
+            filters['user_id'] = int(value)
+        elif key in ('command', 'cmd') and value:
+            filters['command'] = value
+        elif key == 'target' and value:
+            filters['target'] = value
+        elif key == 'since' and re.fullmatch(r'\d+[smhdw]', value):
+            filters['since'] = time.time() - int(value[:-1]) * DURATION_UNITS[value[-1]]
+        elif key == 'page' and value.isdigit() and int(value) > 0:
+            filters['page'] = int(value)
+        else:
+            raise AuditError(f'Invalid filter: {arg}')
+    return filters
+
+
+def format_records(records, total, page=1, page_size=PAGE_SIZE):
+    if not records:
+        return 'No matching audit records.'
+    pages = (total + page_size - 1) // page_size
+    lines = [f'Audit log, page {page}/{pages} ({total} records):']
+    for record in records:
+        when = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.ts))
+        status = {1: 'ok', 0: 'FAILED'}.get(record.ok, '?')
+        details = []
+        if record.exit_code is not None:
+            details.append(f'exit {record.exit_code}')
+        if record.duration is not None:
+            details.append(f'{record.duration:.2f}s')
+        lines.append(
+            f'{when}  @{record.username} ({record.user_id})  /{record.command} {record.args}'.rstrip()
+            + f'  [{status}{", " + ", ".join(details) if details else ""}]'
+        )
+        if record.result:
+            lines.append(f'    {record.result}')
+    if page < pages:
+        lines.append(f'\nNext page: add page={page + 1}')
+    return '\n'.join(lines)
@@ -0,0 +1,67 @@
+"""Show that a slow external command does not delay unrelated work.
+
+Runs a slow command (`sleep`) and, while it is running, measures event loop
+lag with a 10ms heartbeat and the latency of an unrelated fast command from a
+different family. The same is done with a blocking subprocess.check_output for
+comparison. Exits non-zero if the executor lets the slow command delay the
+unrelated work by more than --max-lag.
+"""
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import executor  # noqa: E402
+
+
+async def heartbeat(stop, interval=0.01):
+    worst = 0.0
+    while not stop.is_set():
+        started = time.monotonic()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.monotonic() - started - interval)
+    return worst
+
+
+async def measure(slow, slow_seconds):
+    stop = asyncio.Event()
+    beat = asyncio.create_task(heartbeat(stop))
+    slow_task = asyncio.create_task(slow(slow_seconds))
+    started = time.monotonic()
+    await asyncio.sleep(0.05)
+    await executor.check_output(['true'], family='bench-fast')
+    fast_latency = time.monotonic() - started - 0.05
+    await slow_task
+    stop.set()
+    return await beat, fast_latency
+
+
+async def async_slow(seconds):
+    await executor.check_output(['sleep', str(seconds)], family='bench-slow')
+
+
+async def blocking_slow(seconds):
+    subprocess.check_output(['sleep', str(seconds)])
+
+
+async def main(args):
+    lag, fast = await measure(blocking_slow, args.slow)
+    print(f'blocking subprocess: max loop lag {lag * 1000:.1f}ms, unrelated command latency {fast * 1000:.1f}ms')
+    lag, fast = await measure(async_slow, args.slow)
+    print(f'async executor:      max loop lag {lag * 1000:.1f}ms, unrelated command latency {fast * 1000:.1f}ms')
+    if lag > args.max_lag or fast > args.max_lag:
+        print(f'FAIL: unrelated work delayed by more than {args.max_lag * 1000:.0f}ms')
+        return 1
+    print('OK')
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--slow', type=float, default=1.0, help='duration of the slow command in seconds')
+    parser.add_argument('--max-lag', type=float, default=0.1, help='allowed delay in seconds')
+    sys.exit(asyncio.run(main(parser.parse_args())))
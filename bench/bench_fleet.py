@@ -0,0 +1,158 @@
+"""Measure fleet fan-out latency as the number of hosts grows.
+
+Starts --hosts local fleet_agent.py processes, each with its own fake
+nginx site tree, cpufreq sysfs tree, ufw stub state and in-process fake
+hypervisor, then runs --requests fan-outs of --command to the first N agents
+for every N in --counts. "pooled" reuses one Fleet and its persistent
+connections; "fresh" builds a new Fleet for every request, so each one pays
+for connecting and authenticating to every agent, e.g.:
+
+    python bench/bench_fleet.py --counts 1,4,16,32 --command ufw_status --ufw-latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from bench_load import make_sites, make_sysfs  # noqa: E402
+from bench_webhook import free_port, percentile  # noqa: E402
+from fleet import Fleet, Host, format_results  # noqa: E402
+
+TOKEN = 'bench-token'
+AGENT = os.path.join(BENCH_DIR, '..', 'fleet_agent.py')
+
+
+def start_agent(name, port, workdir, args):
+    root = os.path.join(workdir, name)
+    make_sysfs(os.path.join(root, 'sys'), args.cpus)
+    make_sites(os.path.join(root, 'available'), os.path.join(root, 'enabled'), SimpleNamespace(sites=args.sites))
+    env = dict(
+        os.environ,
+        PATH=os.path.join(BENCH_DIR, 'stubs') + os.pathsep + os.environ['PATH'],
+        FLEET_TOKEN=TOKEN,
+        VM_BACKEND='fake',
+        CPUFREQ_SYSFS_ROOT=os.path.join(root, 'sys'),
+        NGINX_SITES_AVAILABLE=os.path.join(root, 'available'),
+        NGINX_SITES_ENABLED=os.path.join(root, 'enabled'),
+        STUB_UFW_STATE=os.path.join(root, 'ufw.json'),
+        STUB_UFW_LATENCY=str(args.ufw_latency),
+        # Don't let the agents' cached ufw state hide the stub's latency
+        UFW_STATUS_TTL='0',
+    )
+    log = open(os.path.join(root, 'agent.log'), 'w')
+    return subprocess.Popen(
+        [sys.executable, AGENT, '--listen', '127.0.0.1', '--port', str(port), '--name', name],
+        env=env, stdout=log, stderr=subprocess.STDOUT,
+    )
+
+
+def wait_for_port(port, timeout=20):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.05)
+
+
+async def measure(hosts, args, pooled):
+    names = list(hosts)
+    fleet = Fleet(hosts, token=TOKEN, timeout=args.timeout, pool_size=args.pool_size)
+    await fleet.run(names, 'ping')
+    latencies = []
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def one():
+        nonlocal failures
+        async with semaphore:
+            target = fleet if pooled else Fleet(hosts, token=TOKEN, timeout=args.timeout, pool_size=args.pool_size)
+            started = time.perf_counter()
+            results = await target.run(names, args.command, args.args)
+            latencies.append(time.perf_counter() - started)
+            failures += sum(1 for result in results if not result.ok)
+            if not pooled:
+                await target.close()
+            return results
+
+    started = time.perf_counter()
+    results = await asyncio.gather(*(one() for _ in range(args.requests)))
+    elapsed = time.perf_counter() - started
+    await fleet.close()
+    return {
+        'hosts': len(names),
+        'mode': 'pooled' if pooled else 'fresh',
+        'requests': args.requests,
+        'host_failures': failures,
+        'mean_ms': statistics.mean(latencies) * 1000,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p95_ms': percentile(latencies, 95) * 1000,
+        'max_ms': max(latencies) * 1000,
+        'fanouts_per_s': args.requests / elapsed,
+        'reply_bytes': len(format_results(results[-1])),
+    }
+
+
+async def main(args):
+    counts = [int(count) for count in args.counts.split(',')]
+    workdir = tempfile.mkdtemp(prefix='gdc_fleet_')
+    hosts = {}
+    agents = []
+    try:
+        for i in range(max(counts)):
+            name = f'host{i:02d}'
+            port = free_port()
+            hosts[name] = Host(name, '127.0.0.1', port)
+            agents.append(start_agent(name, port, workdir, args))
+        for host in hosts.values():
+            wait_for_port(host.port)
+        print(f'/{args.command} {" ".join(args.args)} x{args.requests}, concurrency {args.concurrency}, pool size {args.pool_size}:')
+        print(f'{"hosts":>5}  {"mode":6}  {"p50 ms":>8}  {"p95 ms":>8}  {"max ms":>8}  {"fan-outs/s":>10}  failures')
+        report = []
+        for count in counts:
+            subset = dict(list(hosts.items())[:count])
+            for pooled in (True, False):
+                row = await measure(subset, args, pooled)
+                report.append(row)
+                print(
+                    f'{row["hosts"]:>5}  {row["mode"]:6}  {row["p50_ms"]:8.2f}  {row["p95_ms"]:8.2f}  '
+                    f'{row["max_ms"]:8.2f}  {row["fanouts_per_s"]:10.1f}  {row["host_failures"]}'
+                )
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+    finally:
+        for agent in agents:
+            agent.terminate()
+        for agent in agents:
+            agent.wait()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--counts', default='1,2,4,8,16', help='comma-separated host counts to measure')
+    parser.add_argument('--command', default='listsites', choices=('ping', 'listsites', 'listensites', 'ufw_status', 'list_vms', 'cpugov'))
+    parser.add_argument('--args', nargs='*', default=[], help='arguments passed to the command')
+    parser.add_argument('--requests', type=int, default=100, help='fan-outs per host count and mode')
+    parser.add_argument('--concurrency', type=int, default=4, help='fan-outs in flight at once')
+    parser.add_argument('--pool-size', type=int, default=2)
+    parser.add_argument('--timeout', type=float, default=10)
+    parser.add_argument('--sites', type=int, default=50, help='nginx sites per host')
+    parser.add_argument('--cpus', type=int, default=8, help='cpufreq policies per host')
+    parser.add_argument('--ufw-latency', type=float, default=0.0, help='simulated seconds per ufw call')
+    parser.add_argument('--output', help='also write the results as JSON to this file')
+    asyncio.run(main(parser.parse_args()))
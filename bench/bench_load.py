@@ -0,0 +1,372 @@
+"""Offline load test of the full handler pipeline.
+
+Feeds synthetic updates through the real Application from gdc_bot, with the
+handlers registered by build_application(), against the fake Telegram server
+in bench/fake_telegram.py. nginx_ensite/nginx_dissite, nginx, systemctl, ufw
+and virsh are the stubs in bench/stubs (each with its own latency), CPU
+governors are read from and written to a fake sysfs tree. Latency is
+measured from the update being handed to Telegram until every handler for
+it has finished, so it includes polling/webhook delivery, the external
+commands and all Bot API calls the handler made.
+
+Every combination of --concurrency and --managers is run and the results are
+printed (or written with --output) as JSON, e.g.:
+
+    python bench/bench_load.py --concurrency 1,8,32 --managers 1,100 \\
+        --virsh-latency 0.05 --ufw-latency 0.2 --output load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from telegram import Update  # noqa: E402
+from telegram.ext import TypeHandler  # noqa: E402
+
+from bench_webhook import free_port, percentile  # noqa: E402
+from fake_telegram import FakeTelegram  # noqa: E402
+
+TOKEN = '123456:load'
+ADMIN_CHAT_ID = 1000
+FIRST_MANAGER_ID = 2000
+OUTSIDER_ID = 999_999
+WEBHOOK_SECRET = 'load-secret'
+GOVERNORS = ('performance', 'powersave', 'schedutil', 'ondemand')
+
+DEFAULT_MIX = (
+    'help=1,list_vms=4,vm_status=3,listsites=3,listensites=2,ufw_status=3,'
+    'ufw_allow=1,ensite=1,dissite=1,cpugov=2,start_vm=1,stop_vm=1,reboot_vm=1'
+)
+
+
+def parse_counts(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+def parse_mix(value):
+    mix = {}
+    for item in filter(None, value.split(',')):
+        command, _, weight = item.partition('=')
+        mix[command.strip()] = float(weight or 1)
+    unknown = set(mix) - set(COMMANDS)
+    if unknown:
+        raise argparse.ArgumentTypeError(f'unknown commands in mix: {", ".join(sorted(unknown))}')
+    return mix
+
+
+# Command name -> function(rng, args) returning the argument string
+COMMANDS = {
+    'help': lambda rng, args: '',
+    'list_vms': lambda rng, args: '',
+    'vm_status': lambda rng, args: ' '.join(rng.sample(vm_names(args), min(3, args.vms))),
+    'start_vm': lambda rng, args: rng.choice(vm_names(args)),
+    'stop_vm': lambda rng, args: rng.choice(vm_names(args)),
+    'reboot_vm': lambda rng, args: rng.choice(vm_names(args)),
+    'listsites': lambda rng, args: rng.choice(('', 'site1', 'site2*')),
+    'listensites': lambda rng, args: '',
+    'ensite': lambda rng, args: rng.choice(site_names(args)),
+    'dissite': lambda rng, args: rng.choice(site_names(args)),
+    'ufw_status': lambda rng, args: rng.choice(('', '22', '80 allow')),
+    'ufw_allow': lambda rng, args: f'{rng.randint(10000, 60000)}/tcp',
+    'ufw_deny': lambda rng, args: f'{rng.randint(10000, 60000)}/tcp',
+    'cpugov': lambda rng, args: rng.choice(('', rng.choice(GOVERNORS), f'{rng.choice(GOVERNORS)} 0-{args.cpus // 2}')),
+}
+
+
+def vm_names(args):
+    return [f'vm{i:03d}' for i in range(args.vms)]
+
+
+def site_names(args):
+    return [f'site{i:03d}' for i in range(args.sites)]
+
+
+def make_sysfs(root, cpus):
+    """A cpufreq tree with one policy per CPU, as on most x86 machines."""
+    for cpu in range(cpus):
+        policy = os.path.join(root, 'cpufreq', f'policy{cpu}')
+        os.makedirs(policy)
+        files = {
+            'affected_cpus': str(cpu),
+            'scaling_governor': 'schedutil',
+            'scaling_available_governors': ' '.join(GOVERNORS),
+            'scaling_cur_freq': '2400000',
+            'scaling_min_freq': '800000',
+            'scaling_max_freq': '4200000',
+        }
+        for name, value in files.items():
+            with open(os.path.join(policy, name), 'w') as f:
+                f.write(value + '\n')
+
+
+def make_sites(available, enabled, sites):
+    os.makedirs(available)
+    os.makedirs(enabled)
+    for i, name in enumerate(site_names(sites)):
+        with open(os.path.join(available, name), 'w') as f:
+            f.write(f'server {{ server_name {name}.example.com; }}\n')
+        if i % 2 == 0:
+            os.symlink(os.path.join(available, name), os.path.join(enabled, name))
+
+
+def make_domains(path, vms):
+    with open(path, 'w') as f:
+        json.dump({name: [1 if i % 3 else 5, 2, 2097152] for i, name in enumerate(vm_names(vms))}, f)
+
+
+def stub_calls(log_path):
+    calls = {}
+    with open(log_path) as f:
+        for line in f:
+            name = line.split(' ', 1)[0]
+            calls[name] = calls.get(name, 0) + 1
+    return calls
+
+
+def summarize(samples):
+    if not samples:
+        return {'count': 0}
+    return {
+        'count': len(samples),
+        'p50_ms': round(percentile(samples, 50) * 1000, 3),
+        'p95_ms': round(percentile(samples, 95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 99) * 1000, 3),
+        'mean_ms': round(statistics.mean(samples) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3),
+    }
+
+
+class Tracker:
+    """Resolves a future per update_id once all of its handlers have run."""
+
+    def __init__(self):
+        self.pending = {}
+        self.errors = 0
+
+    def expect(self, update_id):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[update_id] = future
+        return future
+
+    async def done(self, update, context):
+        future = self.pending.pop(update.update_id, None)
+        if future is not None and not future.done():
+            future.set_result(time.monotonic())
+
+    async def error(self, update, context):
+        self.errors += 1
+
+
+async def drive(fake, tracker, updates, concurrency):
+    """Push updates keeping `concurrency` of them in flight; returns (label, latency) pairs."""
+    queue = list(updates)
+    samples = []
+
+    async def worker():
+        while queue:
+            label, update = queue.pop()
+            finished = tracker.expect(update['update_id'])
+            started = time.monotonic()
+            await fake.push_update(update)
+            samples.append((label, await asyncio.wait_for(finished, 120) - started))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return samples
+
+
+def build_updates(fake, args, rng, senders, count):
+    commands = list(args.mix)
+    weights = [args.mix[command] for command in commands]
+    updates = []
+    for i in range(count):
+        command = rng.choices(commands, weights)[0]
+        text = f'/{command} {COMMANDS[command](rng, args)}'.strip()
+        user_id = OUTSIDER_ID if rng.random() < args.unauthorized else rng.choice(senders)
+        updates.append((command, fake.make_update(text, user_id, chat_id=100_000 + i)))
+    updates.reverse()
+    return updates
+
+
+async def run_one(gdc_bot, fake, args, concurrency, managers, log_path):
+    rng = random.Random(f'{args.seed}:{concurrency}:{managers}')
+    for (user_id,) in gdc_bot.conn.execute('SELECT user_id FROM managers').fetchall():
+        gdc_bot.acl.remove(user_id)
+    for i in range(managers):
+        gdc_bot.acl.add(FIRST_MANAGER_ID + i)
+    senders = [FIRST_MANAGER_ID + i for i in range(managers)] or [ADMIN_CHAT_ID]
+
+    gdc_bot.CONCURRENT_UPDATES = concurrency
+    application = gdc_bot.build_application()
+    tracker = Tracker()
+    application.add_handler(TypeHandler(Update, tracker.done), group=1)
+    application.add_error_handler(tracker.error)
+    await application.initialize()
+    await gdc_bot.post_init(application)
+    if args.mode == 'webhook':
+        port = free_port()
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='telegram',
+            webhook_url=f'http://127.0.0.1:{port}/telegram', secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    try:
+        await drive(fake, tracker, build_updates(fake, args, rng, senders, args.warmup), concurrency)
+        open(log_path, 'w').close()
+        sent_before = len(fake.sent)
+        cache = gdc_bot.result_cache
+        cache_before = (cache.hits, cache.shared, cache.misses)
+        started = time.monotonic()
+        samples = await drive(fake, tracker, build_updates(fake, args, rng, senders, args.updates), concurrency)
+        elapsed = time.monotonic() - started
+        sent = len(fake.sent) - sent_before
+        cache_counts = [after - before for after, before in zip((cache.hits, cache.shared, cache.misses), cache_before)]
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await gdc_bot.post_stop(application)
+        await application.shutdown()
+
+    per_command = {}
+    for label, latency in samples:
+        per_command.setdefault(label, []).append(latency)
+    return {
+        'mode': args.mode,
+        'concurrency': concurrency,
+        'managers': managers,
+        'updates': len(samples),
+        'duration_s': round(elapsed, 3),
+        'updates_per_sec': round(len(samples) / elapsed, 2),
+        **{key: value for key, value in summarize([latency for _, latency in samples]).items() if key != 'count'},
+        'handler_errors': tracker.errors,
+        'bot_api_messages': sent,
+        'stub_calls': stub_calls(log_path),
+        'result_cache': dict(zip(('hits', 'shared', 'misses'), cache_counts)),
+        'commands': {command: summarize(latencies) for command, latencies in sorted(per_command.items())},
+    }
+
+
+async def main(args):
+    workdir = tempfile.mkdtemp(prefix='gdc_load_')
+    stubs = os.path.join(BENCH_DIR, 'stubs')
+    log_path = os.path.join(workdir, 'stub.log')
+    sysfs = os.path.join(workdir, 'sys')
+    available = os.path.join(workdir, 'sites-available')
+    enabled = os.path.join(workdir, 'sites-enabled')
+    make_sysfs(sysfs, args.cpus)
+    make_sites(available, enabled, args)
+    make_domains(os.path.join(workdir, 'virsh.json'), args)
+
+    fake = await FakeTelegram(TOKEN).start()
+    os.environ.update({
+        'YOUR_TELEGRAM_BOT_TOKEN': TOKEN,
+        'ADMIN_CHAT_ID': str(ADMIN_CHAT_ID),
+        'TELEGRAM_API_BASE_URL': fake.base_url,
+        'PATH': stubs + os.pathsep + os.environ['PATH'],
+        'VM_BACKEND': 'virsh',
+        'CPUFREQ_SYSFS_ROOT': sysfs,
+        'NGINX_SITES_AVAILABLE': available,
+        'NGINX_SITES_ENABLED': enabled,
+        'NGINX_RELOAD_DEBOUNCE': str(args.reload_debounce),
+        'PROGRESS_EDIT_INTERVAL': str(args.edit_interval),
+        # The fake server has no flood limits, so don't make shutdown wait
+        # for the notifier to drain its queue at Telegram's pace.
+        'NOTIFY_RATE_PER_MINUTE': '100000',
+        'NOTIFY_BURST': '1000',
+        'RESULT_CACHE_SIZE': '0' if args.no_cache else '256',
+        'STUB_LOG': log_path,
+        'STUB_UFW_STATE': os.path.join(workdir, 'ufw.json'),
+        'STUB_VIRSH_STATE': os.path.join(workdir, 'virsh.json'),
+        'STUB_VIRSH_LATENCY': str(args.virsh_latency),
+        'STUB_UFW_LATENCY': str(args.ufw_latency),
+        'STUB_NGINX_ENSITE_LATENCY': str(args.nginx_latency),
+        'STUB_NGINX_DISSITE_LATENCY': str(args.nginx_latency),
+        'STUB_NGINX_LATENCY': str(args.nginx_latency),
+        'STUB_SYSTEMCTL_LATENCY': str(args.systemctl_latency),
+    })
+    os.chdir(workdir)
+    import gdc_bot
+    logging.getLogger().setLevel(args.log_level)
+
+    results = []
+    try:
+        for managers in args.managers:
+            for concurrency in args.concurrency:
+                result = await run_one(gdc_bot, fake, args, concurrency, managers, log_path)
+                results.append(result)
+                print(
+                    f'concurrency {concurrency:4}  managers {managers:6}  {result["updates_per_sec"]:8.1f} upd/s  '
+                    f'p50 {result["p50_ms"]:8.2f}ms  p95 {result["p95_ms"]:8.2f}ms  p99 {result["p99_ms"]:8.2f}ms',
+                    file=sys.stderr,
+                )
+    finally:
+        await fake.stop()
+
+    report = {
+        'benchmark': 'load',
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'host': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()},
+        'config': {
+            'mode': args.mode,
+            'updates': args.updates,
+            'warmup': args.warmup,
+            'seed': args.seed,
+            'mix': args.mix,
+            'unauthorized': args.unauthorized,
+            'vms': args.vms,
+            'sites': args.sites,
+            'cpus': args.cpus,
+            'latency_s': {
+                'virsh': args.virsh_latency,
+                'ufw': args.ufw_latency,
+                'nginx': args.nginx_latency,
+                'systemctl': args.systemctl_latency,
+            },
+            'reload_debounce_s': args.reload_debounce,
+            'result_cache': not args.no_cache,
+        },
+        'results': results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--mode', choices=('polling', 'webhook'), default='polling')
+    parser.add_argument('--updates', type=int, default=500, help='measured updates per run')
+    parser.add_argument('--warmup', type=int, default=20, help='unmeasured updates before each run')
+    parser.add_argument('--concurrency', type=parse_counts, default=[1, 8, 32], help='comma-separated in-flight update counts')
+    parser.add_argument('--managers', type=parse_counts, default=[1, 100], help='comma-separated manager counts')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help='command weights, e.g. "list_vms=3,ufw_status=1"')
+    parser.add_argument('--unauthorized', type=float, default=0.0, help='fraction of updates sent by a non-manager')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--vms', type=int, default=50)
+    parser.add_argument('--sites', type=int, default=100)
+    parser.add_argument('--cpus', type=int, default=8)
+    parser.add_argument('--virsh-latency', type=float, default=0.02)
+    parser.add_argument('--ufw-latency', type=float, default=0.1)
+    parser.add_argument('--nginx-latency', type=float, default=0.02)
+    parser.add_argument('--systemctl-latency', type=float, default=0.05)
+    parser.add_argument('--reload-debounce', type=float, default=0.2)
+    parser.add_argument('--edit-interval', type=float, default=0.5)
+    parser.add_argument('--no-cache', action='store_true', help='disable the read command result cache')
+    parser.add_argument('--log-level', default='WARNING', help="the bot's log level during the run")
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,69 @@
+"""Count nginx reloads caused by a burst of /ensite and /dissite requests.
+
+Uses the stub binaries in bench/stubs. "before" runs each request the old way
+(change + reload per request), "after" sends the same burst through the
+ReloadScheduler.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import executor  # noqa: E402
+from nginx_reload import ReloadScheduler  # noqa: E402
+
+
+def count_calls(log_path, prefix):
+    with open(log_path) as f:
+        return sum(1 for line in f if line.startswith(prefix))
+
+
+async def before(requests):
+    async def one(i):
+        action = 'nginx_ensite' if i % 2 == 0 else 'nginx_dissite'
+        await executor.check_output([action, f'site{i}'], family='nginx')
+        await executor.check_output(['systemctl', 'reload', 'nginx'], family='nginx')
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+async def after(requests, debounce):
+    scheduler = ReloadScheduler(debounce=debounce)
+
+    async def one(i):
+        await asyncio.sleep(i * 0.01)
+        await scheduler.submit([('ensite' if i % 2 == 0 else 'dissite', f'site{i}')])
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+
+
+async def run(label, coro, log_path):
+    open(log_path, 'w').close()
+    started = time.monotonic()
+    await coro
+    elapsed = time.monotonic() - started
+    print(f'{label:7} reloads: {count_calls(log_path, "systemctl reload"):3}  '
+          f'nginx -t: {count_calls(log_path, "nginx -t"):3}  wall time: {elapsed:.2f}s')
+
+
+async def main(args):
+    os.environ['PATH'] = os.path.join(BENCH_DIR, 'stubs') + os.pathsep + os.environ['PATH']
+    os.environ['STUB_LATENCY'] = str(args.latency)
+    with tempfile.NamedTemporaryFile(suffix='.log') as log:
+        os.environ['STUB_LOG'] = log.name
+        print(f'Burst of {args.requests} requests, {args.latency}s per command:')
+        await run('before', before(args.requests), log.name)
+        await run('after', after(args.requests, args.debounce), log.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per stub command')
+    parser.add_argument('--debounce', type=float, default=0.5)
+    asyncio.run(main(parser.parse_args()))
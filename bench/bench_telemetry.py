@@ -0,0 +1,79 @@
+"""Measure the CPU cost of one host telemetry sample.
+
+Samples the real /proc (or --proc-root) back to back and reports CPU time
+per sample, then replays a CPU spike through a fixture /proc tree to show
+when threshold alerts fire and clear.
+"""
+import argparse
+import logging
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telemetry import HostSampler, format_stats  # noqa: E402
+
+MEMINFO = 'MemTotal: 16000000 kB\nMemFree: 8000000 kB\nMemAvailable: 12000000 kB\nSwapTotal: 0 kB\nSwapFree: 0 kB\n'
+
+
+def write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def make_proc(root, cpus):
+    write(os.path.join(root, 'meminfo'), MEMINFO)
+    write(os.path.join(root, 'loadavg'), f'{cpus / 4:.2f} 0.50 0.25 1/300 4242\n')
+    write(os.path.join(root, 'stat'), 'cpu  0 0 0 0 0 0 0 0 0 0\n')
+
+
+def measure(args):
+    sampler = HostSampler(args.proc_root, args.sysfs_root, interval=1, history=args.samples)
+    sampler.open()
+    started = time.monotonic()
+    for _ in range(args.samples):
+        sampler.sample()
+    elapsed = time.monotonic() - started
+    sampler.close()
+    per_sample = sampler.cost / args.samples
+    print(f'{args.samples} samples of {args.proc_root}: {per_sample * 1e6:.1f}µs CPU, '
+          f'{elapsed / args.samples * 1e6:.1f}µs wall per sample')
+    print(f'At a {args.interval:g}s interval that is {per_sample / args.interval:.5%} of one CPU.')
+
+
+def replay_spike(args):
+    alerts = []
+    with tempfile.TemporaryDirectory() as root:
+        make_proc(root, 8)
+        sampler = HostSampler(root, root, interval=args.interval, history=360,
+                              thresholds={'cpu': 90}, sustain=3 * args.interval,
+                              on_alert=lambda text: alerts.append(text))
+        sampler.open()
+        busy = idle = 0
+        # 10 quiet samples, 6 at 95% busy, then quiet again
+        for tick in range(24):
+            load = 95 if 10 <= tick < 16 else 10
+            busy += load
+            idle += 100 - load
+            write(os.path.join(root, 'stat'), f'cpu  {busy} 0 0 {idle} 0 0 0 0 0 0\n')
+            sampler.sample()
+            while alerts:
+                print(f'sample {tick:2}: {alerts.pop(0)}')
+        sampler.close()
+        print()
+        print(format_stats(sampler))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--samples', type=int, default=10000)
+    parser.add_argument('--interval', type=float, default=5, help='sampling interval to express the cost against')
+    parser.add_argument('--proc-root', default='/proc')
+    parser.add_argument('--sysfs-root', default='/sys/devices/system/cpu')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)
+    measure(args)
+    print()
+    replay_spike(args)
@@ -0,0 +1,72 @@
+"""Measure ufw throughput offline with the stub ufw in bench/stubs.
+
+"before" opens each port with its own `ufw allow` call, as /ufw_allow did;
+"after" sends the same ports through Firewall.apply, which batches them into
+multiport rules. Status lookups are compared the same way: a raw `ufw status`
+per request versus the parsed, cached model.
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+
+import executor  # noqa: E402
+from firewall import Firewall  # noqa: E402
+
+
+def count_calls(log_path):
+    with open(log_path) as f:
+        return sum(1 for _ in f)
+
+
+async def measure(label, coro_fn, log_path, state_path):
+    open(log_path, 'w').close()
+    open(state_path, 'w').close()
+    started = time.monotonic()
+    await coro_fn()
+    elapsed = time.monotonic() - started
+    print(f'{label:16} ufw calls: {count_calls(log_path):4}  wall time: {elapsed:.2f}s')
+
+
+async def main(args):
+    os.environ['PATH'] = os.path.join(BENCH_DIR, 'stubs') + os.pathsep + os.environ['PATH']
+    os.environ['STUB_LATENCY'] = str(args.latency)
+    ports = [str(8000 + i) for i in range(args.ports)]
+
+    async def allow_before():
+        for port in ports:
+            await executor.check_output(['ufw', 'allow', f'{port}/tcp'], family='ufw')
+
+    async def allow_after():
+        await Firewall().apply('allow', [','.join(ports) + '/tcp'])
+
+    async def status_before():
+        for _ in range(args.lookups):
+            await executor.check_output(['ufw', 'status'], family='ufw')
+
+    async def status_after():
+        firewall = Firewall()
+        for _ in range(args.lookups):
+            await firewall.rules(port=8000)
+
+    with tempfile.NamedTemporaryFile(suffix='.log') as log, tempfile.NamedTemporaryFile(suffix='.json') as state:
+        os.environ['STUB_LOG'] = log.name
+        os.environ['STUB_UFW_STATE'] = state.name
+        print(f'{args.ports} ports, {args.lookups} status lookups, {args.latency}s per ufw call:')
+        await measure('allow before', allow_before, log.name, state.name)
+        await measure('allow after', allow_after, log.name, state.name)
+        await measure('status before', status_before, log.name, state.name)
+        await measure('status after', status_after, log.name, state.name)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--ports', type=int, default=60)
+    parser.add_argument('--lookups', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated seconds per ufw call')
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+"""Time /list_vms and /vm_status backend calls without a real hypervisor.
+
+By default this uses the in-process fake backend with --domains domains; pass
+--backend virsh or --backend libvirt to compare against a real host.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import vm_backend  # noqa: E402
+
+
+async def timed(coro_fn, iterations):
+    samples = []
+    for _ in range(iterations):
+        started = time.perf_counter()
+        await coro_fn()
+        samples.append(time.perf_counter() - started)
+    return statistics.median(samples) * 1000, max(samples) * 1000
+
+
+async def main(args):
+    if args.backend == 'fake':
+        domains = [vm_backend.DomainInfo(f'vm{i:04d}', vm_backend.STATE_RUNNING, 2, 2097152) for i in range(args.domains)]
+        backend = vm_backend.FakeBackend(domains)
+    else:
+        backend = vm_backend.create_backend(args.backend)
+    names = [dom.name for dom in await backend.list_domains()]
+    if not names:
+        print('No domains found.')
+        return 1
+
+    async def list_vms():
+        vm_backend.format_domain_table(await backend.list_domains())
+
+    async def vm_status():
+        vm_backend.format_domain_info(await backend.domain_info(names[0]))
+
+    for label, coro_fn in (('list_vms', list_vms), ('vm_status', vm_status)):
+        median, worst = await timed(coro_fn, args.iterations)
+        print(f'{backend.name:8} {label:10} {len(names)} domains: median {median:.2f}ms, max {worst:.2f}ms')
+    await backend.close()
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--backend', default='fake', choices=('fake', 'virsh', 'libvirt'))
+    parser.add_argument('--domains', type=int, default=500, help='number of fake domains')
+    parser.add_argument('--iterations', type=int, default=50)
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,117 @@
+"""Compare update latency between polling and webhook mode.
+
+Runs the real Application from gdc_bot against the local fake Telegram server
+in bench/fake_telegram.py and measures the time from an update being made
+available to Telegram until the bot's reply arrives back at it.
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..'))
+sys.path.insert(0, BENCH_DIR)
+
+from fake_telegram import FakeTelegram  # noqa: E402
+
+TOKEN = '123456:bench'
+ADMIN_CHAT_ID = 1000
+WEBHOOK_SECRET = 'bench-secret'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+async def drive(fake, updates, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def one(i):
+        async with semaphore:
+            chat_id = 10_000 + i
+            reply = fake.expect_reply(chat_id)
+            started = loop.time()
+            await fake.push_update(fake.make_update('/help', ADMIN_CHAT_ID, chat_id))
+            return await asyncio.wait_for(reply, 30) - started
+
+    return await asyncio.gather(*(one(i) for i in range(updates)))
+
+
+async def run_mode(gdc_bot, fake, mode, args):
+    application = gdc_bot.build_application()
+    await application.initialize()
+    await gdc_bot.post_init(application)
+    if mode == 'webhook':
+        port = free_port()
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=port, url_path='telegram',
+            webhook_url=f'http://127.0.0.1:{port}/telegram', secret_token=WEBHOOK_SECRET,
+        )
+    else:
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    await application.start()
+    try:
+        await drive(fake, 5, 1)
+        samples = await drive(fake, args.updates, args.concurrency)
+        if mode == 'webhook':
+            rejected = await fake._client.post(
+                fake.webhook_url, json=fake.make_update('/help', ADMIN_CHAT_ID), headers={'X-Telegram-Bot-Api-Secret-Token': 'wrong'}
+            )
+            if rejected.status_code != 403:
+                raise SystemExit(f'Webhook accepted an update with a wrong secret token ({rejected.status_code})')
+    finally:
+        await application.updater.stop()
+        await application.stop()
+        await gdc_bot.post_stop(application)
+        await application.shutdown()
+    return {
+        'mode': mode,
+        'updates': args.updates,
+        'concurrency': args.concurrency,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p95_ms': percentile(samples, 95) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'mean_ms': statistics.mean(samples) * 1000,
+    }
+
+
+async def main(args):
+    fake = await FakeTelegram(TOKEN).start()
+    os.environ.update({
+        'YOUR_TELEGRAM_BOT_TOKEN': TOKEN,
+        'ADMIN_CHAT_ID': str(ADMIN_CHAT_ID),
+        'TELEGRAM_API_BASE_URL': fake.base_url,
+        'VM_BACKEND': 'fake',
+        'CONCURRENT_UPDATES': str(args.concurrency),
+    })
+    os.chdir(tempfile.mkdtemp(prefix='gdc_bench_'))
+    import gdc_bot
+    results = []
+    try:
+        for mode in ('polling', 'webhook'):
+            result = await run_mode(gdc_bot, fake, mode, args)
+            results.append(result)
+            print(f'{mode:8} p50 {result["p50_ms"]:7.2f}ms  p95 {result["p95_ms"]:7.2f}ms  p99 {result["p99_ms"]:7.2f}ms', file=sys.stderr)
+    finally:
+        await fake.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--updates', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,191 @@
+"""A minimal local stand-in for the Telegram Bot API.
+
+Serves just enough of the API for the bot to run against it: getMe,
+getUpdates (long polling), setWebhook/deleteWebhook, sendMessage,
+editMessageText and sendDocument. Updates are injected with push_update();
+when a webhook is set they are POSTed to it with the secret token header,
+otherwise they are handed out through getUpdates. Every reply the bot sends
+is recorded with its arrival time so benchmarks can measure end-to-end
+latency.
+"""
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import time
+import urllib.parse
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'gdc', 'username': 'gdc_bot'}
+
+
+def _parse_body(headers, body):
+    content_type = headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        message = email.parser.BytesParser(policy=email.policy.HTTP).parsebytes(
+            b'Content-Type: ' + content_type.encode() + b'\r\n\r\n' + body
+        )
+        params = {}
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            payload = part.get_payload(decode=True) or b''
+            params[name] = payload if part.get_filename() else payload.decode()
+        return params
+    params = dict(urllib.parse.parse_qsl(body.decode()))
+    for key, value in params.items():
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            pass
+    return params
+
+
+class FakeTelegram:
+    def __init__(self, token, host='127.0.0.1', port=0):
+        self.token = token
+        self.host = host
+        self.port = port
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.sent = []
+        self.calls = {}
+        self._updates = []
+        self._new_update = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._waiters = {}
+        self._server = None
+        self._client = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._client = httpx.AsyncClient(timeout=30)
+        return self
+
+    async def stop(self):
+        self._server.close()
+        await self._server.wait_closed()
+        await self._client.aclose()
+
+    def make_update(self, text, user_id, chat_id=None, username='bench'):
+        command = text.split()[0]
+        return {
+            'update_id': next(self._update_ids),
+            'message': {
+                'message_id': next(self._message_ids),
+                'date': int(time.time()),
+                'chat': {'id': chat_id or user_id, 'type': 'private'},
+                'from': {'id': user_id, 'is_bot': False, 'first_name': username, 'username': username},
+                'text': text,
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}] if command.startswith('/') else [],
+            },
+        }
+
+    def expect_reply(self, chat_id):
+        """Future resolved with the arrival time of the next message sent to chat_id."""
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(chat_id, []).append(future)
+        return future
+
+    async def push_update(self, update):
+        if self.webhook_url:
+            headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret or ''}
+            response = await self._client.post(self.webhook_url, json=update, headers=headers)
+            response.raise_for_status()
+        else:
+            self._updates.append(update)
+            self._new_update.set()
+
+    async def _get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates:
+            self._new_update.clear()
+            try:
+                await asyncio.wait_for(self._new_update.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get('limit') or 100)]
+
+    def _message(self, chat_id, **fields):
+        return {'message_id': next(self._message_ids), 'date': int(time.time()), 'chat': {'id': int(chat_id), 'type': 'private'}, **fields}
+
+    def _record(self, method, params):
+        received = time.monotonic()
+        chat_id = int(params.get('chat_id', 0))
+        self.sent.append((received, method, params))
+        for future in self._waiters.pop(chat_id, [])[:1]:
+            if not future.done():
+                future.set_result(received)
+
+    async def _dispatch(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return await self._get_updates(params)
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_secret = params.get('secret_token')
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method == 'getWebhookInfo':
+            return {'url': self.webhook_url or '', 'has_custom_certificate': False, 'pending_update_count': 0}
+        if method == 'sendMessage':
+            self._record(method, params)
+            return self._message(params['chat_id'], text=params.get('text', ''))
+        if method == 'editMessageText':
+            self._record(method, params)
+            return self._message(params['chat_id'], text=params.get('text', ''))
+        if method == 'sendDocument':
+            self._record(method, params)
+            document = params.get('document', b'')
+            return self._message(params['chat_id'], document={'file_id': 'fake', 'file_unique_id': 'fake', 'file_size': len(document)})
+        return True
+
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                _, path, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode().partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = path.rstrip('/').rsplit('/', 1)[-1]
+                try:
+                    result = {'ok': True, 'result': await self._dispatch(method, _parse_body(headers, body))}
+                except Exception as e:
+                    logger.exception(f'Fake Telegram failed to handle {method}')
+                    result = {'ok': False, 'error_code': 400, 'description': str(e)}
+                payload = json.dumps(result).encode()
+                writer.write(
+                    b'HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n'
+                    + f'Content-Length: {len(payload)}\r\n\r\n'.encode()
+                    + payload
+                )
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            writer.close()
@@ -0,0 +1,133 @@
+import asyncio
+import functools
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+HIT = 'hit'
+MISS = 'miss'
+SHARED = 'shared'
+
+
+def _retrieve(future):
+    # Mark the exception as retrieved when nobody else was waiting for it
+    if not future.cancelled():
+        future.exception()
+
+
+class ResultCache:
+    """Single-flight LRU cache of read command results with a TTL per command.
+
+    Keys are tuples starting with the command name. Concurrent get() calls
+    for the same key share one loader, run in a task of its own so that
+    cancelling any caller, including the one that started it, leaves the
+    others waiting for the result. Results are kept for the
+    command's TTL, at most `maxsize` of them. invalidate() drops a command's
+    entries and makes loads already running when it was called not store
+    their (possibly stale) result. maxsize=0 disables caching altogether.
+    """
+
+    def __init__(self, maxsize=256, ttls=None, default_ttl=5.0):
+        self.maxsize = maxsize
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self.shared = 0
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._generations = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def ttl(self, command):
+        return self.ttls.get(command, self.default_ttl)
+
+    async def get(self, key, loader, refresh=False):
+        """Return (value, status, age) where status is HIT, MISS or SHARED."""
+        if self.maxsize <= 0:
+            self.misses += 1
+            return await loader(), MISS, 0.0
+        command = key[0]
+        if not refresh:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = time.monotonic() - entry[1]
+                if age <= self.ttl(command):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], HIT, age
+                del self._entries[key]
+            future = self._inflight.get(key)
+            if future is not None:
+                self.shared += 1
+                return await asyncio.shield(future), SHARED, 0.0
+
+        self.misses += 1
+        task = asyncio.ensure_future(self._load(key, loader, self._generations.get(command, 0)))
+        task.add_done_callback(_retrieve)
+        self._inflight[key] = task
+        return await asyncio.shield(task), MISS, 0.0
+
+    async def _load(self, key, loader, generation):
+        try:
+            value = await loader()
+        finally:
+            if self._inflight.get(key) is asyncio.current_task():
+                del self._inflight[key]
+        if self._generations.get(key[0], 0) == generation:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def invalidate(self, *commands):
+        for command in commands:
+            self._generations[command] = self._generations.get(command, 0) + 1
+            self._inflight = {key: future for key, future in self._inflight.items() if key[0] != command}
+        stale = [key for key in self._entries if key[0] in commands]
+        for key in stale:
+            del self._entries[key]
+        if stale:
+            logger.debug(f'Invalidated {len(stale)} cached results for {", ".join(commands)}.')
+
+    def invalidating(self, commands, callback):
+        """Wrap a mutating handler so it invalidates `commands` before and after it runs."""
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            self.invalidate(*commands)
+            try:
+                return await callback(update, context)
+            finally:
+                self.invalidate(*commands)
+        return wrapper
+
+    def format_stats(self):
+        lookups = self.hits + self.shared + self.misses
+        served = f'{(self.hits + self.shared) / lookups:.0%}' if lookups else '-'
+        return (
+            f'Result cache: {len(self)}/{self.maxsize} entries, {self.hits} hits, '
+            f'{self.shared} shared, {self.misses} misses ({served} served without a new run)'
+        )
+
+
+def format_marker(status, age):
+    if status == HIT:
+        return f'[cache hit, {age:.1f}s old]'
+    if status == SHARED:
+        return '[cache shared with a concurrent request]'
+    return '[cache miss]'
+
+
+def parse_ttls(text):
+    """Parse e.g. "list_vms=10,ufw_status=5" into {command: seconds}."""
+    ttls = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        command, _, seconds = item.partition('=')
+        ttls[command.strip()] = float(seconds)
+    return ttls
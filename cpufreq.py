@@ -0,0 +1,158 @@
+import asyncio
+import glob
+import logging
+import os
+import re
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+SYSFS_CPU_ROOT = '/sys/devices/system/cpu'
+
+# Frequencies are in kHz, as exposed by sysfs; None when the file is missing
+Policy = namedtuple('Policy', 'name cpus governor available_governors cur_freq min_freq max_freq')
+
+
+class CpufreqError(Exception):
+    pass
+
+
+def parse_cpu_list(text):
+    """Parse a cpu list such as "0-15,32,34-35" into a set of cpu numbers."""
+    cpus = set()
+    for part in filter(None, (part.strip() for part in text.replace(' ', ',').split(','))):
+        match = re.fullmatch(r'(\d+)(?:-(\d+))?', part)
+        if not match:
+            raise CpufreqError(f'Invalid CPU list: {text}')
+        first = int(match.group(1))
+        last = int(match.group(2) or first)
+        if last < first:
+            raise CpufreqError(f'Invalid CPU range: {part}')
+        cpus.update(range(first, last + 1))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ','.join(str(first) if first == last else f'{first}-{last}' for first, last in ranges)
+
+
+def _read(path, default=None):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return default
+
+
+def _read_int(path):
+    value = _read(path)
+    return int(value) if value and value.isdigit() else None
+
+
+def _policy_number(path):
+    return int(re.search(r'(\d+)$', path).group(1))
+
+
+class Cpufreq:
+    """Reads and writes cpufreq policies straight from sysfs.
+
+    Works per policy (cpufreq/policyN), so cores sharing a policy are handled
+    with a single write. `root` can point at a fake sysfs tree for tests.
+    """
+
+    def __init__(self, root=SYSFS_CPU_ROOT):
+        self.root = root
+
+    def _policy_dirs(self):
+        return sorted(glob.glob(os.path.join(self.root, 'cpufreq', 'policy*')), key=_policy_number)
+
+    def _read_policy(self, path):
+        cpus = _read(os.path.join(path, 'affected_cpus')) or _read(os.path.join(path, 'related_cpus'), '')
+        return Policy(
+            os.path.basename(path),
+            frozenset(parse_cpu_list(cpus)),
+            _read(os.path.join(path, 'scaling_governor'), 'unknown'),
+            tuple((_read(os.path.join(path, 'scaling_available_governors')) or '').split()),
+            _read_int(os.path.join(path, 'scaling_cur_freq')),
+            _read_int(os.path.join(path, 'scaling_min_freq')),
+            _read_int(os.path.join(path, 'scaling_max_freq')),
+        )
+
+    def policies(self, cpus=None):
+        policies = [self._read_policy(path) for path in self._policy_dirs()]
+        if not policies:
+            raise CpufreqError(f'No cpufreq policies found under {self.root}')
+        if cpus is not None:
+            policies = [policy for policy in policies if policy.cpus & cpus]
+            if not policies:
+                raise CpufreqError(f'No cpufreq policy covers CPUs {format_cpu_list(cpus)}')
+        return policies
+
+    def set_governor(self, governor, cpus=None):
+        """Set `governor` on every policy covering `cpus` (all if None)."""
+        policies = self.policies(cpus)
+        for policy in policies:
+            if policy.available_governors and governor not in policy.available_governors:
+                raise CpufreqError(
+                    f'Governor {governor} is not available on {policy.name}. '
+                    f'Available: {" ".join(policy.available_governors)}'
+                )
+        for policy in policies:
+            if policy.governor == governor:
+                continue
+            path = os.path.join(self.root, 'cpufreq', policy.name, 'scaling_governor')
+            try:
+                with open(path, 'w') as f:
+                    f.write(governor)
+            except OSError as e:
+                raise CpufreqError(f'Failed to set governor on {policy.name}: {e}') from e
+        logger.info(f'Set governor {governor} on {len(policies)} cpufreq policies.')
+        return self.policies(cpus)
+
+    async def policies_async(self, cpus=None):
+        return await asyncio.to_thread(self.policies, cpus)
+
+    async def set_governor_async(self, governor, cpus=None):
+        return await asyncio.to_thread(self.set_governor, governor, cpus)
+
+
+def _mhz(khz):
+    return '?' if khz is None else str(khz // 1000)
+
+
+def _mhz_range(values):
+    values = [value for value in values if value is not None]
+    if not values:
+        return '?'
+    low, high = min(values), max(values)
+    return _mhz(low) if low == high else f'{_mhz(low)}-{_mhz(high)}'
+
+
+def format_policies(policies):
+    """Table with one row per run of policies sharing governor and limits."""
+    groups = []
+    for policy in policies:
+        key = (policy.governor, policy.min_freq, policy.max_freq)
+        if groups and groups[-1][0] == key:
+            groups[-1][1].append(policy)
+        else:
+            groups.append((key, [policy]))
+    rows = [('CPUs', 'Governor', 'Cur MHz', 'Min-Max MHz')]
+    for (governor, min_freq, max_freq), members in groups:
+        cpus = set().union(*(policy.cpus for policy in members))
+        rows.append((
+            format_cpu_list(cpus),
+            governor,
+            _mhz_range(policy.cur_freq for policy in members),
+            f'{_mhz(min_freq)}-{_mhz(max_freq)}',
+        ))
+    widths = [max(len(row[i]) for row in rows) for i in range(3)]
+    return '\n'.join(
+        f'{row[0]:<{widths[0]}}  {row[1]:<{widths[1]}}  {row[2]:<{widths[2]}}  {row[3]}' for row in rows
+    )
@@ -0,0 +1,140 @@
+import asyncio
+import io
+import logging
+import os
+import time
+
+from telegram import InputFile
+from telegram.error import BadRequest, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+# Replies longer than this are sent as a text file instead of many messages
+DOCUMENT_THRESHOLD = int(os.getenv('DOCUMENT_THRESHOLD', '12000'))
+# Minimum seconds between edits of a progress message
+EDIT_INTERVAL = float(os.getenv('PROGRESS_EDIT_INTERVAL', '2'))
+
+
+def paginate(text, limit=MESSAGE_LIMIT):
+    """Split text into pages of at most `limit` characters at line boundaries."""
+    pages = []
+    current = []
+    size = 0
+    for line in text.split('\n'):
+        while len(line) > limit:
+            if current:
+                pages.append('\n'.join(current))
+                current, size = [], 0
+            pages.append(line[:limit])
+            line = line[limit:]
+        if current and size + 1 + len(line) > limit:
+            pages.append('\n'.join(current))
+            current, size = [], 0
+        size += len(line) + (1 if current else 0)
+        current.append(line)
+    if current:
+        pages.append('\n'.join(current))
+    return [page for page in pages if page.strip()] or [text[:limit] or '(empty)']
+
+
+async def reply_long(message, text, filename='output.txt'):
+    """Reply with text split into pages, or as a document above DOCUMENT_THRESHOLD."""
+    if len(text) > DOCUMENT_THRESHOLD:
+        caption = text.split('\n', 1)[0][:1024]
+        document = InputFile(io.BytesIO(text.encode()), filename=filename)
+        return [await message.reply_document(document=document, caption=caption)]
+    return [await message.reply_text(page) for page in paginate(text)]
+
+
+def _tail(text, limit):
+    if len(text) <= limit:
+        return text
+    text = text[-limit:]
+    newline = text.find('\n')
+    return text[newline + 1:] if 0 <= newline < len(text) - 1 else text
+
+
+class ProgressMessage:
+    """A single status message that is edited as an operation progresses.
+
+    Output fed in with feed() (e.g. as executor's on_output callback) is
+    shown as a rolling tail. Edits are throttled to one per EDIT_INTERVAL
+    seconds; finish() does the final edit and pages any overflow.
+    """
+
+    def __init__(self, message, title, interval=EDIT_INTERVAL):
+        self.title = title
+        self.interval = interval
+        self._message = message
+        self._status = ''
+        self._output = ''
+        self._rendered = None
+        self._last_edit = 0.0
+        self._dirty = asyncio.Event()
+        self._task = None
+
+    @classmethod
+    async def start(cls, reply_to, title):
+        progress = cls(None, title)
+        progress._message = await reply_to.reply_text(progress._render())
+        progress._rendered = progress._render()
+        progress._last_edit = time.monotonic()
+        progress._task = asyncio.create_task(progress._run())
+        return progress
+
+    def status(self, text):
+        self._status = text
+        self._dirty.set()
+
+    def feed(self, stream, text):
+        self._output = _tail(self._output + text, MESSAGE_LIMIT)
+        self._dirty.set()
+
+    def _render(self):
+        # Never exceed MESSAGE_LIMIT, or every edit would be rejected
+        head = f'{self.title}\n{self._status}'.rstrip()
+        if len(head) > MESSAGE_LIMIT:
+            head = head[:MESSAGE_LIMIT - 2].rstrip() + '\n…'
+        room = MESSAGE_LIMIT - len(head) - 2
+        if not self._output or room <= 0:
+            return head
+        return f'{head}\n\n{_tail(self._output, room)}'
+
+    async def _edit(self, text):
+        if text == self._rendered:
+            return
+        try:
+            await self._message.edit_text(text)
+        except RetryAfter as e:
+            retry_after = e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+            await asyncio.sleep(retry_after)
+            await self._message.edit_text(text)
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                raise
+        self._rendered = text
+        self._last_edit = time.monotonic()
+
+    async def _run(self):
+        while True:
+            await self._dirty.wait()
+            await asyncio.sleep(max(0.0, self._last_edit + self.interval - time.monotonic()))
+            self._dirty.clear()
+            try:
+                await self._edit(self._render())
+            except Exception as e:
+                logger.warning(f'Failed to update progress message: {e}')
+
+    async def finish(self, text):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        pages = paginate(text)
+        await self._edit(pages[0])
+        for page in pages[1:]:
+            await self._message.reply_text(page)
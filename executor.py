@@ -0,0 +1,187 @@
+import asyncio
+import codecs
+import logging
+import os
+import signal
+import subprocess
+import time
+from collections import Counter
+
+import audit
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Default timeout (seconds) for any external command
+DEFAULT_TIMEOUT = float(os.getenv('COMMAND_TIMEOUT', '60'))
+
+# Max number of concurrently running processes per command family.
+# Override with e.g. COMMAND_LIMITS="virsh=16,ufw=1"
+FAMILY_LIMITS = {
+    'nginx': 1,
+    'ufw': 1,
+    'cpugov': 1,
+    'virsh': 8,
+    'default': 4,
+}
+
+# Per-family timeouts (seconds). Override with e.g. COMMAND_TIMEOUTS="virsh=300"
+FAMILY_TIMEOUTS = {
+    'virsh': 120,
+}
+
+READ_CHUNK_SIZE = 4096
+# How long to wait for a killed process group to exit and its output to end;
+# a child that left the group can hold the pipes open indefinitely
+KILL_READ_TIMEOUT = 2.0
+
+
+def _parse_overrides(value, cast):
+    overrides = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        key, _, raw = item.partition('=')
+        overrides[key.strip()] = cast(raw)
+    return overrides
+
+
+FAMILY_LIMITS.update(_parse_overrides(os.getenv('COMMAND_LIMITS', ''), int))
+FAMILY_TIMEOUTS.update(_parse_overrides(os.getenv('COMMAND_TIMEOUTS', ''), float))
+
+_semaphores = {}
+# Processes started per family since startup
+spawned = Counter()
+
+
+class CommandTimeout(subprocess.CalledProcessError):
+    def __init__(self, cmd, timeout, output=b'', stderr=b''):
+        super().__init__(-signal.SIGKILL, cmd, output=output, stderr=stderr)
+        self.timeout = timeout
+
+    def __str__(self):
+        return f"Command '{' '.join(self.cmd)}' timed out after {self.timeout:g} seconds"
+
+
+class CommandResult:
+    __slots__ = ('args', 'returncode', 'stdout', 'stderr', 'duration')
+
+    def __init__(self, args, returncode, stdout, stderr, duration):
+        self.args = args
+        self.returncode = returncode
+        self.stdout = stdout
+        self.stderr = stderr
+        self.duration = duration
+
+    def check_returncode(self):
+        if self.returncode:
+            raise subprocess.CalledProcessError(self.returncode, self.args, output=self.stdout, stderr=self.stderr)
+
+
+def _semaphore(family):
+    sem = _semaphores.get(family)
+    if sem is None:
+        limit = FAMILY_LIMITS.get(family, FAMILY_LIMITS['default'])
+        sem = _semaphores[family] = asyncio.Semaphore(limit)
+    return sem
+
+
+async def _read_stream(stream, name, chunks, on_output):
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    while True:
+        chunk = await stream.read(READ_CHUNK_SIZE)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        if on_output is not None:
+            text = decoder.decode(chunk)
+            if text:
+                on_output(name, text)
+
+
+def _kill(proc):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+async def _kill_and_wait(proc, *readers):
+    """Kill the process group, then wait a bounded time for it to exit and for `readers`.
+
+    proc.wait() only returns once the pipes are closed, so both are cancelled
+    when KILL_READ_TIMEOUT expires.
+    """
+    _kill(proc)
+    try:
+        await asyncio.wait_for(asyncio.gather(proc.wait(), *readers), KILL_READ_TIMEOUT)
+    except asyncio.TimeoutError:
+        logger.warning(f'Output of process {proc.pid} still open {KILL_READ_TIMEOUT:g}s after the kill, stopped reading.')
+        # asyncio.subprocess.Process has no public way to drop its pipes
+        proc._transport.close()
+
+
+async def run(args, family=None, timeout=None, on_output=None, input=None):
+    """Run a command without blocking the event loop.
+
+    Processes in the same family share a concurrency limit. stdout/stderr are
+    read incrementally and, if given, passed to on_output(stream_name, text) as
+    they arrive. On timeout the whole process group is killed and
+    CommandTimeout is raised.
+    """
+    args = [str(arg) for arg in args]
+    family = family or os.path.basename(args[0])
+    if timeout is None:
+        timeout = FAMILY_TIMEOUTS.get(family, DEFAULT_TIMEOUT)
+    async with _semaphore(family):
+        with metrics.phase('exec'):
+            started = time.monotonic()
+            logger.debug(f'Running {args} (family: {family}, timeout: {timeout}s).')
+            spawned[family] += 1
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                start_new_session=True,
+            )
+            stdout, stderr = [], []
+            readers = asyncio.gather(
+                _read_stream(proc.stdout, 'stdout', stdout, on_output),
+                _read_stream(proc.stderr, 'stderr', stderr, on_output),
+            )
+            try:
+                if input is not None:
+                    proc.stdin.write(input)
+                    await proc.stdin.drain()
+                    proc.stdin.close()
+                await asyncio.wait_for(asyncio.shield(readers), timeout)
+                await asyncio.wait_for(proc.wait(), max(timeout - (time.monotonic() - started), 0.1))
+            except asyncio.TimeoutError:
+                await _kill_and_wait(proc, readers)
+                logger.error(f'Command {args} timed out after {timeout}s, killed.')
+                metrics.record_process(family, 'timeout', sum(map(len, stdout)) + sum(map(len, stderr)))
+                audit.record_exit(-signal.SIGKILL)
+                raise CommandTimeout(args, timeout, output=b''.join(stdout), stderr=b''.join(stderr))
+            except BaseException:
+                await _kill_and_wait(proc, readers)
+                raise
+            duration = time.monotonic() - started
+            logger.debug(f'Command {args} exited with {proc.returncode} in {duration:.3f}s.')
+            metrics.record_process(family, proc.returncode, sum(map(len, stdout)) + sum(map(len, stderr)))
+            audit.record_exit(proc.returncode)
+            return CommandResult(args, proc.returncode, b''.join(stdout), b''.join(stderr), duration)
+
+
+async def check_output(args, family=None, timeout=None, on_output=None, input=None):
+    """Async equivalent of subprocess.check_output."""
+    result = await run(args, family=family, timeout=timeout, on_output=on_output, input=input)
+    result.check_returncode()
+    return result.stdout
+
+
+def error_text(e):
+    if isinstance(e, CommandTimeout):
+        return str(e)
+    if isinstance(e, subprocess.CalledProcessError):
+        text = (e.stderr or b'').decode(errors='replace').strip() or (e.output or b'').decode(errors='replace').strip()
+        return text or str(e)
+    return str(e)
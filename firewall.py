@@ -0,0 +1,240 @@
+import asyncio
+import logging
+import re
+import subprocess
+import time
+from collections import namedtuple
+
+import executor
+
+logger = logging.getLogger(__name__)
+
+# ufw accepts at most 15 ports per multiport rule, a range counts as two
+MULTIPORT_LIMIT = 15
+PROTOCOLS = ('tcp', 'udp')
+ACTIONS = ('allow', 'deny', 'reject', 'limit')
+
+# A port spec is a single port (first == last) or a range; proto may be None
+PortSpec = namedtuple('PortSpec', 'first last proto')
+# One line of `ufw status`; `ports` is empty for app profiles such as OpenSSH
+Rule = namedtuple('Rule', 'to action direction source v6 ports proto')
+CommandResult = namedtuple('CommandResult', 'args ok output')
+
+
+class FirewallError(Exception):
+    pass
+
+
+def _port(text):
+    if not text.isdigit() or not 0 < int(text) < 65536:
+        raise FirewallError(f'Invalid port: {text}')
+    return int(text)
+
+
+def parse_ports(text, proto=None):
+    specs = []
+    for part in filter(None, text.split(',')):
+        match = re.fullmatch(r'(\d+)(?:[:-](\d+))?', part)
+        if not match:
+            raise FirewallError(f'Invalid port spec: {part}')
+        first = _port(match.group(1))
+        last = _port(match.group(2)) if match.group(2) else first
+        if last < first:
+            raise FirewallError(f'Invalid port range: {part}')
+        specs.append(PortSpec(first, last, proto))
+    return specs
+
+
+def parse_spec(arg):
+    """Parse e.g. "80,443,8000:8100/tcp" into PortSpecs.
+
+    Anything that is not a port list (e.g. an app profile like "OpenSSH") is
+    returned as a plain string.
+    """
+    ports, _, proto = arg.partition('/')
+    proto = proto.lower() or None
+    if not re.fullmatch(r'[\d,:-]+', ports):
+        if proto or ',' in arg:
+            raise FirewallError(f'Invalid port spec: {arg}')
+        return [arg]
+    if proto is not None and proto not in PROTOCOLS:
+        raise FirewallError(f'Invalid protocol: {proto}')
+    specs = parse_ports(ports, proto)
+    for spec in specs:
+        if spec.first != spec.last and spec.proto is None:
+            raise FirewallError(f'Port range {spec.first}:{spec.last} needs a protocol, e.g. {spec.first}:{spec.last}/tcp')
+    return specs
+
+
+def _spec_text(spec):
+    return str(spec.first) if spec.first == spec.last else f'{spec.first}:{spec.last}'
+
+
+def plan(specs):
+    """Group specs into as few ufw rule arguments as possible.
+
+    Ports with a protocol are packed into multiport rules of up to 15 ports;
+    ports without a protocol and app profiles need one rule each.
+    """
+    rules = []
+    chunks = {proto: [] for proto in PROTOCOLS}
+    sizes = {proto: 0 for proto in PROTOCOLS}
+    for spec in dict.fromkeys(specs):
+        if isinstance(spec, str):
+            rules.append(spec)
+        elif spec.proto is None:
+            rules.append(_spec_text(spec))
+        else:
+            size = 1 if spec.first == spec.last else 2
+            if sizes[spec.proto] + size > MULTIPORT_LIMIT:
+                rules.append(f'{",".join(chunks[spec.proto])}/{spec.proto}')
+                chunks[spec.proto], sizes[spec.proto] = [], 0
+            chunks[spec.proto].append(_spec_text(spec))
+            sizes[spec.proto] += size
+    for proto in PROTOCOLS:
+        if chunks[proto]:
+            rules.append(f'{",".join(chunks[proto])}/{proto}')
+    return rules
+
+
+def _parse_rule(line):
+    columns = re.split(r'\s{2,}', line.strip())
+    if len(columns) < 3:
+        return None
+    to, action, source = columns[0], columns[1], columns[2]
+    action, _, direction = action.partition(' ')
+    v6 = to.endswith('(v6)')
+    to = to.replace(' (v6)', '')
+    ports, proto = (), None
+    match = re.fullmatch(r'([\d,:]+)(?:/(tcp|udp))?', to)
+    if match:
+        try:
+            ports = tuple(parse_ports(match.group(1), match.group(2)))
+            proto = match.group(2)
+        except FirewallError:
+            pass
+    return Rule(to, action.lower(), direction.lower() or 'in', source, v6, ports, proto)
+
+
+def parse_status(output):
+    """Parse `ufw status` into (active, rules)."""
+    active = False
+    rules = []
+    in_rules = False
+    for line in output.splitlines():
+        if line.startswith('Status:'):
+            active = line.split(':', 1)[1].strip() == 'active'
+        elif line.startswith('--'):
+            in_rules = True
+        elif in_rules and line.strip():
+            rule = _parse_rule(line)
+            if rule is not None:
+                rules.append(rule)
+    return active, rules
+
+
+def rule_covers(rule, port):
+    return any(spec.first <= port <= spec.last for spec in rule.ports)
+
+
+class Firewall:
+    """Batched ufw changes and a parsed, cached view of the ruleset.
+
+    The parsed `ufw status` is reused until a change is applied or `ttl`
+    seconds pass, whichever comes first.
+    """
+
+    def __init__(self, ttl=30.0):
+        self.ttl = ttl
+        self._state = None
+        self._loaded_at = None
+        self._loading = None
+        self._loading_generation = 0
+        self._generation = 0
+
+    def invalidate(self):
+        self._state = None
+        self._generation += 1
+
+    def age(self):
+        """Seconds since the cached ruleset was loaded, None while nothing is cached."""
+        if self._state is None:
+            return None
+        return time.monotonic() - self._loaded_at
+
+    async def _load(self, generation):
+        output = (await executor.check_output(['ufw', 'status'], family='ufw')).decode()
+        state = parse_status(output)
+        # A change applied while ufw status ran may not be in its output
+        if generation == self._generation:
+            self._state = state
+            self._loaded_at = time.monotonic()
+        return state
+
+    async def state(self, refresh=False):
+        """Parsed (active, rules); concurrent callers share one `ufw status` run."""
+        if refresh or self._state is None or self.age() > self.ttl:
+            if self._loading is None or self._loading.done() or self._loading_generation != self._generation:
+                self._loading = asyncio.ensure_future(self._load(self._generation))
+                self._loading_generation = self._generation
+            return await asyncio.shield(self._loading)
+        return self._state
+
+    async def rules(self, port=None, action=None, refresh=False):
+        _, rules = await self.state(refresh)
+        if port is not None:
+            rules = [rule for rule in rules if rule_covers(rule, port)]
+        if action is not None:
+            rules = [rule for rule in rules if rule.action == action]
+        return rules
+
+    async def apply(self, action, args, on_output=None):
+        """Apply `ufw <action>` for all port specs in args, batched.
+
+        Returns a CommandResult per ufw invocation. ufw output is streamed to
+        on_output(stream_name, text) as it arrives.
+        """
+        if action not in ACTIONS:
+            raise FirewallError(f'Invalid action: {action}')
+        specs = [spec for arg in args for spec in parse_spec(arg)]
+        results = []
+        try:
+            for rule in plan(specs):
+                if on_output is not None:
+                    on_output('command', f'$ ufw {action} {rule}\n')
+                try:
+                    output = await executor.check_output(['ufw', action, rule], family='ufw', on_output=on_output)
+                    results.append(CommandResult(rule, True, output.decode().strip()))
+                except (subprocess.CalledProcessError, OSError) as e:
+                    results.append(CommandResult(rule, False, executor.error_text(e)))
+        finally:
+            self.invalidate()
+        logger.info(f'Applied ufw {action} for {len(specs)} port specs in {len(results)} invocations.')
+        return results
+
+
+def format_rules(active, rules):
+    lines = [f'Status: {"active" if active else "inactive"}']
+    if not rules:
+        lines.append('No matching rules.')
+        return '\n'.join(lines)
+    width = max(len(rule.to) + (5 if rule.v6 else 0) for rule in rules)
+    for rule in rules:
+        to = f'{rule.to} (v6)' if rule.v6 else rule.to
+        lines.append(f'{to:<{width}}  {rule.action.upper():<6}  {rule.direction.upper():<3}  {rule.source}')
+    return '\n'.join(lines)
+
+
+def format_age(age):
+    return 'Updated: unknown' if age is None else f'Updated {age:.1f}s ago'
+
+
+def format_results(action, results):
+    verb = {'allow': 'allowed', 'deny': 'denied', 'reject': 'rejected', 'limit': 'limited'}[action]
+    lines = []
+    for result in results:
+        if result.ok:
+            lines.append(f'Port {result.args} {verb} through UFW.')
+        else:
+            lines.append(f'Error with port {result.args}: {result.output}')
+    return '\n'.join(lines)
@@ -0,0 +1,288 @@
+import asyncio
+import itertools
+import json
+import logging
+import os
+import ssl
+import time
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+ALL = 'all'
+# Largest JSON line accepted by either side of the agent channel
+MAX_LINE = 16 * 1024 * 1024
+
+Host = namedtuple('Host', 'name address port')
+# ok is False when the agent failed, could not be reached or timed out
+HostResult = namedtuple('HostResult', 'host ok text duration')
+
+
+class FleetError(Exception):
+    pass
+
+
+def encode(message):
+    return json.dumps(message, separators=(',', ':')).encode() + b'\n'
+
+
+def parse_hosts(text):
+    """Parse e.g. "web1=10.0.0.1:7070,web2=10.0.0.2" into {name: Host}."""
+    hosts = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, address = item.partition('=')
+        address, _, port = address.rpartition(':') if ':' in address else (address, '', '')
+        if not name or not address or (port and not port.isdigit()):
+            raise FleetError(f'Invalid fleet host: {item}')
+        if name == ALL:
+            raise FleetError(f'"{ALL}" is reserved and cannot name a host')
+        hosts[name] = Host(name, address, int(port or 7070))
+    return hosts
+
+
+def parse_groups(text):
+    """Parse e.g. "web=web1,web2;db=db1" into {group: (host, ...)}."""
+    groups = {}
+    for item in filter(None, (part.strip() for part in text.split(';'))):
+        name, _, members = item.partition('=')
+        groups[name.strip()] = tuple(filter(None, (member.strip() for member in members.split(','))))
+    return groups
+
+
+def client_ssl_context(cafile=None, certfile=None, keyfile=None):
+    """TLS context for connecting to agents: verifies them against `cafile`
+    (or the system CAs) and presents a client certificate if given."""
+    context = ssl.create_default_context(cafile=cafile)
+    if certfile:
+        context.load_cert_chain(certfile, keyfile)
+    return context
+
+
+def server_ssl_context(certfile, keyfile=None, cafile=None):
+    """TLS context for an agent; with `cafile`, clients must present a certificate it signed."""
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain(certfile, keyfile)
+    if cafile:
+        context.load_verify_locations(cafile)
+        context.verify_mode = ssl.CERT_REQUIRED
+    return context
+
+
+def split_target(args):
+    """Return (target, args) with the first "@target" argument taken out of args."""
+    for i, arg in enumerate(args):
+        if arg.startswith('@') and len(arg) > 1:
+            return arg[1:], list(args[:i]) + list(args[i + 1:])
+    return None, list(args)
+
+
+class AgentConnection:
+    """One persistent connection to an agent, shared by concurrent requests.
+
+    Requests carry an id and the agent answers them in any order; a reader
+    task matches each answer to the waiting request.
+    """
+
+    def __init__(self, host, token, ssl=None):
+        self.host = host
+        self.token = token
+        self.ssl = ssl
+        self.closed = False
+        self._reader = None
+        self._writer = None
+        self._read_task = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+
+    @property
+    def in_flight(self):
+        return len(self._pending)
+
+    async def open(self, timeout):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host.address, self.host.port, ssl=self.ssl, limit=MAX_LINE), timeout)
+        try:
+            self._writer.write(encode({'id': 0, 'command': 'hello', 'token': self.token}))
+            reply = json.loads(await asyncio.wait_for(self._reader.readline(), timeout) or 'null')
+        except BaseException:
+            self._writer.close()
+            raise
+        if not reply or not reply.get('ok'):
+            self._writer.close()
+            raise FleetError((reply or {}).get('error', 'agent closed the connection'))
+        self._read_task = asyncio.create_task(self._read_loop())
+        logger.debug(f'Connected to fleet agent {self.host.name} ({self.host.address}:{self.host.port}).')
+
+    async def _read_loop(self):
+        error = 'connection closed by agent'
+        try:
+            while line := await self._reader.readline():
+                message = json.loads(line)
+                future = self._pending.get(message.get('id'))
+                if future is not None and not future.done():
+                    future.set_result(message)
+        except (OSError, ValueError) as e:
+            error = f'connection lost: {e}'
+        finally:
+            self.closed = True
+            self._writer.close()
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(FleetError(error))
+            logger.debug(f'Fleet agent {self.host.name}: {error}.')
+
+    async def request(self, command, args):
+        if self.closed:
+            raise FleetError('connection closed')
+        request_id = next(self._ids)
+        future = asyncio.get_running_loop().create_future()
+        self._pending[request_id] = future
+        try:
+            self._writer.write(encode({'id': request_id, 'command': command, 'args': list(args)}))
+            await self._writer.drain()
+            return await future
+        finally:
+            del self._pending[request_id]
+
+    async def close(self):
+        self.closed = True
+        if self._writer is not None:
+            self._writer.close()
+        if self._read_task is not None:
+            await asyncio.gather(self._read_task, return_exceptions=True)
+
+
+class AgentPool:
+    """Up to `size` persistent connections to one agent.
+
+    A request goes to the least busy open connection; a new connection is
+    only opened when every open one already has requests in flight. Closed
+    connections are replaced on the next request.
+    """
+
+    def __init__(self, host, token, size=2, connect_timeout=5.0, ssl=None):
+        self.host = host
+        self.token = token
+        self.ssl = ssl
+        self.size = size
+        self.connect_timeout = connect_timeout
+        self._connections = []
+        self._lock = asyncio.Lock()
+
+    @property
+    def connected(self):
+        return sum(1 for connection in self._connections if not connection.closed)
+
+    def _idle(self):
+        self._connections = [connection for connection in self._connections if not connection.closed]
+        if not self._connections:
+            return None
+        connection = min(self._connections, key=lambda connection: connection.in_flight)
+        if connection.in_flight == 0 or len(self._connections) >= self.size:
+            return connection
+        return None
+
+    async def _connection(self):
+        connection = self._idle()
+        if connection is not None:
+            return connection
+        async with self._lock:
+            connection = self._idle()
+            if connection is None:
+                connection = AgentConnection(self.host, self.token, self.ssl)
+                try:
+                    await connection.open(self.connect_timeout)
+                except asyncio.TimeoutError as e:
+                    raise FleetError(f'cannot connect to {self.host.address}:{self.host.port}: timed out') from e
+                except OSError as e:
+                    reason = os.strerror(e.errno) if e.errno and not isinstance(e, ssl.SSLError) else str(e)
+                    raise FleetError(f'cannot connect to {self.host.address}:{self.host.port}: {reason}') from e
+                self._connections.append(connection)
+            return connection
+
+    async def request(self, command, args):
+        connection = await self._connection()
+        reply = await connection.request(command, args)
+        if not reply.get('ok'):
+            raise FleetError(reply.get('error', 'unknown agent error'))
+        return reply.get('text', '')
+
+    async def close(self):
+        connections, self._connections = self._connections, []
+        await asyncio.gather(*(connection.close() for connection in connections))
+
+
+class Fleet:
+    """Runs commands on fleet agents, concurrently and with a per-host timeout.
+
+    Connections use TLS when an `ssl` context is given (see client_ssl_context);
+    otherwise the token travels in plaintext.
+    """
+
+    def __init__(self, hosts, groups=None, token='', timeout=10.0, pool_size=2, ssl=None):
+        self.hosts = dict(hosts)
+        self.groups = dict(groups or {})
+        self.timeout = timeout
+        for group, members in self.groups.items():
+            unknown = [member for member in members if member not in self.hosts]
+            if unknown:
+                raise FleetError(f'Fleet group {group} has unknown hosts: {", ".join(unknown)}')
+        self.pools = {
+            name: AgentPool(host, token, size=pool_size, connect_timeout=timeout, ssl=ssl)
+            for name, host in self.hosts.items()
+        }
+
+    def __bool__(self):
+        return bool(self.hosts)
+
+    def resolve(self, target):
+        """Host names for "all", a group or a single host."""
+        if not self.hosts:
+            raise FleetError('No fleet hosts are configured.')
+        if target == ALL:
+            return list(self.hosts)
+        if target in self.groups:
+            return list(self.groups[target])
+        if target in self.hosts:
+            return [target]
+        raise FleetError(f'Unknown host or group: @{target}')
+
+    async def _run_one(self, name, command, args):
+        started = time.monotonic()
+        try:
+            text = await asyncio.wait_for(self.pools[name].request(command, args), self.timeout)
+            return HostResult(name, True, text, time.monotonic() - started)
+        except asyncio.TimeoutError:
+            return HostResult(name, False, f'timed out after {self.timeout:g}s', time.monotonic() - started)
+        except (FleetError, OSError) as e:
+            return HostResult(name, False, str(e), time.monotonic() - started)
+
+    async def run(self, names, command, args=()):
+        """Run `command` on every host in `names` at once; returns HostResults in order."""
+        return await asyncio.gather(*(self._run_one(name, command, args) for name in names))
+
+    async def close(self):
+        await asyncio.gather(*(pool.close() for pool in self.pools.values()))
+
+
+def format_results(results):
+    ok = sum(1 for result in results if result.ok)
+    sections = []
+    for result in results:
+        status = '' if result.ok else ' FAILED'
+        sections.append(f'== {result.host}{status} ({result.duration:.2f}s) ==\n{result.text}'.rstrip())
+    sections.append(f'{ok}/{len(results)} hosts ok')
+    return '\n\n'.join(sections)
+
+
+def format_fleet(fleet, pings):
+    """Describe hosts and groups; `pings` are the HostResults of a "ping" to every host."""
+    lines = ['Hosts:']
+    for result in pings:
+        host = fleet.hosts[result.host]
+        status = f'ok in {result.duration * 1000:.0f}ms' if result.ok else f'unavailable: {result.text}'
+        lines.append(f'  {host.name}  {host.address}:{host.port}  {status}, {fleet.pools[host.name].connected} connections')
+    if fleet.groups:
+        lines.append('Groups:')
+        lines.extend(f'  {group}: {", ".join(members)}' for group, members in fleet.groups.items())
+    return '\n'.join(lines)
@@ -0,0 +1,197 @@
+"""Fleet agent: answers the bot's read commands for the host it runs on.
+
+The agent is read-only: it never changes sites, firewall rules, VMs or
+governors. It listens on 127.0.0.1 unless FLEET_AGENT_LISTEN says
+otherwise; when exposing it, set FLEET_AGENT_TLS_CERT/KEY (and
+FLEET_AGENT_TLS_CA to require client certificates) so the token is not
+sent in the clear.
+
+Speaks JSON lines over TCP. A client first sends
+{"id": 0, "command": "hello", "token": ...}; after that every
+{"id": n, "command": ..., "args": [...]} is handled concurrently and
+answered with {"id": n, "ok": true, "text": ...} or
+{"id": n, "ok": false, "error": ...}, in whatever order they finish.
+"""
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import socket
+import subprocess
+
+from dotenv import load_dotenv
+
+import executor
+from cpufreq import Cpufreq, CpufreqError, format_policies, parse_cpu_list
+from firewall import ACTIONS as UFW_ACTIONS, Firewall, FirewallError, format_age as format_ufw_age, format_rules as format_ufw_rules
+from fleet import MAX_LINE, FleetError, encode, server_ssl_context
+from site_index import SiteIndex, format_enabled, format_sites
+from vm_backend import VMError, create_backend
+from vm_inventory import VMInventory, format_entries
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Configuration
+FLEET_TOKEN = os.getenv('FLEET_TOKEN')
+FLEET_AGENT_LISTEN = os.getenv('FLEET_AGENT_LISTEN', '127.0.0.1')
+FLEET_AGENT_PORT = int(os.getenv('FLEET_AGENT_PORT', '7070'))
+FLEET_AGENT_NAME = os.getenv('FLEET_AGENT_NAME', socket.gethostname())
+FLEET_AGENT_TLS_CERT = os.getenv('FLEET_AGENT_TLS_CERT')
+FLEET_AGENT_TLS_KEY = os.getenv('FLEET_AGENT_TLS_KEY')
+FLEET_AGENT_TLS_CA = os.getenv('FLEET_AGENT_TLS_CA')
+UFW_STATUS_TTL = float(os.getenv('UFW_STATUS_TTL', '30'))
+CPUFREQ_SYSFS_ROOT = os.getenv('CPUFREQ_SYSFS_ROOT', '/sys/devices/system/cpu')
+NGINX_SITES_AVAILABLE = os.getenv('NGINX_SITES_AVAILABLE', '/etc/nginx/sites-available')
+NGINX_SITES_ENABLED = os.getenv('NGINX_SITES_ENABLED', '/etc/nginx/sites-enabled')
+VM_POLL_MIN_INTERVAL = float(os.getenv('VM_POLL_MIN_INTERVAL', '2'))
+VM_POLL_MAX_INTERVAL = float(os.getenv('VM_POLL_MAX_INTERVAL', '60'))
+
+REFRESH_FLAGS = {'refresh', '--refresh'}
+
+logging.basicConfig(
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    level=logging.INFO
+)
+logger = logging.getLogger('fleet_agent')
+
+
+class FleetAgent:
+    """Serves the fleet commands from this host's own indexes and caches."""
+
+    def __init__(self, name, token):
+        self.name = name
+        self.token = token
+        self.cpufreq = Cpufreq(CPUFREQ_SYSFS_ROOT)
+        self.firewall = Firewall(ttl=UFW_STATUS_TTL)
+        self.site_index = SiteIndex(NGINX_SITES_AVAILABLE, NGINX_SITES_ENABLED)
+        self.vm_backend = create_backend()
+        self.vm_inventory = VMInventory(self.vm_backend, min_interval=VM_POLL_MIN_INTERVAL, max_interval=VM_POLL_MAX_INTERVAL)
+        self.commands = {
+            'ping': self.ping,
+            'listsites': self.listsites,
+            'listensites': self.listensites,
+            'ufw_status': self.ufw_status,
+            'list_vms': self.list_vms,
+            'cpugov': self.cpugov,
+        }
+
+    async def ping(self, args):
+        return self.name
+
+    async def listsites(self, args):
+        pattern = args[0] if args else None
+        return f'Sites:\n{format_sites(self.site_index.sites(pattern), self.site_index.dangling())}'
+
+    async def listensites(self, args):
+        pattern = args[0] if args else None
+        return f'Sites enabled:\n{format_enabled(self.site_index.enabled(pattern))}'
+
+    async def ufw_status(self, args):
+        port = None
+        action = None
+        for arg in args:
+            if arg.isdigit():
+                port = int(arg)
+            elif arg.lower() in UFW_ACTIONS:
+                action = arg.lower()
+        refresh = bool(REFRESH_FLAGS.intersection(args))
+        rules = await self.firewall.rules(port=port, action=action, refresh=refresh)
+        active, _ = await self.firewall.state()
+        return f'UFW Status: {format_ufw_rules(active, rules)}\n\n{format_ufw_age(self.firewall.age())}'
+
+    async def list_vms(self, args):
+        if REFRESH_FLAGS.intersection(args):
+            await self.vm_inventory.refresh()
+        else:
+            await self.vm_inventory.ensure_loaded()
+        return f'Virtual Machines:\n{format_entries(self.vm_inventory.all())}\n\n{self.vm_inventory.staleness()}'
+
+    async def cpugov(self, args):
+        cpus = None
+        for arg in args:
+            if not arg[0].isdigit():
+                raise FleetError('Fleet agents are read-only, governors can only be shown.')
+            cpus = parse_cpu_list(arg)
+        return f'Current CPU Governor:\n{format_policies(await self.cpufreq.policies_async(cpus))}'
+
+    async def _dispatch(self, message, writer):
+        request_id = message.get('id')
+        handler = self.commands.get(message.get('command'))
+        try:
+            if handler is None:
+                raise FleetError(f'Unknown command: {message.get("command")}')
+            reply = {'id': request_id, 'ok': True, 'text': await handler([str(arg) for arg in message.get('args', ())])}
+        except subprocess.CalledProcessError as e:
+            reply = {'id': request_id, 'ok': False, 'error': executor.error_text(e)}
+        except (CpufreqError, FirewallError, FleetError, VMError) as e:
+            reply = {'id': request_id, 'ok': False, 'error': str(e)}
+        except Exception as e:
+            logger.exception(f'Fleet command {message.get("command")} failed.')
+            reply = {'id': request_id, 'ok': False, 'error': f'{type(e).__name__}: {e}'}
+        if writer.is_closing():
+            return
+        try:
+            writer.write(encode(reply))
+            await writer.drain()
+        except ConnectionError:
+            logger.debug(f'Fleet client went away before the reply to request {request_id}.')
+
+    async def handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        tasks = set()
+        try:
+            hello = json.loads(await reader.readline() or 'null')
+            if not hello or hello.get('command') != 'hello' or not hmac.compare_digest(str(hello.get('token', '')), self.token):
+                logger.warning(f'Rejected fleet connection from {peer}: bad token.')
+                writer.write(encode({'id': 0, 'ok': False, 'error': 'invalid token'}))
+                return
+            writer.write(encode({'id': 0, 'ok': True, 'text': self.name}))
+            logger.info(f'Fleet connection from {peer}.')
+            while line := await reader.readline():
+                task = asyncio.create_task(self._dispatch(json.loads(line), writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (OSError, ValueError) as e:
+            logger.warning(f'Fleet connection from {peer} failed: {e}')
+        finally:
+            for task in tasks:
+                task.cancel()
+            writer.close()
+
+    async def serve(self, listen, port, ssl=None):
+        self.site_index.start(asyncio.get_running_loop())
+        await self.vm_inventory.start()
+        server = await asyncio.start_server(self.handle, listen, port, ssl=ssl, limit=MAX_LINE)
+        logger.info(f'Fleet agent {self.name} listening on {listen}:{port} ({"TLS" if ssl else "plaintext"}).')
+        if ssl is None and listen not in ('127.0.0.1', '::1', 'localhost'):
+            logger.warning('Fleet agent is reachable from the network without TLS, the token is sent in the clear.')
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            self.site_index.stop()
+            await self.vm_inventory.stop()
+            await self.vm_backend.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--listen', default=FLEET_AGENT_LISTEN)
+    parser.add_argument('--port', type=int, default=FLEET_AGENT_PORT)
+    parser.add_argument('--name', default=FLEET_AGENT_NAME)
+    args = parser.parse_args()
+    if not FLEET_TOKEN:
+        raise SystemExit('FLEET_TOKEN must be set.')
+    context = None
+    if FLEET_AGENT_TLS_CERT:
+        context = server_ssl_context(FLEET_AGENT_TLS_CERT, FLEET_AGENT_TLS_KEY, FLEET_AGENT_TLS_CA)
+    try:
+        asyncio.run(FleetAgent(args.name, FLEET_TOKEN).serve(args.listen, args.port, context))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -1,23 +1,163 @@
+import asyncio
+import atexit
 import logging
+import logging.handlers
 import os
+import queue
 import sqlite3
 import subprocess
 from telegram import Update
 from telegram.ext import ApplicationBuilder, CommandHandler, ContextTypes
 from dotenv import load_dotenv
 
+import audit
+import executor
+import metrics
+from acl import ManagerACL
+from cache import ResultCache, format_marker, parse_ttls
+from cpufreq import Cpufreq, CpufreqError, format_cpu_list, format_policies, parse_cpu_list
+from delivery import ProgressMessage, reply_long
+from fleet import (
+    Fleet,
+    FleetError,
+    client_ssl_context,
+    format_fleet,
+    format_results as format_fleet_results,
+    parse_groups as parse_fleet_groups,
+    parse_hosts as parse_fleet_hosts,
+    split_target,
+)
+from firewall import (
+    ACTIONS as UFW_ACTIONS,
+    Firewall,
+    FirewallError,
+    format_age as format_ufw_age,
+    format_results as format_ufw_results,
+    format_rules as format_ufw_rules,
+)
+from nginx_reload import ReloadScheduler, format_result as format_reload_result
+from notifier import AdminNotifier
+from site_index import SiteIndex, format_enabled, format_sites
+from telemetry import HostSampler, format_stats as format_host_stats, parse_thresholds
+from vm_backend import VMError, create_backend
+from vm_inventory import VMInventory, format_entries
+from vm_power import (
+    ACTIONS as POWER_ACTIONS,
+    PowerError,
+    PowerOperation,
+    format_progress as format_power_progress,
+    format_results as format_power_results,
+    parse_request as parse_power_request,
+)
+
 # Load environment variables from .env file
 load_dotenv()
 
 # Configuration
 TOKEN = os.getenv('YOUR_TELEGRAM_BOT_TOKEN')
 ADMIN_CHAT_ID = int(os.getenv('ADMIN_CHAT_ID'))
-
-# Set up logging
+# Override the Bot API server, e.g. a local fake for benchmarks
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL')
+# 'polling' (default) or 'webhook'. Webhook mode needs the optional
+# python-telegram-bot[webhooks] dependency and serves updates itself.
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+WEBHOOK_CERT = os.getenv('WEBHOOK_CERT')
+WEBHOOK_KEY = os.getenv('WEBHOOK_KEY')
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# Number of updates processed concurrently, so a slow command doesn't hold up others
+CONCURRENT_UPDATES = int(os.getenv('CONCURRENT_UPDATES', '32'))
+# Admin notifications are merged into one digest per window and rate limited
+NOTIFY_WINDOW = float(os.getenv('NOTIFY_WINDOW', '5'))
+NOTIFY_RATE_PER_MINUTE = float(os.getenv('NOTIFY_RATE_PER_MINUTE', '20'))
+NOTIFY_BURST = int(os.getenv('NOTIFY_BURST', '3'))
+# VM inventory poll interval bounds (seconds), used when lifecycle events are unavailable
+VM_POLL_MIN_INTERVAL = float(os.getenv('VM_POLL_MIN_INTERVAL', '2'))
+VM_POLL_MAX_INTERVAL = float(os.getenv('VM_POLL_MAX_INTERVAL', '60'))
+# Parsed `ufw status` is reused for this many seconds unless a rule changes
+UFW_STATUS_TTL = float(os.getenv('UFW_STATUS_TTL', '30'))
+CPUFREQ_SYSFS_ROOT = os.getenv('CPUFREQ_SYSFS_ROOT', '/sys/devices/system/cpu')
+NGINX_SITES_AVAILABLE = os.getenv('NGINX_SITES_AVAILABLE', '/etc/nginx/sites-available')
+NGINX_SITES_ENABLED = os.getenv('NGINX_SITES_ENABLED', '/etc/nginx/sites-enabled')
+# Site changes within this many seconds are validated and reloaded together
+NGINX_RELOAD_DEBOUNCE = float(os.getenv('NGINX_RELOAD_DEBOUNCE', '2'))
+
+# Prometheus endpoint, only served when METRICS_ENABLED=1
+METRICS_LISTEN = os.getenv('METRICS_LISTEN', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9464'))
+
+# Audit trail of every action, kept apart from managers.db
+AUDIT_DB = os.getenv('AUDIT_DB', 'audit.db')
+
+# Replies to read commands that run a process (/ufw_status) or fan out to
+# fleet agents are shared between identical concurrent requests and reused for
+# a few seconds. The local /list_vms, /vm_status, /listsites and /listensites
+# answer from indexes that events keep current and are never cached.
+# Override TTLs with e.g. RESULT_CACHE_TTLS="list_vms=10"
+RESULT_CACHE_SIZE = int(os.getenv('RESULT_CACHE_SIZE', '256'))
+RESULT_CACHE_TTLS = {
+    'list_vms': 5,
+    'vm_status': 5,
+    'ufw_status': 10,
+    'listsites': 10,
+    'listensites': 10,
+    **parse_ttls(os.getenv('RESULT_CACHE_TTLS', '')),
+}
+# Cached read commands made stale by each mutating command (for the VM and
+# site commands these are fleet fan-outs, which may include this host)
+INVALIDATES = {
+    'ensite': ('listsites', 'listensites'),
+    'dissite': ('listsites', 'listensites'),
+    'ufw_allow': ('ufw_status',),
+    'ufw_deny': ('ufw_status',),
+    'start_vm': ('list_vms', 'vm_status'),
+    'stop_vm': ('list_vms', 'vm_status'),
+    'reboot_vm': ('list_vms', 'vm_status'),
+}
+
+# Host telemetry for /host_stats. HOST_ALERTS lists thresholds that, when
+# exceeded for HOST_ALERT_SUSTAIN seconds, are reported to the admin.
+HOST_PROC_ROOT = os.getenv('HOST_PROC_ROOT', '/proc')
+HOST_STATS_INTERVAL = float(os.getenv('HOST_STATS_INTERVAL', '5'))
+HOST_STATS_HISTORY = int(os.getenv('HOST_STATS_HISTORY', '720'))
+HOST_ALERTS = parse_thresholds(os.getenv('HOST_ALERTS', 'cpu=90,mem=90,swap=50'))
+HOST_ALERT_SUSTAIN = float(os.getenv('HOST_ALERT_SUSTAIN', '60'))
+
+# Fleet mode: /listsites, /listensites, /ufw_status, /list_vms and /cpugov
+# run on fleet_agent.py instances when given @host, @group or @all, e.g.
+# FLEET_HOSTS="web1=10.0.0.1:7070,web2=10.0.0.2:7070" FLEET_GROUPS="web=web1,web2;db=db3"
+FLEET_HOSTS = parse_fleet_hosts(os.getenv('FLEET_HOSTS', ''))
+FLEET_GROUPS = parse_fleet_groups(os.getenv('FLEET_GROUPS', ''))
+FLEET_TOKEN = os.getenv('FLEET_TOKEN', '')
+FLEET_TIMEOUT = float(os.getenv('FLEET_TIMEOUT', '10'))
+FLEET_POOL_SIZE = int(os.getenv('FLEET_POOL_SIZE', '2'))
+# TLS to the agents: FLEET_TLS=1 verifies them against the system CAs or
+# FLEET_TLS_CA; FLEET_TLS_CERT/KEY is the client certificate, if they require one
+FLEET_TLS = os.getenv('FLEET_TLS', '0').lower() in ('1', 'true', 'yes') or bool(os.getenv('FLEET_TLS_CA'))
+FLEET_TLS_CA = os.getenv('FLEET_TLS_CA')
+FLEET_TLS_CERT = os.getenv('FLEET_TLS_CERT')
+FLEET_TLS_KEY = os.getenv('FLEET_TLS_KEY')
+
+# Arguments that force a cache refresh
+REFRESH_FLAGS = {'refresh', '--refresh'}
+
+# Set up logging. Records are queued and formatted/written by a listener
+# thread, so handlers never wait on log I/O.
+log_queue = queue.SimpleQueue()
+log_handler = logging.StreamHandler()
+log_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+log_listener = logging.handlers.QueueListener(log_queue, log_handler)
 logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(message)s',
+    handlers=[logging.handlers.QueueHandler(log_queue)],
     level=logging.DEBUG
 )
+log_listener.start()
+atexit.register(log_listener.stop)
 logger = logging.getLogger(__name__)
 
 # Database setup
@@ -31,18 +171,34 @@ c.execute('''
 ''')
 conn.commit()
 
-def is_manager(user_id):
-    if user_id == ADMIN_CHAT_ID:
-        logger.debug(f'User ID {user_id} is the admin.')
-        return True
-    c.execute('SELECT user_id FROM managers WHERE user_id = ?', (user_id,))
-    result = c.fetchone()
-    if result:
-        logger.debug(f'User ID {user_id} is a manager.')
-        return True
-    else:
-        logger.debug(f'User ID {user_id} is NOT a manager.')
-        return False
+# Manager ACL cache, answers is_manager() without a database round trip
+acl = ManagerACL(conn, ADMIN_CHAT_ID, refresh_interval=float(os.getenv('ACL_REFRESH_INTERVAL', '5')))
+is_manager = metrics.timed('auth', acl.is_manager)
+
+cpufreq = Cpufreq(CPUFREQ_SYSFS_ROOT)
+firewall = Firewall(ttl=UFW_STATUS_TTL)
+site_index = SiteIndex(NGINX_SITES_AVAILABLE, NGINX_SITES_ENABLED)
+reload_scheduler = ReloadScheduler(debounce=NGINX_RELOAD_DEBOUNCE, enabled_dir=NGINX_SITES_ENABLED)
+
+vm_backend = create_backend()
+vm_inventory = VMInventory(vm_backend, min_interval=VM_POLL_MIN_INTERVAL, max_interval=VM_POLL_MAX_INTERVAL)
+
+notifier = AdminNotifier(ADMIN_CHAT_ID, window=NOTIFY_WINDOW, rate_per_minute=NOTIFY_RATE_PER_MINUTE, burst=NOTIFY_BURST)
+metrics_server = None
+
+host_sampler = HostSampler(
+    HOST_PROC_ROOT, CPUFREQ_SYSFS_ROOT, interval=HOST_STATS_INTERVAL, history=HOST_STATS_HISTORY,
+    thresholds=HOST_ALERTS, sustain=HOST_ALERT_SUSTAIN, on_alert=lambda text: notifier.notify(text, critical=True),
+)
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTLS)
+
+audit_log = audit.AuditLog(AUDIT_DB)
+
+fleet = Fleet(
+    FLEET_HOSTS, FLEET_GROUPS, FLEET_TOKEN, timeout=FLEET_TIMEOUT, pool_size=FLEET_POOL_SIZE,
+    ssl=client_ssl_context(FLEET_TLS_CA, FLEET_TLS_CERT, FLEET_TLS_KEY) if FLEET_TLS else None,
+)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -67,8 +223,8 @@ async def add_manager(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('Usage: /add_manager <user_id>')
         return
     new_manager_id = int(context.args[0])
-    c.execute('INSERT OR IGNORE INTO managers (user_id) VALUES (?)', (new_manager_id,))
-    conn.commit()
+    acl.add(new_manager_id)
+    audit.note(f'Added user ID {new_manager_id} as a manager', target=str(new_manager_id))
     await context.bot.send_message(chat_id=new_manager_id, text='You have been approved as a manager. Use /help to see commands.')
     await update.message.reply_text('Manager added.')
     logger.info(f'Added user ID {new_manager_id} as a manager.')
@@ -83,8 +239,8 @@ async def remove_manager(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text('Usage: /remove_manager <user_id>')
         return
     remove_manager_id = int(context.args[0])
-    c.execute('DELETE FROM managers WHERE user_id = ?', (remove_manager_id,))
-    conn.commit()
+    acl.remove(remove_manager_id)
+    audit.note(f'Removed user ID {remove_manager_id} from managers', target=str(remove_manager_id))
     await context.bot.send_message(chat_id=remove_manager_id, text='Your manager access has been revoked.')
     await update.message.reply_text('Manager removed.')
     logger.info(f'Removed user ID {remove_manager_id} from managers.')
@@ -98,9 +254,35 @@ async def list_managers(update: Update, context: ContextTypes.DEFAULT_TYPE):
     c.execute('SELECT user_id, username FROM managers')
     managers = c.fetchall()
     text = 'Managers:\n' + '\n'.join(f'ID: {row[0]}, Username: {row[1]}' for row in managers)
-    await update.message.reply_text(text)
+    await reply_long(update.message, text, 'managers.txt')
     logger.info('Listed managers to admin.')
 
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    logger.info(f'User @{user.username} (ID: {user.id}) issued /stats command.')
+    if user.id != ADMIN_CHAT_ID:
+        logger.warning(f'Unauthorized access attempt to /stats by user ID {user.id}.')
+        return
+    spawned = ', '.join(f'{family}: {count}' for family, count in sorted(executor.spawned.items())) or 'none'
+    text = f'{metrics.format_stats()}\n\n{result_cache.format_stats()}\nProcesses spawned: {spawned}'
+    await reply_long(update.message, text, 'stats.txt')
+    logger.info('Sent stats to admin.')
+
+async def audit_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    logger.info(f'User @{user.username} (ID: {user.id}) issued /audit command.')
+    if user.id != ADMIN_CHAT_ID:
+        logger.warning(f'Unauthorized access attempt to /audit by user ID {user.id}.')
+        return
+    try:
+        filters = audit.parse_filters(context.args)
+    except audit.AuditError as e:
+        await update.message.reply_text(f'{e}\nUsage: /audit [user=<id>] [command=<name>] [target=<glob>] [since=<30m|2h|7d>] [failed] [page=<n>]')
+        return
+    records, total = await audit_log.query_async(**filters)
+    await reply_long(update.message, audit.format_records(records, total, filters.get('page', 1)), 'audit.txt')
+    logger.info(f'Sent {len(records)} of {total} audit records to admin.')
+
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     logger.info(f'User @{user.username} (ID: {user.id}) issued /help command.')
@@ -113,39 +295,51 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             '/add_manager <user_id> - Add a new manager\n'
             '/remove_manager <user_id> - Remove a manager\n'
             '/list_managers - List all managers\n'
+            '/stats - Show command latency and error statistics\n'
+            '/audit [user=<id>] [command=<name>] [target=<glob>] [since=<2h>] [failed] [page=<n>] - Query the audit log\n'
             '\nManager commands:\n'
-            '/ensite <site_name> - Enable a site\n'
-            '/dissite <site_name> - Disable a site\n'
-            '/listsites - List available sites\n'
-            '/listensites - List enabled sites\n'
-            '/cpugov [governor] - Configure CPU governor\n'
-            '/ufw_allow <port> - Allow port through UFW\n'
-            '/ufw_deny <port> - Deny port through UFW\n'
-            '/ufw_status - Show UFW status\n'
+            '/ensite <site_name> [...] - Enable sites\n'
+            '/dissite <site_name> [...] - Disable sites\n'
+            '/listsites [filter] - List available sites\n'
+            '/listensites [filter] - List enabled sites\n'
+            '/cpugov [governor] [cpus] - Show or set CPU governor, e.g. /cpugov performance 0-15\n'
+            '/host_stats - Show CPU, memory, load and frequency over the last 15 minutes\n'
+            '/ufw_allow <ports>[/proto] [...] - Allow ports through UFW, e.g. 80,443,8000:8100/tcp\n'
+            '/ufw_deny <ports>[/proto] [...] - Deny ports through UFW\n'
+            '/ufw_status [port] [allow|deny] [refresh] - Show UFW status\n'
             '\nVM Management Commands:\n'
-            '/list_vms - List all virtual machines\n'
-            '/vm_status <vm_name> - Get status of a virtual machine\n'
-            '/start_vm <vm_name> - Start a virtual machine\n'
-            '/stop_vm <vm_name> - Stop a virtual machine\n'
-            '/reboot_vm <vm_name> - Reboot a virtual machine\n'
+            '/list_vms [refresh] - List all virtual machines\n'
+            '/vm_status <vm_name|glob> [...] [refresh] - Get status of virtual machines\n'
+            '/start_vm <vm_name|glob> [...] - Start virtual machines\n'
+            '/stop_vm <vm_name|glob|--all-running> [...] - Stop virtual machines\n'
+            '/reboot_vm <vm_name|glob|--all-running> [...] - Reboot virtual machines\n'
+            '    Add --then to start a new stage, --wait [--timeout=<s>] to wait for the new state (start/stop only), --parallel=<n>\n'
+            '\nFleet:\n'
+            '/fleet - Show fleet hosts, groups and whether their agents respond\n'
+            'Add @host, @group or @all to /listsites, /listensites, /ufw_status, /list_vms or /cpugov (show only) to run it on fleet hosts\n'
         )
     else:
         text = (
             'Available commands:\n'
-            '/ensite <site_name> - Enable a site\n'
-            '/dissite <site_name> - Disable a site\n'
-            '/listsites - List available sites\n'
-            '/listensites - List enabled sites\n'
-            '/cpugov [governor] - Configure CPU governor\n'
-            '/ufw_allow <port> - Allow port through UFW\n'
-            '/ufw_deny <port> - Deny port through UFW\n'
-            '/ufw_status - Show UFW status\n'
+            '/ensite <site_name> [...] - Enable sites\n'
+            '/dissite <site_name> [...] - Disable sites\n'
+            '/listsites [filter] - List available sites\n'
+            '/listensites [filter] - List enabled sites\n'
+            '/cpugov [governor] [cpus] - Show or set CPU governor, e.g. /cpugov performance 0-15\n'
+            '/host_stats - Show CPU, memory, load and frequency over the last 15 minutes\n'
+            '/ufw_allow <ports>[/proto] [...] - Allow ports through UFW, e.g. 80,443,8000:8100/tcp\n'
+            '/ufw_deny <ports>[/proto] [...] - Deny ports through UFW\n'
+            '/ufw_status [port] [allow|deny] [refresh] - Show UFW status\n'
             '\nVM Management Commands:\n'
-            '/list_vms - List all virtual machines\n'
-            '/vm_status <vm_name> - Get status of a virtual machine\n'
-            '/start_vm <vm_name> - Start a virtual machine\n'
-            '/stop_vm <vm_name> - Stop a virtual machine\n'
-            '/reboot_vm <vm_name> - Reboot a virtual machine\n'
+            '/list_vms [refresh] - List all virtual machines\n'
+            '/vm_status <vm_name|glob> [...] [refresh] - Get status of virtual machines\n'
+            '/start_vm <vm_name|glob> [...] - Start virtual machines\n'
+            '/stop_vm <vm_name|glob|--all-running> [...] - Stop virtual machines\n'
+            '/reboot_vm <vm_name|glob|--all-running> [...] - Reboot virtual machines\n'
+            '    Add --then to start a new stage, --wait [--timeout=<s>] to wait for the new state (start/stop only), --parallel=<n>\n'
+            '\nFleet:\n'
+            '/fleet - Show fleet hosts, groups and whether their agents respond\n'
+            'Add @host, @group or @all to /listsites, /listensites, /ufw_status, /list_vms or /cpugov (show only) to run it on fleet hosts\n'
         )
     await update.message.reply_text(text)
     logger.debug(f'Sent help information to user ID {user.id}.')
@@ -157,20 +351,17 @@ async def ensite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f'Unauthorized access attempt to /ensite by user ID {user.id}.')
         return
     if not context.args:
-        await update.message.reply_text('Usage: /ensite <site_name>')
+        await update.message.reply_text('Usage: /ensite <site_name> [...]')
         return
-    site_name = context.args[0]
-    try:
-        subprocess.check_output(['nginx_ensite', site_name])
-        subprocess.check_output(['systemctl', 'reload', 'nginx'])
-        await update.message.reply_text(f'Site {site_name} enabled.')
-        await log_and_notify_admin(update, context, f'Enabled site {site_name}')
-        logger.debug(f'Successfully enabled site {site_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error enabling site: {error_output}')
-        await log_and_notify_admin(update, context, f'Error enabling site {site_name}: {error_output}')
-        logger.error(f'Error enabling site {site_name} for user ID {user.id}: {error_output}')
+    site_names = ' '.join(context.args)
+    results, batch = await reload_scheduler.submit(('ensite', site) for site in context.args)
+    await update.message.reply_text(format_reload_result(results, batch))
+    if batch.ok:
+        await log_and_notify_admin(update, context, f'Enabled site {site_names}', target=site_names)
+        logger.debug(f'Successfully enabled site {site_names} for user ID {user.id}.')
+    else:
+        await log_and_notify_admin(update, context, f'Error enabling site {site_names}: {format_reload_result(results, batch)}', critical=True, target=site_names)
+        logger.error(f'Error enabling site {site_names} for user ID {user.id}.')
 
 async def dissite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -179,20 +370,17 @@ async def dissite_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f'Unauthorized access attempt to /dissite by user ID {user.id}.')
         return
     if not context.args:
-        await update.message.reply_text('Usage: /dissite <site_name>')
+        await update.message.reply_text('Usage: /dissite <site_name> [...]')
         return
-    site_name = context.args[0]
-    try:
-        subprocess.check_output(['nginx_dissite', site_name])
-        subprocess.check_output(['systemctl', 'reload', 'nginx'])
-        await update.message.reply_text(f'Site {site_name} disabled.')
-        await log_and_notify_admin(update, context, f'Disabled site {site_name}')
-        logger.debug(f'Successfully disabled site {site_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error disabling site: {error_output}')
-        await log_and_notify_admin(update, context, f'Error disabling site {site_name}: {error_output}')
-        logger.error(f'Error disabling site {site_name} for user ID {user.id}: {error_output}')
+    site_names = ' '.join(context.args)
+    results, batch = await reload_scheduler.submit(('dissite', site) for site in context.args)
+    await update.message.reply_text(format_reload_result(results, batch))
+    if batch.ok:
+        await log_and_notify_admin(update, context, f'Disabled site {site_names}', target=site_names)
+        logger.debug(f'Successfully disabled site {site_names} for user ID {user.id}.')
+    else:
+        await log_and_notify_admin(update, context, f'Error disabling site {site_names}: {format_reload_result(results, batch)}', critical=True, target=site_names)
+        logger.error(f'Error disabling site {site_names} for user ID {user.id}.')
 
 async def cpugov_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -200,23 +388,45 @@ async def cpugov_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /cpugov by user ID {user.id}.')
         return
+    target, args = split_target(context.args)
+    if target:
+        if any(not arg[0].isdigit() for arg in args):
+            await update.message.reply_text('Fleet hosts are read-only, use /cpugov @<target> [cpus] to show their governors.')
+            return
+        await fleet_reply(update, context, 'cpugov', target, args)
+        return
+    governor = None
+    cpus = None
     try:
-        if context.args:
-            governor = context.args[0]
-            output = subprocess.check_output(['bash', '-c', f'./cpugov.sh {governor}']).decode()
-            await update.message.reply_text(f'CPU Governor set to {governor}.\n{output}')
-            await log_and_notify_admin(update, context, f'Set CPU governor to {governor}')
-            logger.debug(f'Successfully set CPU governor to {governor} for user ID {user.id}.')
+        for arg in context.args:
+            if arg[0].isdigit():
+                cpus = parse_cpu_list(arg)
+            else:
+                governor = arg
+        target = f' on CPUs {format_cpu_list(cpus)}' if cpus else ''
+        if governor:
+            output = format_policies(await cpufreq.set_governor_async(governor, cpus))
+            await reply_long(update.message, f'CPU Governor set to {governor}{target}.\n{output}', 'cpugov.txt')
+            await log_and_notify_admin(update, context, f'Set CPU governor to {governor}{target}', target=format_cpu_list(cpus) if cpus else 'all')
+            logger.debug(f'Successfully set CPU governor to {governor}{target} for user ID {user.id}.')
         else:
-            output = subprocess.check_output(['bash', '-c', './cpugov.sh']).decode()
-            await update.message.reply_text(f'Current CPU Governor:\n{output}')
+            output = format_policies(await cpufreq.policies_async(cpus))
+            await reply_long(update.message, f'Current CPU Governor:\n{output}', 'cpugov.txt')
             await log_and_notify_admin(update, context, 'Checked CPU governor')
             logger.debug(f'Checked CPU governor for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error executing cpugov script: {error_output}')
-        await log_and_notify_admin(update, context, f'Error executing cpugov script: {error_output}')
-        logger.error(f'Error executing cpugov script for user ID {user.id}: {error_output}')
+    except CpufreqError as e:
+        await update.message.reply_text(f'Error configuring CPU governor: {e}')
+        await log_and_notify_admin(update, context, f'Error configuring CPU governor: {e}', critical=True)
+        logger.error(f'Error configuring CPU governor for user ID {user.id}: {e}')
+
+async def host_stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    logger.info(f'User @{user.username} (ID: {user.id}) issued /host_stats command.')
+    if not is_manager(user.id):
+        logger.warning(f'Unauthorized access attempt to /host_stats by user ID {user.id}.')
+        return
+    await reply_long(update.message, format_host_stats(host_sampler), 'host_stats.txt')
+    logger.debug(f'Sent host stats to user ID {user.id}.')
 
 async def ufw_allow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -225,19 +435,24 @@ async def ufw_allow_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f'Unauthorized access attempt to /ufw_allow by user ID {user.id}.')
         return
     if not context.args:
-        await update.message.reply_text('Usage: /ufw_allow <port>')
+        await update.message.reply_text('Usage: /ufw_allow <ports>[/proto] [...], e.g. /ufw_allow 80,443,8000:8100/tcp')
         return
-    port = context.args[0]
+    port = ' '.join(context.args)
+    progress = await ProgressMessage.start(update.message, f'Allowing port {port} through UFW...')
     try:
-        subprocess.check_output(['ufw', 'allow', port])
-        await update.message.reply_text(f'Port {port} allowed through UFW.')
-        await log_and_notify_admin(update, context, f'Allowed port {port} through UFW')
-        logger.debug(f'Allowed port {port} through UFW for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error allowing port: {error_output}')
-        await log_and_notify_admin(update, context, f'Error allowing port {port}: {error_output}')
-        logger.error(f'Error allowing port {port} for user ID {user.id}: {error_output}')
+        results = await firewall.apply('allow', context.args, on_output=progress.feed)
+        output = format_ufw_results('allow', results)
+        await progress.finish(output)
+        if all(result.ok for result in results):
+            await log_and_notify_admin(update, context, f'Allowed port {port} through UFW', target=port)
+            logger.debug(f'Allowed port {port} through UFW for user ID {user.id}.')
+        else:
+            await log_and_notify_admin(update, context, f'Error allowing port {port}: {output}', critical=True, target=port)
+            logger.error(f'Error allowing port {port} for user ID {user.id}: {output}')
+    except FirewallError as e:
+        await progress.finish(f'Error allowing port: {e}')
+        await log_and_notify_admin(update, context, f'Error allowing port {port}: {e}', critical=True, target=port)
+        logger.error(f'Error allowing port {port} for user ID {user.id}: {e}')
 
 async def ufw_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -245,15 +460,33 @@ async def ufw_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE)
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /ufw_status by user ID {user.id}.')
         return
+    target, args = split_target(context.args)
+    if target:
+        await fleet_reply(update, context, 'ufw_status', target, args)
+        return
+    port = None
+    action = None
+    for arg in context.args:
+        if arg.isdigit():
+            port = int(arg)
+        elif arg.lower() in UFW_ACTIONS:
+            action = arg.lower()
+    refresh = bool(REFRESH_FLAGS.intersection(context.args))
+
+    async def load():
+        rules = await firewall.rules(port=port, action=action, refresh=refresh)
+        active, _ = await firewall.state()
+        return f'UFW Status: {format_ufw_rules(active, rules)}\n\n{format_ufw_age(firewall.age())}'
+
     try:
-        output = subprocess.check_output(['ufw', 'status']).decode()
-        await update.message.reply_text(f'UFW Status: {output}')
+        text = await cached_reply(('ufw_status', port, action), load, refresh)
+        await reply_long(update.message, text, 'ufw_status.txt')
         await log_and_notify_admin(update, context, f'Sent UFW Status')
         logger.debug(f'Sent UFW Status user ID {user.id}.')
     except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
+        error_output = executor.error_text(e)
         await update.message.reply_text(f'Error showing UFW Status: {error_output}')
-        await log_and_notify_admin(update, context, f'Error showing UFW Status: {error_output}')
+        await log_and_notify_admin(update, context, f'Error showing UFW Status: {error_output}', critical=True)
         logger.error(f'Error Sending UFW Status user ID {user.id}: {error_output}')
 
 async def ufw_deny_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -263,19 +496,24 @@ async def ufw_deny_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.warning(f'Unauthorized access attempt to /ufw_deny by user ID {user.id}.')
         return
     if not context.args:
-        await update.message.reply_text('Usage: /ufw_deny <port>')
+        await update.message.reply_text('Usage: /ufw_deny <ports>[/proto] [...], e.g. /ufw_deny 80,443,8000:8100/tcp')
         return
-    port = context.args[0]
+    port = ' '.join(context.args)
+    progress = await ProgressMessage.start(update.message, f'Denying port {port} through UFW...')
     try:
-        subprocess.check_output(['ufw', 'deny', port])
-        await update.message.reply_text(f'Port {port} denied through UFW.')
-        await log_and_notify_admin(update, context, f'Denied port {port} through UFW')
-        logger.debug(f'Denied port {port} through UFW for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error denying port: {error_output}')
-        await log_and_notify_admin(update, context, f'Error denying port {port}: {error_output}')
-        logger.error(f'Error denying port {port} for user ID {user.id}: {error_output}')
+        results = await firewall.apply('deny', context.args, on_output=progress.feed)
+        output = format_ufw_results('deny', results)
+        await progress.finish(output)
+        if all(result.ok for result in results):
+            await log_and_notify_admin(update, context, f'Denied port {port} through UFW', target=port)
+            logger.debug(f'Denied port {port} through UFW for user ID {user.id}.')
+        else:
+            await log_and_notify_admin(update, context, f'Error denying port {port}: {output}', critical=True, target=port)
+            logger.error(f'Error denying port {port} for user ID {user.id}: {output}')
+    except FirewallError as e:
+        await progress.finish(f'Error denying port: {e}')
+        await log_and_notify_admin(update, context, f'Error denying port {port}: {e}', critical=True, target=port)
+        logger.error(f'Error denying port {port} for user ID {user.id}: {e}')
 
 async def list_vms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -283,14 +521,23 @@ async def list_vms_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /list_vms by user ID {user.id}.')
         return
+    target, args = split_target(context.args)
+    if target:
+        await fleet_reply(update, context, 'list_vms', target, args)
+        return
+    refresh = bool(REFRESH_FLAGS.intersection(context.args))
     try:
-        output = subprocess.check_output(['virsh', 'list', '--all']).decode()
-        await update.message.reply_text(f'Virtual Machines:\n{output}')
+        if refresh:
+            await vm_inventory.refresh()
+        else:
+            await vm_inventory.ensure_loaded()
+        text = f'Virtual Machines:\n{format_entries(vm_inventory.all())}\n\n{vm_inventory.staleness()}'
+        await reply_long(update.message, text, 'vms.txt')
         await log_and_notify_admin(update, context, 'Listed virtual machines')
         logger.debug(f'Successfully listed VMs for user ID {user.id}.')
-    except Exception as e:
+    except VMError as e:
         await update.message.reply_text(f'Error listing VMs: {e}')
-        await log_and_notify_admin(update, context, f'Error listing VMs: {e}')
+        await log_and_notify_admin(update, context, f'Error listing VMs: {e}', critical=True)
         logger.error(f'Error listing VMs for user ID {user.id}: {e}')
 
 async def vm_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -299,84 +546,82 @@ async def vm_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /vm_status by user ID {user.id}.')
         return
-    if not context.args:
-        await update.message.reply_text('Usage: /vm_status <vm_name>')
+    patterns = [arg for arg in context.args if arg not in REFRESH_FLAGS]
+    if not patterns:
+        await update.message.reply_text('Usage: /vm_status <vm_name|glob> [...] [refresh]')
         return
-    vm_name = context.args[0]
+    vm_names = ' '.join(patterns)
+    refresh = len(patterns) != len(context.args)
     try:
-        output = subprocess.check_output(['virsh', 'dominfo', vm_name]).decode()
-        await update.message.reply_text(f'Status of {vm_name}:\n{output}')
-        await log_and_notify_admin(update, context, f'Checked status of VM {vm_name}')
-        logger.debug(f'Checked status of VM {vm_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error getting status of VM {vm_name}: {error_output}')
-        await log_and_notify_admin(update, context, f'Error getting status of VM {vm_name}: {error_output}')
-        logger.error(f'Error getting status of VM {vm_name} for user ID {user.id}: {error_output}')
-
-async def start_vm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if refresh:
+            await vm_inventory.refresh()
+        else:
+            await vm_inventory.ensure_loaded()
+        entries, unmatched = vm_inventory.match(patterns)
+        output = format_entries(entries) if entries else 'No matching VMs.'
+        if unmatched:
+            output += f'\nNot found: {", ".join(unmatched)}'
+        text = f'Status of {vm_names}:\n{output}\n\n{vm_inventory.staleness()}'
+        await reply_long(update.message, text, 'vm_status.txt')
+        await log_and_notify_admin(update, context, f'Checked status of VM {vm_names}', target=vm_names)
+        logger.debug(f'Checked status of VM {vm_names} for user ID {user.id}.')
+    except VMError as e:
+        error_output = str(e)
+        await update.message.reply_text(f'Error getting status of VM {vm_names}: {error_output}')
+        await log_and_notify_admin(update, context, f'Error getting status of VM {vm_names}: {error_output}', critical=True, target=vm_names)
+        logger.error(f'Error getting status of VM {vm_names} for user ID {user.id}: {error_output}')
+
+async def vm_power_command(update: Update, context: ContextTypes.DEFAULT_TYPE, command, action):
     user = update.effective_user
-    logger.info(f'User @{user.username} (ID: {user.id}) issued /start_vm command.')
+    logger.info(f'User @{user.username} (ID: {user.id}) issued /{command} command.')
     if not is_manager(user.id):
-        logger.warning(f'Unauthorized access attempt to /start_vm by user ID {user.id}.')
+        logger.warning(f'Unauthorized access attempt to /{command} by user ID {user.id}.')
         return
-    if not context.args:
-        await update.message.reply_text('Usage: /start_vm <vm_name>')
+    try:
+        request = parse_power_request(context.args, action)
+        if not context.args:
+            raise PowerError('No VMs given.')
+    except PowerError as e:
+        await update.message.reply_text(
+            f'{e}\nUsage: /{command} <vm_name|glob|--all-running> [...] [--then <vm_name|glob> ...] '
+            f'[--wait] [--timeout=<seconds>] [--parallel=<n>]'
+        )
         return
-    vm_name = context.args[0]
+    _, _, title, verb = POWER_ACTIONS[action]
     try:
-        subprocess.check_output(['virsh', 'start', vm_name])
-        await update.message.reply_text(f'VM {vm_name} started.')
-        await log_and_notify_admin(update, context, f'Started VM {vm_name}')
-        logger.debug(f'Started VM {vm_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error starting VM {vm_name}: {error_output}')
-        await log_and_notify_admin(update, context, f'Error starting VM {vm_name}: {error_output}')
-        logger.error(f'Error starting VM {vm_name} for user ID {user.id}: {error_output}')
+        await vm_inventory.refresh()
+    except VMError as e:
+        await update.message.reply_text(f'Error listing VMs: {e}')
+        await log_and_notify_admin(update, context, f'Error listing VMs: {e}', critical=True)
+        logger.error(f'Error listing VMs for user ID {user.id}: {e}')
+        return
+    progress = await ProgressMessage.start(update.message, f'{title} VMs...')
+    operation = PowerOperation(
+        vm_backend, vm_inventory, action, request,
+        on_change=lambda: progress.status(format_power_progress(operation)), on_output=progress.feed,
+    )
+    operation.plan()
+    progress.status(format_power_progress(operation))
+    ok = await operation.run()
+    names = ', '.join(sorted(operation.results)) or 'no VMs'
+    vm_names = ' '.join(sorted(operation.results) + operation.unmatched)
+    await progress.finish(format_power_results(operation))
+    if ok:
+        await log_and_notify_admin(update, context, f'VMs {verb}: {names}', target=vm_names)
+        logger.debug(f'VMs {verb} for user ID {user.id}: {names}.')
+    else:
+        failed = ', '.join([result.name for result in operation.results.values() if result.status != 'ok'] + operation.unmatched)
+        await log_and_notify_admin(update, context, f'Error: VMs not {verb}: {failed or "no matching VMs"}', critical=True, target=vm_names)
+        logger.error(f'Not all VMs {verb} for user ID {user.id}: {failed}.')
+
+async def start_vm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await vm_power_command(update, context, 'start_vm', 'start')
 
 async def stop_vm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    logger.info(f'User @{user.username} (ID: {user.id}) issued /stop_vm command.')
-    if not is_manager(user.id):
-        logger.warning(f'Unauthorized access attempt to /stop_vm by user ID {user.id}.')
-        return
-    if not context.args:
-        await update.message.reply_text('Usage: /stop_vm <vm_name>')
-        return
-    vm_name = context.args[0]
-    try:
-        subprocess.check_output(['virsh', 'shutdown', vm_name])
-        await update.message.reply_text(f'VM {vm_name} is shutting down.')
-        await log_and_notify_admin(update, context, f'Shutting down VM {vm_name}')
-        logger.debug(f'Shutting down VM {vm_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error stopping VM {vm_name}: {error_output}')
-        await log_and_notify_admin(update, context, f'Error stopping VM {vm_name}: {error_output}')
-        logger.error(f'Error stopping VM {vm_name} for user ID {user.id}: {error_output}')
+    await vm_power_command(update, context, 'stop_vm', 'shutdown')
 
 async def reboot_vm_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user = update.effective_user
-    logger.info(f'User @{user.username} (ID: {user.id}) issued /reboot_vm command.')
-    if not is_manager(user.id):
-        logger.warning(f'Unauthorized access attempt to /reboot_vm by user ID {user.id}.')
-        return
-    if not context.args:
-        await update.message.reply_text('Usage: /reboot_vm <vm_name>')
-        return
-    vm_name = context.args[0]
-    try:
-        subprocess.check_output(['virsh', 'reboot', vm_name])
-        await update.message.reply_text(f'VM {vm_name} is rebooting.')
-        await log_and_notify_admin(update, context, f'Rebooted VM {vm_name}')
-        logger.debug(f'Rebooted VM {vm_name} for user ID {user.id}.')
-    except subprocess.CalledProcessError as e:
-        error_output = e.output.decode()
-        await update.message.reply_text(f'Error rebooting VM {vm_name}: {error_output}')
-        await log_and_notify_admin(update, context, f'Error rebooting VM {vm_name}: {error_output}')
-        logger.error(f'Error rebooting VM {vm_name} for user ID {user.id}: {error_output}')
-
+    await vm_power_command(update, context, 'reboot_vm', 'reboot')
 
 async def listsites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
@@ -384,20 +629,19 @@ async def listsites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /listsites by user ID {user.id}.')
         return
+    target, args = split_target(context.args)
+    if target:
+        await fleet_reply(update, context, 'listsites', target, args)
+        return
+    pattern = context.args[0] if context.args else None
     try:
-        available_sites = subprocess.check_output(['ls', '/etc/nginx/sites-available']).decode().split()
-        enabled_sites = subprocess.check_output(['ls', '/etc/nginx/sites-enabled']).decode().split()
-        site_status = []
-        for site in available_sites:
-            status = 'Enabled' if site in enabled_sites else 'Disabled'
-            site_status.append(f'{site}: {status}')
-        output = '\n'.join(site_status)
-        await update.message.reply_text(f'Sites:\n{output}')
+        text = f'Sites:\n{format_sites(site_index.sites(pattern), site_index.dangling())}'
+        await reply_long(update.message, text, 'sites.txt')
         await log_and_notify_admin(update, context, 'Listed sites with status')
         logger.debug(f'Successfully listed sites with status for user ID {user.id}.')
     except Exception as e:
         await update.message.reply_text(f'Error listing sites: {e}')
-        await log_and_notify_admin(update, context, f'Error listing sites: {e}')
+        await log_and_notify_admin(update, context, f'Error listing sites: {e}', critical=True)
         logger.error(f'Error listing sites for user ID {user.id}: {e}')
 
 async def listensites_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -406,48 +650,163 @@ async def listensites_command(update: Update, context: ContextTypes.DEFAULT_TYPE
     if not is_manager(user.id):
         logger.warning(f'Unauthorized access attempt to /listensites by user ID {user.id}.')
         return
+    target, args = split_target(context.args)
+    if target:
+        await fleet_reply(update, context, 'listensites', target, args)
+        return
+    pattern = context.args[0] if context.args else None
     try:
-        output = subprocess.check_output(['ls', '/etc/nginx/sites-enabled']).decode()
-        await update.message.reply_text(f'Sites enabled:\n{output}')
+        text = f'Sites enabled:\n{format_enabled(site_index.enabled(pattern))}'
+        await reply_long(update.message, text, 'sites_enabled.txt')
         await log_and_notify_admin(update, context, 'Listed enabled sites')
         logger.debug(f'Successfully listed enabled sites for user ID {user.id}.')
     except Exception as e:
         await update.message.reply_text(f'Error listing enabled sites: {e}')
-        await log_and_notify_admin(update, context, f'Error listing enabled sites: {e}')
+        await log_and_notify_admin(update, context, f'Error listing enabled sites: {e}', critical=True)
         logger.error(f'Error listing enabled sites for user ID {user.id}: {e}')
 
-async def log_and_notify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str):
+async def fleet_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    log_message = f'User @{user.username} (ID: {user.id}) performed action: {message}'
-    logger.info(log_message)
-    await context.bot.send_message(chat_id=ADMIN_CHAT_ID, text=log_message)
+    logger.info(f'User @{user.username} (ID: {user.id}) issued /fleet command.')
+    if not is_manager(user.id):
+        logger.warning(f'Unauthorized access attempt to /fleet by user ID {user.id}.')
+        return
+    if not fleet:
+        await update.message.reply_text('Fleet mode is off, set FLEET_HOSTS to enable it.')
+        return
+    pings = await fleet.run(list(fleet.hosts), 'ping')
+    await reply_long(update.message, format_fleet(fleet, pings), 'fleet.txt')
+    logger.debug(f'Sent fleet status to user ID {user.id}.')
 
-def main():
-    application = ApplicationBuilder().token(TOKEN).build()
-
-    application.add_handler(CommandHandler('start', start))
-    application.add_handler(CommandHandler('add_manager', add_manager))
-    application.add_handler(CommandHandler('remove_manager', remove_manager))
-    application.add_handler(CommandHandler('list_managers', list_managers))
-    application.add_handler(CommandHandler('help', help_command))
-
-    application.add_handler(CommandHandler('ensite', ensite_command))
-    application.add_handler(CommandHandler('dissite', dissite_command))
-    application.add_handler(CommandHandler('cpugov', cpugov_command))
-    application.add_handler(CommandHandler('ufw_allow', ufw_allow_command))
-    application.add_handler(CommandHandler('ufw_deny', ufw_deny_command))
-    application.add_handler(CommandHandler('ufw_status', ufw_status_command))
-    application.add_handler(CommandHandler('listsites', listsites_command))
-    application.add_handler(CommandHandler('listensites', listensites_command))
+async def fleet_reply(update: Update, context: ContextTypes.DEFAULT_TYPE, command, target, args):
+    """Run `command` on the agents `target` names and reply with their merged output."""
+    user = update.effective_user
+    try:
+        names = fleet.resolve(target)
+    except FleetError as e:
+        await update.message.reply_text(str(e))
+        return
+    refresh = bool(REFRESH_FLAGS.intersection(args))
+
+    async def load():
+        return await fleet.run(names, command, args)
+
+    if command in RESULT_CACHE_TTLS:
+        results, status, age = await result_cache.get((command, f'@{target}', *args), load, refresh)
+        text = f'{format_fleet_results(results)}\n\n{format_marker(status, age)}'
+    else:
+        results = await load()
+        text = format_fleet_results(results)
+    await reply_long(update.message, text, f'{command}_{target}.txt')
+    failed = [result.host for result in results if not result.ok]
+    summary = f'Ran /{command} {" ".join(args)}'.rstrip() + f' on @{target}: {len(results) - len(failed)}/{len(results)} hosts ok'
+    if failed:
+        await log_and_notify_admin(update, context, f'{summary}, failed on {", ".join(failed)}', critical=True, target=f'@{target}')
+        logger.error(f'/{command} failed on {", ".join(failed)} for user ID {user.id}.')
+    else:
+        await log_and_notify_admin(update, context, summary, target=f'@{target}')
+        logger.debug(f'Ran /{command} on @{target} for user ID {user.id}.')
+
+async def cached_reply(key, load, refresh=False):
+    text, status, age = await result_cache.get(key, load, refresh)
+    return f'{text}\n\n{format_marker(status, age)}'
+
+async def log_and_notify_admin(update: Update, context: ContextTypes.DEFAULT_TYPE, message: str, critical: bool = False, target: str = None):
+    user = update.effective_user
+    with metrics.phase('notify'):
+        log_message = f'User @{user.username} (ID: {user.id}) performed action: {message}'
+        logger.info(log_message)
+        notifier.notify(log_message, critical=critical)
+    audit.note(message, ok=not critical, target=target)
+    if critical:
+        metrics.record_error()
+
+async def post_init(application):
+    global metrics_server
+    notifier.start(application.bot.send_message)
+    audit_log.start()
+    metrics_server = await metrics.start_server(METRICS_LISTEN, METRICS_PORT)
+    await vm_inventory.start()
+    site_index.start(asyncio.get_running_loop())
+    host_sampler.start()
+
+async def post_stop(application):
+    if metrics_server is not None:
+        metrics_server.close()
+    site_index.stop()
+    await host_sampler.stop()
+    await vm_inventory.stop()
+    await notifier.stop()
+    await vm_backend.close()
+    await fleet.close()
+    await asyncio.to_thread(audit_log.stop)
+
+def command_handler(name, callback):
+    if name in INVALIDATES:
+        callback = result_cache.invalidating(INVALIDATES[name], callback)
+    return CommandHandler(name, metrics.instrument(name, audit_log.track(name, callback)))
+
+def build_application():
+    builder = (
+        ApplicationBuilder()
+        .token(TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .post_init(post_init)
+        .post_stop(post_stop)
+    )
+    if metrics.ENABLED:
+        builder = builder.request(metrics.InstrumentedRequest(connection_pool_size=256))
+    if TELEGRAM_API_BASE_URL:
+        builder = builder.base_url(f'{TELEGRAM_API_BASE_URL}/bot').base_file_url(f'{TELEGRAM_API_BASE_URL}/file/bot')
+    application = builder.build()
+
+    application.add_handler(command_handler('start', start))
+    application.add_handler(command_handler('add_manager', add_manager))
+    application.add_handler(command_handler('remove_manager', remove_manager))
+    application.add_handler(command_handler('list_managers', list_managers))
+    application.add_handler(command_handler('stats', stats_command))
+    application.add_handler(command_handler('audit', audit_command))
+    application.add_handler(command_handler('help', help_command))
+
+    application.add_handler(command_handler('ensite', ensite_command))
+    application.add_handler(command_handler('dissite', dissite_command))
+    application.add_handler(command_handler('cpugov', cpugov_command))
+    application.add_handler(command_handler('host_stats', host_stats_command))
+    application.add_handler(command_handler('fleet', fleet_command))
+    application.add_handler(command_handler('ufw_allow', ufw_allow_command))
+    application.add_handler(command_handler('ufw_deny', ufw_deny_command))
+    application.add_handler(command_handler('ufw_status', ufw_status_command))
+    application.add_handler(command_handler('listsites', listsites_command))
+    application.add_handler(command_handler('listensites', listensites_command))
 
     # Register new VM management commands
-    application.add_handler(CommandHandler('list_vms', list_vms_command))
-    application.add_handler(CommandHandler('vm_status', vm_status_command))
-    application.add_handler(CommandHandler('start_vm', start_vm_command))
-    application.add_handler(CommandHandler('stop_vm', stop_vm_command))
-    application.add_handler(CommandHandler('reboot_vm', reboot_vm_command))
+    application.add_handler(command_handler('list_vms', list_vms_command))
+    application.add_handler(command_handler('vm_status', vm_status_command))
+    application.add_handler(command_handler('start_vm', start_vm_command))
+    application.add_handler(command_handler('stop_vm', stop_vm_command))
+    application.add_handler(command_handler('reboot_vm', reboot_vm_command))
+    return application
 
-    application.run_polling()
+def main():
+    application = build_application()
+    # Both modes drain in-flight handlers and run post_stop before exiting
+    if BOT_MODE == 'webhook':
+        if not WEBHOOK_URL or not WEBHOOK_SECRET:
+            raise SystemExit('BOT_MODE=webhook requires WEBHOOK_URL and WEBHOOK_SECRET to be set.')
+        logger.info(f'Starting in webhook mode on {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}.')
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            cert=WEBHOOK_CERT,
+            key=WEBHOOK_KEY,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+    else:
+        logger.info('Starting in polling mode.')
+        application.run_polling()
 
 if __name__ == '__main__':
     main()
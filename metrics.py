@@ -0,0 +1,253 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import logging
+import os
+import time
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Everything here is a no-op unless METRICS_ENABLED is set, so the handlers
+# pay nothing for instrumentation they don't use.
+ENABLED = os.getenv('METRICS_ENABLED', '0').lower() in ('1', 'true', 'yes')
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (0, 64, 256, 1024, 4096, 16384, 65536, 262144, 1048576)
+
+_command = contextvars.ContextVar('command', default='background')
+_null = contextlib.nullcontext()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} counter'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+
+class Gauge(Counter):
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} gauge'
+        for labels, value in sorted(self.values.items()):
+            yield f'{self.name}{_labels(self.labels, labels)} {value}'
+
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = buckets
+        # labels -> [per-bucket counts (last one is +Inf), sum, count]
+        self.values = {}
+
+    def observe(self, value, *labels):
+        series = self.values.get(labels)
+        if series is None:
+            series = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect.bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def quantile(self, q, *labels):
+        series = self.values.get(labels)
+        if not series or not series[2]:
+            return None
+        rank = q * series[2]
+        seen = 0
+        for i, count in enumerate(series[0]):
+            if seen + count >= rank and count:
+                lower = self.buckets[i - 1] if i else 0.0
+                upper = self.buckets[i] if i < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+    def render(self):
+        yield f'# HELP {self.name} {self.help}'
+        yield f'# TYPE {self.name} histogram'
+        for labels, (counts, total, count) in sorted(self.values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + ('+Inf',), counts):
+                cumulative += bucket_count
+                le = 'le="%s"' % bound
+                yield f'{self.name}_bucket{_labels(self.labels, labels, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labels, labels)} {total}'
+            yield f'{self.name}_count{_labels(self.labels, labels)} {count}'
+
+
+command_seconds = Histogram('gdc_command_seconds', 'End-to-end handler latency.', ('command',))
+phase_seconds = Histogram('gdc_phase_seconds', 'Time spent per phase of a handler.', ('command', 'phase'))
+commands_total = Counter('gdc_commands_total', 'Handled commands.', ('command',))
+command_errors = Counter('gdc_command_errors_total', 'Commands that failed or raised.', ('command',))
+in_flight = Gauge('gdc_commands_in_flight', 'Commands currently being handled.', ('command',))
+process_exits = Counter('gdc_process_exits_total', 'External process exits by exit code.', ('command', 'family', 'code'))
+process_output_bytes = Histogram('gdc_process_output_bytes', 'Size of external process output.', ('family',), SIZE_BUCKETS)
+
+REGISTRY = (command_seconds, phase_seconds, commands_total, command_errors, in_flight, process_exits, process_output_bytes)
+
+
+@contextlib.contextmanager
+def _timed_phase(name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_seconds.observe(time.perf_counter() - started, _command.get(), name)
+
+
+def phase(name):
+    """Context manager timing a phase (auth, exec, telegram, notify) of the current command."""
+    if not ENABLED:
+        return _null
+    return _timed_phase(name)
+
+
+def timed(name, func):
+    """Wrap a plain function so each call is recorded as phase `name`."""
+    if not ENABLED:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _timed_phase(name):
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def record_process(family, returncode, output_size):
+    if ENABLED:
+        # Timeouts are recorded as 'timeout'; keep every code a string so labels sort
+        process_exits.inc(_command.get(), family, str(returncode))
+        process_output_bytes.observe(output_size, family)
+
+
+def record_error():
+    if ENABLED:
+        command_errors.inc(_command.get())
+
+
+def instrument(command, callback):
+    """Wrap a handler callback with latency, in-flight and error metrics."""
+    if not ENABLED:
+        return callback
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        token = _command.set(command)
+        in_flight.inc(command)
+        started = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            command_errors.inc(command)
+            raise
+        finally:
+            command_seconds.observe(time.perf_counter() - started, command)
+            commands_total.inc(command)
+            in_flight.dec(command)
+            _command.reset(token)
+    return wrapper
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that times every Bot API call as the `telegram` phase."""
+
+    async def do_request(self, *args, **kwargs):
+        with _timed_phase('telegram'):
+            return await super().do_request(*args, **kwargs)
+
+
+def render():
+    return '\n'.join(line for metric in REGISTRY for line in metric.render()) + '\n'
+
+
+async def _serve(reader, writer):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        path = request_line.split()[1] if len(request_line.split()) > 1 else b'/'
+        if path.split(b'?')[0] == b'/metrics':
+            status, body = '200 OK', render().encode()
+        else:
+            status, body = '404 Not Found', b'Not found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def start_server(host, port):
+    """Serve the Prometheus text format on http://host:port/metrics."""
+    if not ENABLED:
+        return None
+    server = await asyncio.start_server(_serve, host, port)
+    logger.info(f'Serving metrics on http://{host}:{port}/metrics.')
+    return server
+
+
+def _ms(seconds):
+    return '-' if seconds is None else f'{seconds * 1000:.1f}'
+
+
+def format_stats():
+    if not ENABLED:
+        return 'Metrics are disabled. Set METRICS_ENABLED=1 to enable them.'
+    lines = ['Command      count  err  inflight  p50ms  p95ms  p99ms']
+    for (command,), count in sorted(commands_total.values.items()):
+        lines.append(
+            f'{command:<12} {count:>5}  {command_errors.values.get((command,), 0):>3}  '
+            f'{in_flight.values.get((command,), 0):>8}  {_ms(command_seconds.quantile(0.5, command)):>5}  '
+            f'{_ms(command_seconds.quantile(0.95, command)):>5}  {_ms(command_seconds.quantile(0.99, command)):>5}'
+        )
+    phases = {}
+    for (command, name), (_, total, count) in phase_seconds.values.items():
+        phases.setdefault(name, [0.0, 0])
+        phases[name][0] += total
+        phases[name][1] += count
+    if phases:
+        lines.append('\nPhase      calls  avg ms')
+        for name, (total, count) in sorted(phases.items()):
+            lines.append(f'{name:<10} {count:>5}  {total / count * 1000:.2f}')
+    exits = {}
+    for (_, family, code), count in process_exits.values.items():
+        exits[(family, code)] = exits.get((family, code), 0) + count
+    if exits:
+        lines.append('\nProcess exits (family/code: count)')
+        lines.extend(f'{family}/{code}: {count}' for (family, code), count in sorted(exits.items()))
+    return '\n'.join(lines)
@@ -0,0 +1,179 @@
+import asyncio
+import contextvars
+import logging
+import os
+import subprocess
+from collections import namedtuple
+
+import executor
+
+logger = logging.getLogger(__name__)
+
+SiteChange = namedtuple('SiteChange', 'action site')
+# changed is False when the site was already in the requested state
+ChangeResult = namedtuple('ChangeResult', 'change ok output changed')
+
+CHANGE_COMMANDS = {
+    'ensite': 'nginx_ensite',
+    'dissite': 'nginx_dissite',
+}
+ROLLBACK_ACTIONS = {
+    'ensite': 'dissite',
+    'dissite': 'ensite',
+}
+PAST_TENSE = {
+    'ensite': 'enabled',
+    'dissite': 'disabled',
+}
+
+
+class Batch:
+    def __init__(self):
+        self.results = []
+        self.requests = 0
+        self.validated = None
+        self.validation_output = ''
+        self.reloaded = False
+        self.reload_output = ''
+
+    @property
+    def ok(self):
+        # A batch of no-op changes needs no reload
+        return all(result.ok for result in self.results) and (self.reloaded or self.validated is None)
+
+
+class ReloadScheduler:
+    """Coalesces site changes into a single nginx -t and reload.
+
+    Requests arriving within `debounce` seconds of each other (but no later
+    than `max_wait` after the first) are applied together, validated once
+    with `nginx -t` and followed by one reload. If validation fails, the
+    changes that actually flipped a site are rolled back and nginx is not
+    reloaded. Whether a change flipped a site is decided by its link in
+    `enabled_dir` before and after; without it every successful change
+    counts. Every requester gets the combined result of the batch.
+
+    Each change (and its rollback) runs in the context of the request that
+    submitted it, so per-request context such as the audit record sees its
+    own commands; validation and reload run in a context of their own.
+    """
+
+    def __init__(self, debounce=2.0, max_wait=10.0, enabled_dir=None,
+                 validate_cmd=('nginx', '-t'), reload_cmd=('systemctl', 'reload', 'nginx')):
+        self.debounce = debounce
+        self.enabled_dir = enabled_dir
+        self.max_wait = max_wait
+        self.validate_cmd = list(validate_cmd)
+        self.reload_cmd = list(reload_cmd)
+        self.reloads = 0
+        self._pending = []
+        self._wakeup = asyncio.Event()
+        self._timer = None
+        self._flush_lock = asyncio.Lock()
+
+    async def submit(self, changes):
+        """Queue changes and wait for the batch they end up in.
+
+        Returns (results for these changes, Batch).
+        """
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(([SiteChange(*change) for change in changes], future, contextvars.copy_context()))
+        self._wakeup.set()
+        if self._timer is None:
+            self._timer = contextvars.Context().run(asyncio.create_task, self._wait_and_flush())
+        return await future
+
+    async def _wait_and_flush(self):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.max_wait
+        while True:
+            self._wakeup.clear()
+            timeout = min(self.debounce, deadline - loop.time())
+            if timeout <= 0:
+                break
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                break
+        pending, self._pending = self._pending, []
+        self._timer = None
+        async with self._flush_lock:
+            await self._flush(pending)
+
+    async def _run(self, args):
+        try:
+            await executor.check_output(args, family='nginx')
+            return True, ''
+        except (subprocess.CalledProcessError, OSError) as e:
+            return False, executor.error_text(e)
+
+    def _enabled(self, site):
+        return os.path.lexists(os.path.join(self.enabled_dir, site))
+
+    async def _apply(self, change):
+        if self.enabled_dir is None:
+            ok, output = await self._run([CHANGE_COMMANDS[change.action], change.site])
+            return ChangeResult(change, ok, output, ok)
+        before = self._enabled(change.site)
+        ok, output = await self._run([CHANGE_COMMANDS[change.action], change.site])
+        return ChangeResult(change, ok, output, ok and self._enabled(change.site) != before)
+
+    async def _apply_in(self, context, change):
+        return await context.run(asyncio.create_task, self._apply(change))
+
+    async def _flush(self, pending):
+        batch = Batch()
+        batch.requests = len(pending)
+        contexts = []
+        try:
+            for changes, _, context in pending:
+                for change in changes:
+                    batch.results.append(await self._apply_in(context, change))
+                    contexts.append(context)
+            applied = [(result.change, context) for result, context in zip(batch.results, contexts) if result.changed]
+            if applied:
+                batch.validated, batch.validation_output = await self._run(self.validate_cmd)
+                if batch.validated:
+                    batch.reloaded, batch.reload_output = await self._run(self.reload_cmd)
+                    self.reloads += 1
+                else:
+                    logger.error(f'nginx -t failed, rolling back {len(applied)} site changes: {batch.validation_output}')
+                    for change, context in reversed(applied):
+                        await self._apply_in(context, SiteChange(ROLLBACK_ACTIONS[change.action], change.site))
+            logger.info(
+                f'Changed {len(applied)}/{len(batch.results)} sites from {batch.requests} requests '
+                f'(validated: {batch.validated}, reloaded: {batch.reloaded}).'
+            )
+        except BaseException as e:
+            for _, future, _ in pending:
+                if not future.done():
+                    future.set_exception(e)
+            raise
+        offset = 0
+        for changes, future, _ in pending:
+            if not future.done():
+                future.set_result((batch.results[offset:offset + len(changes)], batch))
+            offset += len(changes)
+
+
+def format_result(results, batch):
+    lines = []
+    for result in results:
+        if result.ok and not result.changed:
+            lines.append(f'Site {result.change.site} already {PAST_TENSE[result.change.action]}.')
+        elif result.ok and batch.validated is False:
+            lines.append(f'Site {result.change.site} rolled back.')
+        elif result.ok:
+            lines.append(f'Site {result.change.site} {PAST_TENSE[result.change.action]}.')
+        else:
+            lines.append(f'Error with site {result.change.site}: {result.output}')
+    summary = f'{len(batch.results)} site changes from {batch.requests} requests'
+    if batch.validated is None:
+        lines.append(f'{summary}, nothing to reload.')
+    elif not batch.validated:
+        lines.append(f'{summary}: nginx -t failed, changes rolled back and nginx NOT reloaded:\n{batch.validation_output}')
+    elif batch.reloaded:
+        lines.append(f'{summary}: nginx -t passed, nginx reloaded.')
+    else:
+        lines.append(f'{summary}: nginx -t passed but reload failed:\n{batch.reload_output}')
+    return '\n'.join(lines)
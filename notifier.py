@@ -0,0 +1,135 @@
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+MESSAGE_LIMIT = 4096
+
+_STOP = object()
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        self._refill()
+        while self._tokens < 1:
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+            self._refill()
+        self._tokens -= 1
+
+
+class AdminNotifier:
+    """Background delivery of admin notifications.
+
+    notify() only enqueues, so handlers never wait on the Telegram API.
+    Events arriving within `window` seconds of each other are merged into one
+    digest message, sends are paced by a token bucket to stay under the per-chat
+    flood limits, and critical events skip the window. stop() flushes whatever
+    is still pending.
+    """
+
+    def __init__(self, chat_id, window=5.0, rate_per_minute=20, burst=3):
+        self.chat_id = chat_id
+        self.window = window
+        self._bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self._queue = asyncio.Queue()
+        self._send = None
+        self._task = None
+
+    def start(self, send):
+        self._send = send
+        self._task = asyncio.create_task(self._run())
+        logger.info(f'Admin notifier started (window: {self.window}s).')
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._queue.put_nowait(_STOP)
+        await self._task
+        self._task = None
+        logger.info('Admin notifier stopped, pending events flushed.')
+
+    def notify(self, text, critical=False):
+        self._queue.put_nowait((text, critical))
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        pending = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(deadline - loop.time(), 0)
+            try:
+                event = await asyncio.wait_for(self._queue.get(), timeout)
+            except asyncio.TimeoutError:
+                event = None
+            if event is _STOP:
+                if pending:
+                    await self._deliver(pending)
+                return
+            if event is not None:
+                text, critical = event
+                if critical:
+                    await self._deliver([text])
+                else:
+                    pending.append(text)
+                    if deadline is None:
+                        deadline = loop.time() + self.window
+            if pending and loop.time() >= deadline:
+                await self._deliver(pending)
+                pending = []
+                deadline = None
+
+    async def _deliver(self, texts):
+        for message in _digest(texts):
+            await self._bucket.acquire()
+            await self._send_with_retry(message)
+
+    async def _send_with_retry(self, message, attempts=3):
+        for attempt in range(attempts):
+            try:
+                await self._send(chat_id=self.chat_id, text=message)
+                return
+            except Exception as e:
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after is None or attempt == attempts - 1:
+                    logger.error(f'Failed to send admin notification: {e}')
+                    return
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                logger.warning(f'Flood limit hit sending admin notification, retrying in {retry_after}s.')
+                await asyncio.sleep(retry_after)
+
+
+def _digest(texts):
+    if len(texts) == 1:
+        lines = texts
+    else:
+        lines = [f'{len(texts)} actions:'] + [f'- {text}' for text in texts]
+    messages = []
+    current = ''
+    for line in lines:
+        while len(line) > MESSAGE_LIMIT:
+            if current:
+                messages.append(current)
+                current = ''
+            messages.append(line[:MESSAGE_LIMIT])
+            line = line[MESSAGE_LIMIT:]
+        if current and len(current) + 1 + len(line) > MESSAGE_LIMIT:
+            messages.append(current)
+            current = line
+        else:
+            current = f'{current}\n{line}' if current else line
+    if current:
+        messages.append(current)
+    return messages
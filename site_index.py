@@ -0,0 +1,246 @@
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+from collections import namedtuple
+
+logger = logging.getLogger(__name__)
+
+# inotify constants from <sys/inotify.h>
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_ATTRIB | IN_DELETE_SELF | IN_MOVE_SELF
+RESCAN_MASK = IN_Q_OVERFLOW | IN_IGNORED | IN_DELETE_SELF | IN_MOVE_SELF
+
+_EVENT = struct.Struct('iIII')
+
+# An enabled entry: `target` is the resolved path for symlinks (None for plain
+# files) and `dangling` is set when the link points at nothing.
+EnabledEntry = namedtuple('EnabledEntry', 'name target dangling')
+
+
+def _libc():
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class Inotify:
+    def __init__(self):
+        self._libc = _libc()
+        if self._libc is None:
+            raise OSError('inotify is not available')
+        self.fd = self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+
+    def add_watch(self, path, mask):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read_events(self):
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, _cookie, length = _EVENT.unpack_from(data, offset)
+            offset += _EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(errors='surrogateescape')
+            offset += length
+            events.append((wd, mask, name))
+        return events
+
+    def close(self):
+        os.close(self.fd)
+
+
+class SiteIndex:
+    """In-memory index of nginx sites-available and sites-enabled.
+
+    Built with os.scandir and kept up to date from inotify events on both
+    directories. Where inotify is unavailable the directories are rescanned
+    on demand whenever their mtime changes. Nothing here forks a process.
+    """
+
+    def __init__(self, available_dir='/etc/nginx/sites-available', enabled_dir='/etc/nginx/sites-enabled'):
+        self.available_dir = available_dir
+        self.enabled_dir = enabled_dir
+        self._available = set()
+        self._enabled = {}
+        self._inotify = None
+        self._watches = {}
+        self._loop = None
+        self._mtimes = None
+        self.rebuild()
+
+    def _dir_mtimes(self):
+        try:
+            return os.stat(self.available_dir).st_mtime_ns, os.stat(self.enabled_dir).st_mtime_ns
+        except OSError:
+            return None
+
+    def _scan_available(self):
+        self._available = set()
+        with os.scandir(self.available_dir) as entries:
+            for entry in entries:
+                if not entry.is_dir():
+                    self._available.add(entry.name)
+
+    def _enabled_entry(self, name):
+        path = os.path.join(self.enabled_dir, name)
+        if not os.path.islink(path):
+            return EnabledEntry(name, None, False) if os.path.isfile(path) else None
+        target = os.path.realpath(path)
+        return EnabledEntry(name, target, not os.path.exists(target))
+
+    def _scan_enabled(self):
+        self._enabled = {}
+        with os.scandir(self.enabled_dir) as entries:
+            for entry in entries:
+                enabled = self._enabled_entry(entry.name)
+                if enabled is not None:
+                    self._enabled[entry.name] = enabled
+
+    def rebuild(self):
+        self._mtimes = self._dir_mtimes()
+        try:
+            self._scan_available()
+            self._scan_enabled()
+        except OSError as e:
+            logger.error(f'Failed to scan nginx site directories: {e}')
+        logger.debug(f'Site index rebuilt: {len(self._available)} available, {len(self._enabled)} enabled.')
+
+    def start(self, loop):
+        try:
+            self._inotify = Inotify()
+            for path in (self.available_dir, self.enabled_dir):
+                self._watches[self._inotify.add_watch(path, WATCH_MASK)] = path
+        except OSError as e:
+            logger.warning(f'inotify unavailable for nginx site index, rescanning on demand: {e}')
+            if self._inotify is not None:
+                self._inotify.close()
+            self._inotify = None
+            return
+        self._loop = loop
+        loop.add_reader(self._inotify.fd, self._on_events)
+        # Catch anything that changed between the initial scan and the watches
+        self.rebuild()
+        logger.info('Watching nginx site directories with inotify.')
+
+    def stop(self):
+        if self._inotify is not None:
+            self._loop.remove_reader(self._inotify.fd)
+            self._inotify.close()
+            self._inotify = None
+
+    def _on_events(self):
+        available_changed = False
+        for wd, mask, name in self._inotify.read_events():
+            if mask & IN_Q_OVERFLOW:
+                logger.warning('inotify queue overflowed, rebuilding site index.')
+                self.rebuild()
+                return
+            if mask & RESCAN_MASK:
+                logger.warning('Site directory watch lost, falling back to rescanning on demand.')
+                self.stop()
+                self.rebuild()
+                return
+            path = self._watches.get(wd)
+            if path == self.available_dir:
+                available_changed = True
+                if os.path.isfile(os.path.join(path, name)):
+                    self._available.add(name)
+                else:
+                    self._available.discard(name)
+            elif path == self.enabled_dir:
+                enabled = self._enabled_entry(name)
+                if enabled is None:
+                    self._enabled.pop(name, None)
+                else:
+                    self._enabled[name] = enabled
+        if available_changed:
+            # Links into sites-available may have started or stopped dangling
+            for name, enabled in self._enabled.items():
+                if enabled.target is not None:
+                    dangling = not os.path.exists(enabled.target)
+                    if dangling != enabled.dangling:
+                        self._enabled[name] = enabled._replace(dangling=dangling)
+
+    def _ensure_fresh(self):
+        if self._inotify is None and self._dir_mtimes() != self._mtimes:
+            self.rebuild()
+
+    def _enabled_names(self):
+        available_dir = os.path.realpath(self.available_dir)
+        names = set()
+        for enabled in self._enabled.values():
+            if enabled.target is None or enabled.dangling:
+                names.add(enabled.name)
+            elif os.path.dirname(enabled.target) == available_dir:
+                names.add(os.path.basename(enabled.target))
+        return names
+
+    def sites(self, pattern=None):
+        """Return sorted (name, enabled) pairs for sites-available."""
+        self._ensure_fresh()
+        enabled_names = self._enabled_names()
+        return [(name, name in enabled_names) for name in sorted(self._available) if matches(name, pattern)]
+
+    def enabled(self, pattern=None):
+        self._ensure_fresh()
+        return [self._enabled[name] for name in sorted(self._enabled) if matches(name, pattern)]
+
+    def dangling(self):
+        self._ensure_fresh()
+        return [enabled for enabled in self._enabled.values() if enabled.dangling]
+
+
+def matches(name, pattern):
+    """`foo*` matches by prefix, anything else by substring."""
+    if not pattern:
+        return True
+    if pattern.endswith('*'):
+        return name.startswith(pattern[:-1])
+    return pattern in name
+
+
+def format_sites(sites, dangling=()):
+    lines = [f'{name}: {"Enabled" if enabled else "Disabled"}' for name, enabled in sites]
+    for enabled in dangling:
+        lines.append(f'{enabled.name}: dangling link -> {enabled.target}')
+    return '\n'.join(lines) or 'No sites found.'
+
+
+def format_enabled(entries):
+    lines = []
+    for enabled in entries:
+        if enabled.target is None:
+            lines.append(enabled.name)
+        elif enabled.dangling:
+            lines.append(f'{enabled.name} -> {enabled.target} (dangling)')
+        elif os.path.basename(enabled.target) != enabled.name:
+            lines.append(f'{enabled.name} -> {enabled.target}')
+        else:
+            lines.append(enabled.name)
+    return '\n'.join(lines) or 'No sites enabled.'
@@ -0,0 +1,258 @@
+import array
+import asyncio
+import glob
+import logging
+import os
+import time
+
+from cpufreq import SYSFS_CPU_ROOT
+
+logger = logging.getLogger(__name__)
+
+PROC_ROOT = '/proc'
+SPARK_CHARS = '▁▂▃▄▅▆▇█'
+# (label, seconds) windows reported by format_stats
+WINDOWS = (('1m', 60), ('5m', 300), ('15m', 900))
+READ_SIZE = 16384
+
+# name -> (label, unit)
+METRICS = {
+    'cpu': ('CPU', '%'),
+    'iowait': ('IO wait', '%'),
+    'load1': ('Load 1m', ''),
+    'mem': ('Memory', '%'),
+    'swap': ('Swap', '%'),
+    'freq': ('CPU freq', ' MHz'),
+}
+
+
+class RingBuffer:
+    """Fixed-size ring of floats backed by a preallocated array."""
+
+    def __init__(self, size):
+        self.size = size
+        self._data = array.array('d', bytes(8 * size))
+        self._next = 0
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def append(self, value):
+        self._data[self._next] = value
+        self._next = (self._next + 1) % self.size
+        if self._count < self.size:
+            self._count += 1
+
+    def latest(self):
+        return self._data[self._next - 1] if self._count else None
+
+    def last(self, n):
+        """The most recent n values (fewer if not yet recorded), oldest first."""
+        n = min(n, self._count)
+        start = (self._next - n) % self.size
+        if start + n <= self.size:
+            return self._data[start:start + n]
+        return self._data[start:] + self._data[:self._next]
+
+
+def parse_thresholds(text):
+    """Parse e.g. "cpu=90,load1=8,mem=95" into {metric: threshold}."""
+    thresholds = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        name, _, value = item.partition('=')
+        if name not in METRICS:
+            raise ValueError(f'Unknown host metric: {name}')
+        thresholds[name] = float(value)
+    return thresholds
+
+
+class HostSampler:
+    """Samples CPU, memory, load and CPU frequency into ring buffers.
+
+    The procfs/sysfs files are opened once and re-read with pread() every
+    `interval` seconds. `history` samples are kept per metric. A metric above
+    its threshold for `sustain` seconds triggers on_alert(text) once, and
+    again only after it has dropped back below the threshold.
+    """
+
+    def __init__(self, proc_root=PROC_ROOT, cpufreq_root=SYSFS_CPU_ROOT, interval=5.0,
+                 history=720, thresholds=None, sustain=60.0, on_alert=None):
+        self.proc_root = proc_root
+        self.cpufreq_root = cpufreq_root
+        self.interval = interval
+        self.history = history
+        self.thresholds = dict(thresholds or {})
+        self.sustain = sustain
+        self.on_alert = on_alert
+        self.buffers = {name: RingBuffer(history) for name in METRICS}
+        self.samples = 0
+        self.cost = 0.0
+        self._fds = {}
+        self._freq_fds = []
+        self._prev_cpu = None
+        self._above = dict.fromkeys(METRICS, 0)
+        self._alerted = set()
+        self._task = None
+
+    def _open(self, name, path):
+        try:
+            self._fds[name] = os.open(path, os.O_RDONLY)
+        except OSError as e:
+            logger.warning(f'Host telemetry cannot read {path}: {e}')
+
+    def open(self):
+        for name in ('stat', 'meminfo', 'loadavg'):
+            self._open(name, os.path.join(self.proc_root, name))
+        # Per-CPU files where present, otherwise one per policy (as in a fake sysfs tree)
+        paths = (glob.glob(os.path.join(self.cpufreq_root, 'cpu[0-9]*', 'cpufreq', 'scaling_cur_freq'))
+                 or glob.glob(os.path.join(self.cpufreq_root, 'cpufreq', 'policy*', 'scaling_cur_freq')))
+        for path in paths:
+            try:
+                self._freq_fds.append(os.open(path, os.O_RDONLY))
+            except OSError:
+                pass
+
+    def close(self):
+        for fd in list(self._fds.values()) + self._freq_fds:
+            os.close(fd)
+        self._fds.clear()
+        self._freq_fds.clear()
+
+    def _read(self, name):
+        fd = self._fds.get(name)
+        return os.pread(fd, READ_SIZE, 0) if fd is not None else None
+
+    def _cpu(self, stat):
+        # cpu  user nice system idle iowait irq softirq steal ...
+        fields = stat[:stat.index(b'\n')].split()[1:9]
+        values = [int(field) for field in fields]
+        total = sum(values)
+        idle, iowait = values[3], values[4]
+        prev, self._prev_cpu = self._prev_cpu, (total, idle, iowait)
+        if prev is None or total <= prev[0]:
+            return None, None
+        elapsed = total - prev[0]
+        busy = elapsed - (idle - prev[1]) - (iowait - prev[2])
+        return 100.0 * busy / elapsed, 100.0 * (iowait - prev[2]) / elapsed
+
+    @staticmethod
+    def _memory(meminfo):
+        fields = {}
+        for line in meminfo.split(b'\n'):
+            key, _, rest = line.partition(b':')
+            if key in (b'MemTotal', b'MemAvailable', b'SwapTotal', b'SwapFree'):
+                fields[key] = int(rest.split()[0])
+        total = fields.get(b'MemTotal')
+        mem = 100.0 * (total - fields.get(b'MemAvailable', total)) / total if total else None
+        swap_total = fields.get(b'SwapTotal')
+        swap = 100.0 * (swap_total - fields.get(b'SwapFree', swap_total)) / swap_total if swap_total else 0.0
+        return mem, swap
+
+    def _record(self, name, value):
+        if value is None:
+            return
+        self.buffers[name].append(value)
+        threshold = self.thresholds.get(name)
+        if threshold is None:
+            return
+        label, unit = METRICS[name]
+        if value < threshold:
+            self._above[name] = 0
+            if name in self._alerted:
+                self._alerted.discard(name)
+                self._alert(f'Host {label} back to normal: {value:.1f}{unit} (threshold {threshold:g})')
+            return
+        self._above[name] += 1
+        if name not in self._alerted and self._above[name] * self.interval >= self.sustain:
+            self._alerted.add(name)
+            self._alert(f'Host {label} at {value:.1f}{unit}, above {threshold:g} for {self._above[name] * self.interval:g}s')
+
+    def sample(self):
+        """Read every source once and append the values to the ring buffers."""
+        started = time.thread_time()
+        stat = self._read('stat')
+        if stat:
+            cpu, iowait = self._cpu(stat)
+            self._record('cpu', cpu)
+            self._record('iowait', iowait)
+        meminfo = self._read('meminfo')
+        if meminfo:
+            mem, swap = self._memory(meminfo)
+            self._record('mem', mem)
+            self._record('swap', swap)
+        loadavg = self._read('loadavg')
+        if loadavg:
+            self._record('load1', float(loadavg.split(None, 1)[0]))
+        if self._freq_fds:
+            total = 0
+            for fd in self._freq_fds:
+                total += int(os.pread(fd, 32, 0))
+            self._record('freq', total / len(self._freq_fds) / 1000)
+        self.samples += 1
+        self.cost += time.thread_time() - started
+
+    def _alert(self, text):
+        logger.warning(text)
+        if self.on_alert is not None:
+            self.on_alert(text)
+
+    async def _run(self):
+        while True:
+            try:
+                self.sample()
+            except (OSError, ValueError) as e:
+                logger.error(f'Host telemetry sample failed: {e}')
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        self.open()
+        self._task = asyncio.create_task(self._run())
+        logger.info(f'Host telemetry sampling every {self.interval:g}s ({self.history} samples of history).')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.close()
+
+
+def sparkline(values, width=30):
+    if not values:
+        return ''
+    if len(values) > width:
+        step = len(values) / width
+        values = [
+            sum(values[int(i * step):int((i + 1) * step)]) / (int((i + 1) * step) - int(i * step))
+            for i in range(width)
+        ]
+    low, high = min(values), max(values)
+    span = (high - low) or 1.0
+    return ''.join(SPARK_CHARS[int((value - low) / span * (len(SPARK_CHARS) - 1))] for value in values)
+
+
+def format_stats(sampler):
+    lines = [f'Host stats (every {sampler.interval:g}s, {sampler.samples} samples)']
+    for name, (label, unit) in METRICS.items():
+        buffer = sampler.buffers[name]
+        if not len(buffer):
+            continue
+        parts = [f'{label}: {buffer.latest():.1f}{unit}']
+        for window, seconds in WINDOWS:
+            values = buffer.last(max(1, int(seconds / sampler.interval)))
+            parts.append(f'{window} {min(values):.1f}/{sum(values) / len(values):.1f}/{max(values):.1f}')
+        lines.append('  '.join(parts))
+        lines.append(f'  {sparkline(buffer.last(int(WINDOWS[-1][1] / sampler.interval)))}')
+    if len(lines) == 1:
+        lines.append('No samples yet.')
+    else:
+        lines.append('(min/avg/max per window, trend over the last 15m)')
+    if sampler.thresholds:
+        lines.append('Alerts: ' + ', '.join(f'{name} >= {value:g}' for name, value in sampler.thresholds.items()))
+    if sampler.samples:
+        lines.append(f'Sampler cost: {sampler.cost / sampler.samples * 1e6:.0f}µs CPU per sample')
+    return '\n'.join(lines)
@@ -0,0 +1,43 @@
+import os
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+STUBS = os.path.join(ROOT, 'bench', 'stubs')
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def stubs(tmp_path, monkeypatch):
+    """Put the bench stubs on PATH with their call log and state in tmp_path."""
+    monkeypatch.setenv('PATH', STUBS + os.pathsep + os.environ['PATH'])
+    monkeypatch.setenv('STUB_LATENCY', '0')
+    monkeypatch.setenv('STUB_LOG', str(tmp_path / 'stub.log'))
+    monkeypatch.setenv('STUB_UFW_STATE', str(tmp_path / 'ufw.json'))
+    monkeypatch.setenv('STUB_VIRSH_STATE', str(tmp_path / 'virsh.json'))
+    (tmp_path / 'stub.log').touch()
+
+    def calls():
+        return (tmp_path / 'stub.log').read_text().splitlines()
+
+    return SimpleNamespace(path=tmp_path, calls=calls)
+
+
+@pytest.fixture
+def sites(stubs, monkeypatch):
+    """A sites-available/sites-enabled pair the nginx stubs really link in."""
+    available = stubs.path / 'sites-available'
+    enabled = stubs.path / 'sites-enabled'
+    available.mkdir()
+    enabled.mkdir()
+    for name in ('alpha', 'beta', 'gamma'):
+        (available / name).write_text(f'server {{ server_name {name}.example.com; }}\n')
+    monkeypatch.setenv('NGINX_SITES_AVAILABLE', str(available))
+    monkeypatch.setenv('NGINX_SITES_ENABLED', str(enabled))
+
+    def enable(name):
+        os.symlink(available / name, enabled / name)
+
+    return SimpleNamespace(available=available, enabled=enabled, enable=enable, calls=stubs.calls)
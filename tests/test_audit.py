@@ -0,0 +1,86 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import audit
+from nginx_reload import ReloadScheduler
+
+
+def test_parse_filters():
+    before = time.time()
+    filters = audit.parse_filters(['user=42', 'cmd=/ensite', 'target=web*', 'since=2h', 'failed', 'page=3'])
+    since = filters.pop('since')
+    assert filters == {'user_id': 42, 'command': '/ensite', 'target': 'web*', 'failed': True, 'page': 3}
+    assert before - 7200 - 1 < since <= time.time() - 7200
+
+
+@pytest.mark.parametrize('arg', ['user=bob', 'since=2y', 'page=0', 'command=', 'failed=yes', 'colour=red'])
+def test_parse_filters_rejects(arg):
+    with pytest.raises(audit.AuditError):
+        audit.parse_filters([arg])
+
+
+@pytest.fixture
+def audit_log(tmp_path):
+    log = audit.AuditLog(str(tmp_path / 'audit.db'))
+    log.start()
+    yield log
+    log.stop()
+
+
+def call(handler, *args, user_id=1):
+    update = SimpleNamespace(effective_user=SimpleNamespace(id=user_id, username=f'user{user_id}'))
+    return handler(update, SimpleNamespace(args=list(args)))
+
+
+def records(log, **filters):
+    log.stop()
+    log.start()
+    return log.query(**filters)[0]
+
+
+def test_every_call_is_recorded_with_the_target_the_handler_gives(audit_log):
+    async def usage_error(update, context):
+        return
+
+    async def power(update, context):
+        audit.note('VMs shut down: web1, web2', target='web1 web2')
+
+    async def crash(update, context):
+        raise RuntimeError('boom')
+
+    async def run():
+        await call(audit_log.track('stop_vm', usage_error))
+        await call(audit_log.track('stop_vm', power), '--all-running', '--wait')
+        with pytest.raises(RuntimeError):
+            await call(audit_log.track('stop_vm', crash), 'web1')
+
+    asyncio.run(run())
+    crashed, powered, usage = records(audit_log)
+    assert (usage.result, usage.ok, usage.target) == (audit.NO_OUTCOME, None, None)
+    assert (powered.args, powered.target, powered.ok) == ('--all-running --wait', 'web1 web2', 1)
+    assert crashed.result == 'RuntimeError: boom' and crashed.ok == 0
+    assert [record.id for record in records(audit_log, target='*web2*')] == [powered.id]
+
+
+def test_batched_site_changes_are_audited_per_request(sites, audit_log):
+    scheduler = ReloadScheduler(debounce=0.05, enabled_dir=str(sites.enabled))
+
+    def handler(site):
+        async def ensite(update, context):
+            results, batch = await scheduler.submit([('ensite', site)])
+            audit.note(f'ensite {site}', ok=results[0].ok, target=site)
+        return ensite
+
+    async def run():
+        await asyncio.gather(
+            call(audit_log.track('ensite', handler('alpha')), 'alpha', user_id=1),
+            call(audit_log.track('ensite', handler('missing')), 'missing', user_id=2),
+        )
+
+    asyncio.run(run())
+    by_user = {record.user_id: record for record in records(audit_log)}
+    assert by_user[1].ok == 1 and not by_user[1].exit_code
+    assert by_user[2].ok == 0 and by_user[2].exit_code
@@ -0,0 +1,96 @@
+import asyncio
+
+from cache import HIT, MISS, SHARED, ResultCache
+
+
+class Loader:
+    """Counts calls and returns them numbered; blocks until `release` is set."""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        call = self.calls
+        await self.release.wait()
+        return f'result {call}'
+
+
+def test_concurrent_gets_share_one_load_and_later_ones_hit():
+    cache = ResultCache(ttls={'list_vms': 60})
+
+    async def run():
+        loader = Loader()
+        first = asyncio.create_task(cache.get(('list_vms',), loader))
+        second = asyncio.create_task(cache.get(('list_vms',), loader))
+        await asyncio.sleep(0)
+        loader.release.set()
+        results = [await first, await second]
+        value, status, _ = await cache.get(('list_vms',), loader)
+        return loader.calls, results, (value, status)
+
+    calls, [(first, first_status, _), (second, second_status, _)], hit = asyncio.run(run())
+    assert calls == 1
+    assert first == second == 'result 1'
+    assert (first_status, second_status) == (MISS, SHARED)
+    assert hit == ('result 1', HIT)
+
+
+def test_cancelling_the_first_caller_does_not_fail_the_others():
+    cache = ResultCache()
+
+    async def run():
+        loader = Loader()
+        leader = asyncio.create_task(cache.get(('ufw_status',), loader))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get(('ufw_status',), loader))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        loader.release.set()
+        return leader, await waiter, loader.calls, len(cache)
+
+    leader, (value, status, _), calls, cached = asyncio.run(run())
+    assert leader.cancelled()
+    assert (value, status, calls, cached) == ('result 1', SHARED, 1, 1)
+
+
+def test_invalidate_drops_results_and_loads_already_running():
+    cache = ResultCache()
+
+    async def run():
+        loader = Loader()
+        loader.release.set()
+        await cache.get(('listsites', 'a*'), loader)
+        await cache.get(('list_vms',), loader)
+        loader.release.clear()
+        running = asyncio.create_task(cache.get(('listsites', 'b*'), loader))
+        await asyncio.sleep(0)
+        cache.invalidate('listsites')
+        # The running load started before the change, so a new get must not share it
+        fresh = asyncio.create_task(cache.get(('listsites', 'b*'), loader))
+        await asyncio.sleep(0)
+        loader.release.set()
+        return await running, await fresh, await cache.get(('listsites', 'a*'), loader), sorted(cache._entries)
+
+    running, fresh, refetched, keys = asyncio.run(run())
+    assert running[:2] == ('result 3', MISS)
+    assert fresh[:2] == ('result 4', MISS)
+    assert refetched[:2] == ('result 5', MISS)
+    assert keys == [('list_vms',), ('listsites', 'a*'), ('listsites', 'b*')]
+    assert cache._entries[('listsites', 'b*')][0] == 'result 4'
+
+
+def test_lru_eviction_and_disabled_cache():
+    async def run(cache):
+        loader = Loader()
+        loader.release.set()
+        for key in ('a', 'b', 'a', 'c'):
+            await cache.get(('listsites', key), loader)
+        return loader.calls
+
+    cache = ResultCache(maxsize=2)
+    assert asyncio.run(run(cache)) == 3
+    assert list(cache._entries) == [('listsites', 'a'), ('listsites', 'c')]
+    assert asyncio.run(run(ResultCache(maxsize=0))) == 4
@@ -0,0 +1,91 @@
+import builtins
+
+import pytest
+
+import cpufreq
+from cpufreq import Cpufreq, CpufreqError, format_cpu_list, format_policies, parse_cpu_list
+
+
+def make_policy(root, number, cpus, governor='schedutil', cur=2000000, min_freq=800000, max_freq=3600000):
+    policy = root / 'cpufreq' / f'policy{number}'
+    policy.mkdir(parents=True)
+    files = {
+        'affected_cpus': cpus,
+        'scaling_governor': governor,
+        'scaling_available_governors': 'performance powersave schedutil',
+        'scaling_cur_freq': cur,
+        'scaling_min_freq': min_freq,
+        'scaling_max_freq': max_freq,
+    }
+    for name, value in files.items():
+        (policy / name).write_text(f'{value}\n')
+
+
+@pytest.fixture
+def sysfs(tmp_path):
+    # Two cores per policy; policy4 is pinned to performance
+    for number in (0, 2, 4, 6):
+        make_policy(tmp_path, number, f'{number} {number + 1}',
+                    governor='performance' if number == 4 else 'schedutil', cur=1000000 + number * 100000)
+    return tmp_path
+
+
+def test_parse_cpu_list():
+    assert parse_cpu_list('0-3,8, 10-11') == {0, 1, 2, 3, 8, 10, 11}
+    assert parse_cpu_list('5') == {5}
+    assert parse_cpu_list('') == set()
+    assert format_cpu_list({0, 1, 2, 3, 8, 10, 11}) == '0-3,8,10-11'
+
+
+@pytest.mark.parametrize('text', ['3-1', 'a', '1-', '-1', '0-3x'])
+def test_parse_cpu_list_rejects(text):
+    with pytest.raises(CpufreqError):
+        parse_cpu_list(text)
+
+
+def test_format_policies_groups_runs_of_equal_policies(sysfs):
+    lines = format_policies(Cpufreq(str(sysfs)).policies()).splitlines()
+    assert [line.split() for line in lines] == [
+        ['CPUs', 'Governor', 'Cur', 'MHz', 'Min-Max', 'MHz'],
+        ['0-3', 'schedutil', '1000-1200', '800-3600'],
+        ['4-5', 'performance', '1400', '800-3600'],
+        ['6-7', 'schedutil', '1600', '800-3600'],
+    ]
+
+
+def test_policies_filtered_by_cpu(sysfs):
+    policies = Cpufreq(str(sysfs)).policies({3, 4})
+    assert [policy.name for policy in policies] == ['policy2', 'policy4']
+    with pytest.raises(CpufreqError):
+        Cpufreq(str(sysfs)).policies({64})
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    written = []
+
+    def recording_open(path, mode='r', *args, **kwargs):
+        if 'w' in mode:
+            written.append(str(path))
+        return builtins.open(path, mode, *args, **kwargs)
+
+    monkeypatch.setattr(cpufreq, 'open', recording_open, raising=False)
+    return written
+
+
+def test_set_governor_writes_once_per_policy_that_differs(sysfs, writes):
+    policies = Cpufreq(str(sysfs)).set_governor('performance')
+    assert sorted(writes) == [str(sysfs / 'cpufreq' / f'policy{number}' / 'scaling_governor') for number in (0, 2, 6)]
+    assert {policy.governor for policy in policies} == {'performance'}
+
+
+def test_set_governor_already_set_writes_nothing(sysfs, writes):
+    policies = Cpufreq(str(sysfs)).set_governor('performance', {4, 5})
+    assert writes == []
+    assert [policy.governor for policy in policies] == ['performance']
+
+
+def test_set_governor_rejects_unavailable_governor(sysfs, writes):
+    with pytest.raises(CpufreqError, match='not available on policy0'):
+        Cpufreq(str(sysfs)).set_governor('ondemand')
+    assert writes == []
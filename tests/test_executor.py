@@ -0,0 +1,35 @@
+import asyncio
+import subprocess
+import sys
+import time
+
+import pytest
+
+import executor
+
+
+def test_output_is_streamed_and_collected():
+    seen = []
+    result = asyncio.run(executor.run(
+        [sys.executable, '-c', 'import sys; print("out"); print("err", file=sys.stderr); sys.exit(3)'],
+        on_output=lambda name, text: seen.append((name, text)),
+    ))
+    assert (result.returncode, result.stdout, result.stderr) == (3, b'out\n', b'err\n')
+    assert ''.join(text for name, text in seen if name == 'stdout') == 'out\n'
+    assert ''.join(text for name, text in seen if name == 'stderr') == 'err\n'
+    with pytest.raises(subprocess.CalledProcessError):
+        result.check_returncode()
+
+
+def test_timeout_is_bounded_when_a_child_escapes_the_process_group(monkeypatch):
+    monkeypatch.setattr(executor, 'KILL_READ_TIMEOUT', 0.2)
+    # The grandchild starts its own session, so killing the group leaves it
+    # running with stdout still open
+    script = ('import subprocess, sys, time; print("started", flush=True); '
+              'subprocess.Popen([sys.executable, "-c", "import time; time.sleep(3)"], start_new_session=True); '
+              'time.sleep(3)')
+    started = time.monotonic()
+    with pytest.raises(executor.CommandTimeout) as info:
+        asyncio.run(executor.run([sys.executable, '-c', script], timeout=0.5))
+    assert time.monotonic() - started < 2
+    assert info.value.output == b'started\n'
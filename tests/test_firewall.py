@@ -0,0 +1,52 @@
+import asyncio
+
+import pytest
+
+from firewall import Firewall, FirewallError, PortSpec, format_age, parse_spec, plan
+
+
+def test_plan_packs_ports_into_multiport_rules():
+    specs = [spec for arg in ('80,443/tcp', '8000:8100/tcp', '53/udp', '22', 'OpenSSH') for spec in parse_spec(arg)]
+    assert specs[2] == PortSpec(8000, 8100, 'tcp')
+    assert plan(specs) == ['22', 'OpenSSH', '80,443,8000:8100/tcp', '53/udp']
+    assert len(plan(parse_spec(','.join(str(port) for port in range(1000, 1020)) + '/tcp'))) == 2
+
+
+@pytest.mark.parametrize('arg', ['8000:8100', '80/icmp', '0', '90:80/tcp', 'a,b'])
+def test_parse_spec_rejects(arg):
+    with pytest.raises(FirewallError):
+        parse_spec(arg)
+
+
+def test_age_is_unknown_until_a_load_is_stored(stubs, monkeypatch):
+    monkeypatch.setenv('STUB_UFW_LATENCY', '0.2')
+    firewall = Firewall()
+
+    async def run():
+        assert firewall.age() is None
+        loading = asyncio.create_task(firewall.state())
+        await asyncio.sleep(0.05)
+        # A change lands while `ufw status` runs, so its output is not cached
+        firewall.invalidate()
+        active, _ = await loading
+        discarded = firewall.age()
+        await firewall.state()
+        return active, discarded, firewall.age()
+
+    active, discarded, stored = asyncio.run(run())
+    assert active and discarded is None and format_age(discarded) == 'Updated: unknown'
+    assert stored is not None and stored < 1
+
+
+def test_apply_invalidates_the_cached_rules(stubs):
+    firewall = Firewall()
+
+    async def run():
+        before = await firewall.rules(port=80)
+        results = await firewall.apply('allow', ['80,443/tcp'])
+        return before, results, firewall.age(), await firewall.rules(port=80)
+
+    before, results, age, after = asyncio.run(run())
+    assert before == [] and [result.ok for result in results] == [True]
+    assert age is None
+    assert [rule.to for rule in after] == ['80,443/tcp', '80,443/tcp']
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import shutil
+import subprocess
+
+import pytest
+
+import fleet_agent
+from fleet import (
+    Fleet,
+    FleetError,
+    Host,
+    client_ssl_context,
+    encode,
+    format_results,
+    parse_groups,
+    parse_hosts,
+    server_ssl_context,
+    split_target,
+)
+
+TOKEN = 'test-token'
+
+
+def test_parse_hosts_and_groups():
+    hosts = parse_hosts('web1=10.0.0.1:7071, web2=web2.example.com')
+    assert hosts == {
+        'web1': Host('web1', '10.0.0.1', 7071),
+        'web2': Host('web2', 'web2.example.com', 7070),
+    }
+    assert parse_groups('web=web1,web2; db=db1') == {'web': ('web1', 'web2'), 'db': ('db1',)}
+
+
+@pytest.mark.parametrize('text', ['web1', '=10.0.0.1', 'web1=10.0.0.1:http', 'all=10.0.0.1'])
+def test_parse_hosts_rejects(text):
+    with pytest.raises(FleetError):
+        parse_hosts(text)
+
+
+def test_split_target():
+    assert split_target(['80', '@web', 'allow']) == ('web', ['80', 'allow'])
+    assert split_target(['@all']) == ('all', [])
+    assert split_target(['site1', '@']) == (None, ['site1', '@'])
+    assert split_target([]) == (None, [])
+
+
+def test_resolve():
+    fleet = Fleet(parse_hosts('a=h:1,b=h:2,c=h:3'), parse_groups('ab=a,b'))
+    assert fleet.resolve('all') == ['a', 'b', 'c']
+    assert fleet.resolve('ab') == ['a', 'b']
+    assert fleet.resolve('c') == ['c']
+    with pytest.raises(FleetError):
+        fleet.resolve('d')
+    with pytest.raises(FleetError):
+        Fleet(parse_hosts('a=h:1'), parse_groups('g=a,z'))
+    with pytest.raises(FleetError):
+        Fleet({}).resolve('all')
+
+
+class ScriptedAgent:
+    """A minimal agent speaking the fleet protocol, for exercising the client.
+
+    "echo" replies once `batch` requests have arrived, in reverse order;
+    "hang" never replies; "drop" closes the connection.
+    """
+
+    def __init__(self, batch=1):
+        self.batch = batch
+        self.connections = 0
+        self._held = []
+
+    async def handle(self, reader, writer):
+        hello = json.loads(await reader.readline())
+        if hello.get('token') != TOKEN:
+            writer.write(encode({'id': 0, 'ok': False, 'error': 'invalid token'}))
+            writer.close()
+            return
+        self.connections += 1
+        writer.write(encode({'id': 0, 'ok': True, 'text': 'scripted'}))
+        while line := await reader.readline():
+            message = json.loads(line)
+            if message['command'] == 'drop':
+                writer.close()
+                return
+            if message['command'] == 'echo':
+                self._held.append(message)
+                if len(self._held) >= self.batch:
+                    for held in reversed(self._held):
+                        writer.write(encode({'id': held['id'], 'ok': True, 'text': ' '.join(held['args'])}))
+                    self._held = []
+
+    async def __aenter__(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+
+
+def test_requests_share_one_connection_and_get_their_own_replies():
+    async def run():
+        async with ScriptedAgent(batch=10) as agent:
+            fleet = Fleet({'a': Host('a', '127.0.0.1', agent.port)}, token=TOKEN, timeout=5, pool_size=1)
+            results = await asyncio.gather(*(fleet.run(['a'], 'echo', [str(i)]) for i in range(10)))
+            await fleet.close()
+            return results, agent.connections
+
+    results, connections = asyncio.run(run())
+    assert [result[0].text for result in results] == [str(i) for i in range(10)]
+    assert all(result[0].ok for result in results)
+    assert connections == 1
+
+
+def test_timeout_is_per_host_and_connection_stays_usable():
+    async def run():
+        async with ScriptedAgent() as agent:
+            hosts = {'a': Host('a', '127.0.0.1', agent.port), 'down': Host('down', '127.0.0.1', 1)}
+            fleet = Fleet(hosts, token=TOKEN, timeout=0.2)
+            hung, refused = await fleet.run(['a', 'down'], 'hang')
+            [after] = await fleet.run(['a'], 'echo', ['still', 'here'])
+            await fleet.close()
+            return hung, refused, after, agent.connections
+
+    hung, refused, after, connections = asyncio.run(run())
+    assert not hung.ok and 'timed out' in hung.text
+    assert not refused.ok and 'cannot connect' in refused.text
+    assert after.ok and after.text == 'still here'
+    assert connections == 1
+
+
+def test_lost_connection_fails_pending_request_and_reconnects():
+    async def run():
+        async with ScriptedAgent() as agent:
+            fleet = Fleet({'a': Host('a', '127.0.0.1', agent.port)}, token=TOKEN, timeout=2)
+            [dropped] = await fleet.run(['a'], 'drop')
+            [after] = await fleet.run(['a'], 'echo', ['ok'])
+            await fleet.close()
+            return dropped, after, agent.connections
+
+    dropped, after, connections = asyncio.run(run())
+    assert not dropped.ok and 'connection' in dropped.text
+    assert after.ok and connections == 2
+
+
+def test_bad_token_is_rejected():
+    async def run():
+        async with ScriptedAgent() as agent:
+            fleet = Fleet({'a': Host('a', '127.0.0.1', agent.port)}, token='wrong', timeout=2)
+            results = await fleet.run(['a'], 'echo', ['x'])
+            await fleet.close()
+            return results
+
+    [result] = asyncio.run(run())
+    assert not result.ok and result.text == 'invalid token'
+    text = format_results([result])
+    assert text.startswith('== a FAILED') and text.endswith('0/1 hosts ok')
+
+
+@pytest.fixture
+def agent(sites, tmp_path, monkeypatch):
+    policy = tmp_path / 'sys' / 'cpufreq' / 'policy0'
+    policy.mkdir(parents=True)
+    for name, value in {'affected_cpus': '0', 'scaling_governor': 'schedutil',
+                        'scaling_available_governors': 'performance schedutil'}.items():
+        (policy / name).write_text(value + '\n')
+    sites.enable('alpha')
+    monkeypatch.setenv('VM_BACKEND', 'fake')
+    monkeypatch.setattr(fleet_agent, 'NGINX_SITES_AVAILABLE', str(sites.available))
+    monkeypatch.setattr(fleet_agent, 'NGINX_SITES_ENABLED', str(sites.enabled))
+    monkeypatch.setattr(fleet_agent, 'CPUFREQ_SYSFS_ROOT', str(tmp_path / 'sys'))
+    return fleet_agent.FleetAgent('node1', TOKEN)
+
+
+def run_against_agent(agent, requests, server_ssl=None, client_ssl=None):
+    async def run():
+        server = await asyncio.start_server(agent.handle, '127.0.0.1', 0, ssl=server_ssl)
+        port = server.sockets[0].getsockname()[1]
+        fleet = Fleet({'node1': Host('node1', 'localhost', port)}, token=TOKEN, timeout=5, ssl=client_ssl)
+        try:
+            return [(await fleet.run(['node1'], command, args))[0] for command, args in requests]
+        finally:
+            await fleet.close()
+            server.close()
+    return asyncio.run(run())
+
+
+def test_agent_serves_read_commands_and_refuses_writes(agent):
+    sites, listed_vms, governors, write = run_against_agent(agent, [
+        ('listensites', []), ('list_vms', []), ('cpugov', ['0']), ('cpugov', ['performance']),
+    ])
+    assert sites.ok and sites.text == 'Sites enabled:\nalpha'
+    assert listed_vms.ok and 'vm000' in listed_vms.text
+    assert governors.ok and 'schedutil' in governors.text
+    assert not write.ok and 'read-only' in write.text
+    with open(f'{agent.cpufreq.root}/cpufreq/policy0/scaling_governor') as f:
+        assert f.read().strip() == 'schedutil'
+
+
+@pytest.mark.skipif(shutil.which('openssl') is None, reason='needs openssl to make a certificate')
+def test_agent_over_tls(agent, tmp_path):
+    cert, key = tmp_path / 'agent.pem', tmp_path / 'agent.key'
+    subprocess.run(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost', '-keyout', str(key), '-out', str(cert)],
+        check=True, capture_output=True,
+    )
+    [ping] = run_against_agent(
+        agent, [('ping', [])], server_ssl=server_ssl_context(str(cert), str(key)), client_ssl=client_ssl_context(str(cert)),
+    )
+    assert ping.ok and ping.text == 'node1'
+    # A client that does not trust the agent's certificate is refused
+    [untrusted] = run_against_agent(agent, [('ping', [])], server_ssl=server_ssl_context(str(cert), str(key)),
+                                    client_ssl=client_ssl_context())
+    assert not untrusted.ok and 'CERTIFICATE_VERIFY_FAILED' in untrusted.text
@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', True)
+    for metric in metrics.REGISTRY:
+        monkeypatch.setattr(metric, 'values', {})
+
+
+def test_histogram_quantiles_interpolate_within_buckets():
+    histogram = metrics.Histogram('h', 'Test.', buckets=(1, 2, 4))
+    assert histogram.quantile(0.5) is None
+    for value in (0.5, 0.5, 1.5, 1.5):
+        histogram.observe(value)
+    assert histogram.quantile(0.5) == 1.0
+    assert histogram.quantile(0.75) == 1.5
+    histogram.observe(10)
+    # Values past the last bucket are reported as the last bound
+    assert histogram.quantile(1.0) == 4
+
+
+def test_prometheus_text_format():
+    histogram = metrics.Histogram('gdc_test_seconds', 'Test latency.', ('command',), buckets=(0.1, 1))
+    histogram.observe(0.05, 'list "vms"')
+    histogram.observe(0.5, 'list "vms"')
+    counter = metrics.Counter('gdc_test_total', 'Tests.', ('command',))
+    counter.inc('a')
+    counter.inc('a', amount=2)
+    assert list(histogram.render()) == [
+        '# HELP gdc_test_seconds Test latency.',
+        '# TYPE gdc_test_seconds histogram',
+        'gdc_test_seconds_bucket{command="list \\"vms\\"",le="0.1"} 1',
+        'gdc_test_seconds_bucket{command="list \\"vms\\"",le="1"} 2',
+        'gdc_test_seconds_bucket{command="list \\"vms\\"",le="+Inf"} 2',
+        'gdc_test_seconds_sum{command="list \\"vms\\""} 0.55',
+        'gdc_test_seconds_count{command="list \\"vms\\""} 2',
+    ]
+    assert list(counter.render())[-1] == 'gdc_test_total{command="a"} 3'
+
+
+def test_endpoints_render_after_a_timeout(enabled):
+    async def handler(update, context):
+        metrics.record_process('ufw', 0, 10)
+        metrics.record_process('ufw', 'timeout', 0)
+        metrics.record_process('ufw', 1, 20)
+
+    async def run():
+        await metrics.instrument('ufw_status', handler)(SimpleNamespace(), SimpleNamespace())
+        server = await metrics.start_server('127.0.0.1', 0)
+        port = server.sockets[0].getsockname()[1]
+        replies = []
+        for path in ('/metrics', '/other'):
+            reader, writer = await asyncio.open_connection('127.0.0.1', port)
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: x\r\n\r\n'.encode())
+            replies.append((await reader.read()).decode())
+            writer.close()
+        server.close()
+        return replies
+
+    page, missing = asyncio.run(run())
+    assert page.startswith('HTTP/1.1 200 OK')
+    for code in ('0', '1', 'timeout'):
+        assert f'gdc_process_exits_total{{command="ufw_status",family="ufw",code="{code}"}} 1' in page
+    assert 'gdc_commands_total{command="ufw_status"} 1' in page
+    assert missing.startswith('HTTP/1.1 404')
+    stats = metrics.format_stats()
+    assert 'ufw/0: 1\nufw/1: 1\nufw/timeout: 1' in stats
+    assert stats.splitlines()[1].split()[:2] == ['ufw_status', '1']
+
+
+def test_disabled_metrics_are_no_ops(monkeypatch):
+    monkeypatch.setattr(metrics, 'ENABLED', False)
+    handler = object()
+    assert metrics.instrument('x', handler) is handler
+    assert metrics.phase('exec') is metrics.phase('auth')
+    assert 'disabled' in metrics.format_stats()
@@ -0,0 +1,56 @@
+import asyncio
+
+from nginx_reload import ReloadScheduler, format_result
+
+
+def submit_all(scheduler, *requests):
+    async def run():
+        return await asyncio.gather(*(scheduler.submit(changes) for changes in requests))
+    return asyncio.run(run())
+
+
+def test_concurrent_requests_share_one_validation_and_reload(sites):
+    scheduler = ReloadScheduler(debounce=0.05, enabled_dir=str(sites.enabled))
+    (results_a, batch), (results_b, batch_b) = submit_all(scheduler, [('ensite', 'alpha')], [('ensite', 'beta')])
+    assert batch is batch_b
+    assert batch.ok and batch.requests == 2
+    assert [result.change.site for result in results_a] == ['alpha']
+    assert [result.change.site for result in results_b] == ['beta']
+    assert sites.calls().count('nginx -t') == 1
+    assert sites.calls().count('systemctl reload nginx') == 1
+    assert (sites.enabled / 'alpha').is_symlink() and (sites.enabled / 'beta').is_symlink()
+
+
+def test_failed_validation_rolls_back_only_sites_that_changed(sites, monkeypatch):
+    monkeypatch.setenv('STUB_NGINX_TEST_FAIL', '1')
+    sites.enable('alpha')
+    scheduler = ReloadScheduler(debounce=0.01, enabled_dir=str(sites.enabled))
+    [(results, batch)] = submit_all(scheduler, [('ensite', 'alpha'), ('ensite', 'beta')])
+    assert batch.validated is False and not batch.ok
+    # alpha was already enabled, so the failed validation must not take it down
+    assert (sites.enabled / 'alpha').is_symlink()
+    assert not (sites.enabled / 'beta').exists()
+    assert 'nginx_dissite alpha' not in sites.calls()
+    assert 'nginx_dissite beta' in sites.calls()
+    assert 'systemctl reload nginx' not in sites.calls()
+    text = format_result(results, batch)
+    assert 'Site alpha already enabled.' in text
+    assert 'Site beta rolled back.' in text
+
+
+def test_no_op_batch_is_not_validated_or_reloaded(sites, monkeypatch):
+    monkeypatch.setenv('STUB_NGINX_TEST_FAIL', '1')
+    sites.enable('alpha')
+    scheduler = ReloadScheduler(debounce=0.01, enabled_dir=str(sites.enabled))
+    [(results, batch)] = submit_all(scheduler, [('ensite', 'alpha')])
+    assert batch.ok and batch.validated is None
+    assert (sites.enabled / 'alpha').is_symlink()
+    assert sites.calls() == ['nginx_ensite alpha']
+
+
+def test_failed_change_is_reported_and_not_rolled_back(sites):
+    scheduler = ReloadScheduler(debounce=0.01, enabled_dir=str(sites.enabled))
+    [(results, batch)] = submit_all(scheduler, [('dissite', 'gamma'), ('ensite', 'beta')])
+    assert not results[0].ok and results[1].changed
+    assert not batch.ok and batch.reloaded
+    assert 'Error with site gamma' in format_result(results, batch)
@@ -0,0 +1,110 @@
+import asyncio
+import os
+
+import pytest
+
+import site_index
+from site_index import SiteIndex, format_enabled, format_sites
+
+
+def run_with_index(sites, steps, inotify=True):
+    """Start a SiteIndex on `sites`, then call each step(index) after the events it caused are handled."""
+    async def run():
+        index = SiteIndex(str(sites.available), str(sites.enabled))
+        index.start(asyncio.get_running_loop())
+        assert (index._inotify is not None) == inotify
+        try:
+            for step in steps:
+                step(index)
+                await asyncio.sleep(0.05)
+        finally:
+            index.stop()
+    asyncio.run(run())
+
+
+def link(sites, name, target):
+    os.symlink(sites.available / target, sites.enabled / name)
+
+
+def scenario(sites):
+    """Yield (change, check) pairs; each check runs once the change is visible."""
+    def enabled(index):
+        return {entry.name: (os.path.basename(entry.target), entry.dangling) for entry in index.enabled()}
+
+    def initial(index):
+        assert index.sites() == [('alpha', False), ('beta', False), ('gamma', False)]
+        assert index.enabled() == []
+
+    def created(index):
+        assert enabled(index) == {'alpha': ('alpha', False)}
+        assert dict(index.sites())['alpha'] is True
+
+    def retargeted(index):
+        # sites-enabled/alpha now points at beta
+        assert enabled(index) == {'alpha': ('beta', False)}
+        assert dict(index.sites()) == {'alpha': False, 'beta': True, 'gamma': False}
+        assert format_enabled(index.enabled()) == f'alpha -> {sites.available / "beta"}'
+
+    def dangling(index):
+        assert enabled(index) == {'alpha': ('beta', True)}
+        assert [entry.name for entry in index.dangling()] == ['alpha']
+        assert 'alpha: dangling link' in format_sites(index.sites(), index.dangling())
+
+    def restored(index):
+        assert enabled(index) == {'alpha': ('beta', False)}
+        assert index.dangling() == []
+
+    def renamed(index):
+        assert enabled(index) == {'www': ('beta', False)}
+
+    def filtered(index):
+        assert index.sites('g*') == [('gamma', False)]
+        assert index.sites('et') == [('beta', True)]
+        assert index.sites('a*') == [('alpha', False)]
+        assert [entry.name for entry in index.enabled('w*')] == ['www']
+        assert index.enabled('zz') == []
+
+    def retarget():
+        link(sites, 'alpha.tmp', 'beta')
+        os.replace(sites.enabled / 'alpha.tmp', sites.enabled / 'alpha')
+
+    def restore():
+        (sites.available / 'beta').write_text('server { server_name beta.example.com; }\n')
+
+    return [
+        (lambda: None, initial),
+        (lambda: link(sites, 'alpha', 'alpha'), created),
+        (retarget, retargeted),
+        (lambda: os.remove(sites.available / 'beta'), dangling),
+        (restore, restored),
+        (lambda: os.rename(sites.enabled / 'alpha', sites.enabled / 'www'), renamed),
+        (lambda: None, filtered),
+    ]
+
+
+def steps_for(sites):
+    steps = []
+    for change, check in scenario(sites):
+        steps.append(lambda index, change=change: change())
+        steps.append(check)
+    return steps
+
+
+@pytest.mark.skipif(site_index._libc() is None, reason='needs inotify')
+def test_index_follows_inotify_events(sites):
+    run_with_index(sites, steps_for(sites))
+
+
+def test_index_rescans_on_mtime_change_without_inotify(sites, monkeypatch):
+    def unavailable():
+        raise OSError('inotify is not available')
+
+    monkeypatch.setattr(site_index, 'Inotify', unavailable)
+    run_with_index(sites, steps_for(sites), inotify=False)
+
+
+def test_plain_files_in_sites_enabled(sites):
+    (sites.enabled / 'default').write_text('server {}\n')
+    index = SiteIndex(str(sites.available), str(sites.enabled))
+    assert index.enabled() == [site_index.EnabledEntry('default', None, False)]
+    assert format_enabled(index.enabled()) == 'default'
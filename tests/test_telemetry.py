@@ -0,0 +1,73 @@
+import pytest
+
+from telemetry import HostSampler, RingBuffer, format_stats, parse_thresholds
+
+
+def test_ring_buffer_last_wraps_around():
+    buffer = RingBuffer(4)
+    assert buffer.latest() is None and list(buffer.last(3)) == []
+    buffer.append(1)
+    buffer.append(2)
+    assert list(buffer.last(5)) == [1, 2]
+    for value in (3, 4):
+        buffer.append(value)
+    # Full, with the next write position back at the start
+    assert list(buffer.last(2)) == [3, 4]
+    for value in (5, 6):
+        buffer.append(value)
+    assert len(buffer) == 4 and buffer.latest() == 6
+    assert list(buffer.last(3)) == [4, 5, 6]
+    assert list(buffer.last(4)) == [3, 4, 5, 6]
+    assert list(buffer.last(10)) == [3, 4, 5, 6]
+
+
+@pytest.fixture
+def proc(tmp_path):
+    (tmp_path / 'stat').write_text('cpu  100 0 100 700 100 0 0 0 0 0\ncpu0 100 0 100 700 100 0 0 0 0 0\n')
+    (tmp_path / 'meminfo').write_text('MemTotal: 1000 kB\nMemFree: 100 kB\nMemAvailable: 250 kB\n')
+    (tmp_path / 'loadavg').write_text('1.50 0.75 0.25 2/300 4242\n')
+    return tmp_path
+
+
+def test_cpu_percentages_come_from_two_stat_samples(proc):
+    sampler = HostSampler(str(proc), str(proc / 'no-cpufreq'), interval=5)
+    sampler.open()
+    try:
+        sampler.sample()
+        assert len(sampler.buffers['cpu']) == 0
+        # 200 jiffies later: 80 idle, 20 iowait, 100 busy
+        (proc / 'stat').write_text('cpu  160 0 140 780 120 0 0 0 0 0\n')
+        sampler.sample()
+    finally:
+        sampler.close()
+    assert sampler.buffers['cpu'].latest() == 50.0
+    assert sampler.buffers['iowait'].latest() == 10.0
+    assert sampler.buffers['load1'].latest() == 1.5
+    assert sampler.buffers['mem'].latest() == 75.0
+    assert len(sampler.buffers['freq']) == 0
+    assert 'CPU: 50.0%' in format_stats(sampler)
+
+
+def test_memory_without_swap():
+    assert HostSampler._memory(b'MemTotal: 1000 kB\nMemAvailable: 250 kB\nSwapTotal: 0 kB\nSwapFree: 0 kB\n') == (75.0, 0.0)
+    assert HostSampler._memory(b'MemTotal: 1000 kB\nMemAvailable: 1000 kB\n') == (0.0, 0.0)
+
+
+def test_alert_fires_after_sustain_and_clears_once():
+    alerts = []
+    sampler = HostSampler(interval=5, thresholds=parse_thresholds('cpu=90'), sustain=15, on_alert=alerts.append)
+    for value in (95, 95, 50, 95, 95):
+        sampler._record('cpu', value)
+    # The dip to 50% restarts the count
+    assert alerts == []
+    sampler._record('cpu', 96)
+    sampler._record('cpu', 97)
+    assert alerts == ['Host CPU at 96.0%, above 90 for 15s']
+    sampler._record('cpu', 89)
+    sampler._record('cpu', 80)
+    assert alerts[1:] == ['Host CPU back to normal: 89.0% (threshold 90)']
+
+
+def test_parse_thresholds_rejects_unknown_metrics():
+    with pytest.raises(ValueError):
+        parse_thresholds('disk=90')
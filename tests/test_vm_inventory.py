@@ -0,0 +1,130 @@
+import asyncio
+import json
+import os
+import time
+
+import pytest
+
+from vm_backend import STATE_RUNNING, STATE_SHUTOFF, DomainInfo, FakeBackend, VirshBackend, VMError, VMNotFound, qemu_start_time
+from vm_inventory import VMInventory, format_entries
+
+
+class FlakyBackend(FakeBackend):
+    def __init__(self, domains):
+        super().__init__(domains)
+        self.failing = False
+
+    async def domain_info(self, name):
+        if self.failing:
+            raise VMError('cannot recv data: Connection reset by peer')
+        return await super().domain_info(name)
+
+
+def test_transient_lookup_failure_keeps_the_domain_as_stale():
+    backend = FlakyBackend([DomainInfo('web1', STATE_RUNNING, 2, 1024), DomainInfo('web2', STATE_RUNNING, 2, 1024)])
+    inventory = VMInventory(backend)
+
+    async def run():
+        await inventory.refresh()
+        backend.failing = True
+        await inventory.refresh_domain('web1')
+        stale = inventory.get('web1')
+        text = format_entries(inventory.all())
+        backend.failing = False
+        await inventory.refresh()
+        return stale, text
+
+    stale, text = asyncio.run(run())
+    assert stale is not None and stale.stale
+    assert 'running*' in text and 'state may be out of date' in text
+    assert not inventory.get('web1').stale
+
+
+def test_domain_that_no_longer_exists_is_dropped():
+    backend = FakeBackend([DomainInfo('web1', STATE_RUNNING, 2, 1024)])
+    inventory = VMInventory(backend)
+
+    async def run():
+        await inventory.refresh()
+        del backend.domains['web1']
+        await inventory.refresh_domain('web1')
+
+    asyncio.run(run())
+    assert inventory.get('web1') is None
+
+
+def test_uptime_comes_from_the_hypervisor_for_domains_running_before_startup():
+    started = time.time() - 3 * 3600 - 120
+    backend = FakeBackend([
+        DomainInfo('old', STATE_RUNNING, 2, 1024, started),
+        DomainInfo('unknown', STATE_RUNNING, 2, 1024),
+        DomainInfo('off', STATE_SHUTOFF, 2, 1024),
+    ])
+    inventory = VMInventory(backend)
+    asyncio.run(inventory.refresh())
+    assert inventory.get('old').since is None
+    lines = {line.split()[0]: line.split()[-1] for line in format_entries(inventory.all()).splitlines()[1:]}
+    assert lines == {'off': '-', 'old': '3h2m', 'unknown': '?'}
+
+
+def test_qemu_start_time_reads_the_qemu_process(tmp_path):
+    run_dir, proc = tmp_path / 'run', tmp_path / 'proc'
+    (proc / '4242').mkdir(parents=True)
+    run_dir.mkdir()
+    (run_dir / 'web1.pid').write_text('4242\n')
+    (proc / 'stat').write_text('cpu  1 2 3 4\nbtime 1700000000\n')
+    ticks = os.sysconf('SC_CLK_TCK')
+    fields = ['S'] + ['0'] * 18 + [str(600 * ticks)]
+    (proc / '4242' / 'stat').write_text(f'4242 (qemu-system-x86 (web1)) {" ".join(fields)} 0 0\n')
+    assert qemu_start_time('web1', str(run_dir), str(proc)) == 1700000600
+    assert qemu_start_time('missing', str(run_dir), str(proc)) is None
+
+
+def test_virsh_backend_distinguishes_missing_domains(stubs):
+    (stubs.path / 'virsh.json').write_text(json.dumps({'web1': [STATE_RUNNING, 2, 1024]}))
+    backend = VirshBackend()
+
+    async def run():
+        dom = await backend.domain_info('web1')
+        with pytest.raises(VMNotFound):
+            await backend.domain_info('ghost')
+        return dom
+
+    assert asyncio.run(run()).state == STATE_RUNNING
+
+
+class SlowListBackend(FakeBackend):
+    """list_domains() takes its snapshot at once but only returns it on `release`."""
+
+    def __init__(self, domains):
+        super().__init__(domains)
+        self.release = asyncio.Event()
+
+    async def list_domains(self):
+        snapshot = list(self.domains.values())
+        await self.release.wait()
+        return snapshot
+
+
+def test_event_during_a_full_listing_is_not_overwritten_by_it():
+    backend = SlowListBackend([DomainInfo('web1', STATE_RUNNING, 2, 1024)])
+    inventory = VMInventory(backend)
+
+    async def run():
+        backend.release.set()
+        await inventory.refresh()
+        backend.release.clear()
+        listing = asyncio.create_task(inventory.refresh())
+        await asyncio.sleep(0)
+        backend.domains['web1'] = backend.domains['web1']._replace(state=STATE_SHUTOFF, started=None)
+        inventory._on_event('web1')
+        pending = set(inventory._domain_tasks)
+        await asyncio.sleep(0)
+        backend.release.set()
+        await listing
+        await asyncio.gather(*pending)
+        return pending, set(inventory._domain_tasks)
+
+    pending, left = asyncio.run(run())
+    assert len(pending) == 1 and not left
+    assert inventory.get('web1').state == STATE_SHUTOFF
@@ -0,0 +1,141 @@
+import asyncio
+
+import pytest
+
+import delivery
+from delivery import MESSAGE_LIMIT, ProgressMessage
+from vm_backend import STATE_RUNNING, STATE_SHUTOFF, DomainInfo, FakeBackend, VMError
+from vm_inventory import VMInventory
+from vm_power import DEFAULT_PARALLEL, PowerError, PowerOperation, format_progress, format_results, parse_request
+
+
+class FakeMessage:
+    """Stands in for a telegram Message; rejects texts Telegram would reject."""
+
+    def __init__(self):
+        self.edits = []
+        self.replies = []
+
+    async def reply_text(self, text):
+        assert len(text) <= MESSAGE_LIMIT
+        self.replies.append(text)
+        return self
+
+    async def edit_text(self, text):
+        assert len(text) <= MESSAGE_LIMIT, f'message too long: {len(text)}'
+        self.edits.append(text)
+
+
+class FailingBackend(FakeBackend):
+    def __init__(self, domains, failing):
+        super().__init__(domains)
+        self.failing = set(failing)
+
+    async def shutdown(self, name, on_output=None):
+        if on_output is not None:
+            on_output('stdout', f'Domain {name} is being shutdown\n')
+        if name in self.failing:
+            raise VMError(f"Failed to shutdown domain '{name}'")
+        await super().shutdown(name)
+
+
+def make_inventory(backend):
+    inventory = VMInventory(backend)
+    asyncio.run(inventory.refresh())
+    return inventory
+
+
+def test_parse_request_stages_and_options():
+    request = parse_request(['web*', 'api1', '--then', 'db*', '--timeout=300', '--parallel=8'])
+    assert request.stages == [['web*', 'api1'], ['db*']]
+    assert request.wait and request.timeout == 300
+    assert request.parallel == 8
+
+
+def test_parse_request_defaults():
+    request = parse_request(['--all-running'])
+    assert request.stages == [['--all-running']]
+    assert not request.wait and request.parallel == DEFAULT_PARALLEL
+
+
+@pytest.mark.parametrize('args', [
+    ['web*', '--then'],
+    ['--then', 'db*'],
+    ['vm1', '--timeout=soon'],
+    ['vm1', '--parallel=0'],
+    ['vm1', '--force'],
+])
+def test_parse_request_rejects(args):
+    with pytest.raises(PowerError):
+        parse_request(args)
+
+
+def test_reboot_cannot_be_waited_for():
+    assert not parse_request(['vm1'], 'reboot').wait
+    assert parse_request(['vm1', '--wait'], 'start').wait
+    for args in (['vm1', '--wait'], ['vm1', '--timeout=30']):
+        with pytest.raises(PowerError):
+            parse_request(args, 'reboot')
+    backend = FakeBackend([DomainInfo('vm1', STATE_RUNNING, 1, 1024)])
+    with pytest.raises(PowerError):
+        PowerOperation(backend, make_inventory(backend), 'reboot', parse_request(['vm1', '--wait']))
+
+
+def test_later_stage_is_skipped_after_a_failure():
+    domains = [DomainInfo(name, STATE_RUNNING, 1, 1024) for name in ('web1', 'web2', 'db1')]
+    backend = FailingBackend(domains, failing={'web2'})
+    inventory = make_inventory(backend)
+    operation = PowerOperation(backend, inventory, 'shutdown', parse_request(['web*', '--then', 'db1']))
+    operation.plan()
+    assert not asyncio.run(operation.run())
+    statuses = {name: result.status for name, result in operation.results.items()}
+    assert statuses == {'web1': 'ok', 'web2': 'failed', 'db1': 'skipped'}
+    assert backend.domains['db1'].state == STATE_RUNNING
+
+
+def test_domains_already_in_target_state_count_as_ok():
+    backend = FakeBackend([DomainInfo('vm1', STATE_SHUTOFF, 1, 1024)])
+    operation = PowerOperation(backend, make_inventory(backend), 'shutdown', parse_request(['vm1']))
+    operation.plan()
+    assert asyncio.run(operation.run())
+    assert operation.results['vm1'].detail == 'already shut off'
+
+
+def test_progress_stays_within_message_limit_for_hundreds_of_vms(monkeypatch):
+    monkeypatch.setattr(delivery, 'EDIT_INTERVAL', 0)
+    domains = [DomainInfo(f'tenant-{i:04d}-worker', STATE_RUNNING, 2, 2097152) for i in range(400)]
+    failing = {dom.name for dom in domains[::37]}
+    backend = FailingBackend(domains, failing)
+    inventory = make_inventory(backend)
+    message = FakeMessage()
+
+    async def run():
+        progress = await ProgressMessage.start(message, 'Shutting down VMs...')
+        progress.interval = 0
+        operation = PowerOperation(
+            backend, inventory, 'shutdown', parse_request(['--all-running', '--parallel=16']),
+            on_change=lambda: progress.status(format_progress(operation)), on_output=progress.feed,
+        )
+        operation.plan()
+        progress.status(format_progress(operation))
+        ok = await operation.run()
+        await asyncio.sleep(0.01)
+        await progress.finish(format_results(operation))
+        return operation, ok
+
+    operation, ok = asyncio.run(run())
+    assert not ok
+    assert len(format_results(operation)) > MESSAGE_LIMIT
+    summary = format_progress(operation)
+    assert summary.startswith('400 VMs: 11 failed, 389 ok')
+    assert 'tenant-0037-worker' in summary
+    assert len(message.edits) >= 2
+    # The final table is paged rather than cut off
+    assert len(message.replies) > 1
+
+
+def test_progress_render_is_capped_even_with_an_oversized_status():
+    progress = ProgressMessage(FakeMessage(), 'Rebooting VMs...')
+    progress.status('\n'.join(f'vm{i:05d}  running' for i in range(1000)))
+    progress.feed('stdout', 'x' * 100)
+    assert len(progress._render()) <= MESSAGE_LIMIT
@@ -0,0 +1,361 @@
+import asyncio
+import functools
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import namedtuple
+
+import executor
+
+try:
+    import libvirt
+except ImportError:
+    libvirt = None
+
+logger = logging.getLogger(__name__)
+
+# libvirt virDomainState values, named the way virsh prints them
+STATE_NAMES = {
+    0: 'no state',
+    1: 'running',
+    2: 'idle',
+    3: 'paused',
+    4: 'in shutdown',
+    5: 'shut off',
+    6: 'crashed',
+    7: 'pmsuspended',
+}
+STATE_RUNNING = 1
+STATE_SHUTOFF = 5
+
+# Where libvirtd keeps the pid files of the qemu processes it runs
+QEMU_RUN_DIR = '/run/libvirt/qemu'
+PROC_ROOT = '/proc'
+
+# `started` is the wall-clock time the domain was started, or None if unknown
+DomainInfo = namedtuple('DomainInfo', 'name state vcpus memory_kib started', defaults=(None,))
+
+
+class VMError(Exception):
+    pass
+
+
+class VMNotFound(VMError):
+    """The domain does not exist (as opposed to the hypervisor failing to answer)."""
+
+
+@functools.lru_cache(maxsize=None)
+def _boot_time(proc_root):
+    with open(os.path.join(proc_root, 'stat')) as f:
+        for line in f:
+            if line.startswith('btime '):
+                return int(line.split()[1])
+    raise ValueError('no btime in /proc/stat')
+
+
+def qemu_start_time(name, run_dir=QEMU_RUN_DIR, proc_root=PROC_ROOT):
+    """Start time of a local domain's qemu process, or None where that can't be read."""
+    try:
+        with open(os.path.join(run_dir, f'{name}.pid')) as f:
+            pid = int(f.read().strip())
+        with open(os.path.join(proc_root, str(pid), 'stat')) as f:
+            # The command name may contain spaces; fields resume after its ')'
+            fields = f.read().rsplit(')', 1)[1].split()
+        return _boot_time(proc_root) + int(fields[19]) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _domain_from_stats(name, stats):
+    state = int(stats.get('state.state', 0))
+    return DomainInfo(
+        name,
+        state,
+        int(stats.get('vcpu.current', stats.get('vcpu.maximum', 0))),
+        int(stats.get('balloon.current', stats.get('balloon.maximum', 0))),
+        qemu_start_time(name) if state == STATE_RUNNING else None,
+    )
+
+
+class VMBackend:
+    name = 'base'
+    supports_events = False
+
+    async def list_domains(self):
+        raise NotImplementedError
+
+    async def domain_info(self, name):
+        raise NotImplementedError
+
+    async def start(self, name, on_output=None):
+        raise NotImplementedError
+
+    async def shutdown(self, name, on_output=None):
+        raise NotImplementedError
+
+    async def reboot(self, name, on_output=None):
+        raise NotImplementedError
+
+    async def watch(self, on_event, on_lost=None):
+        """Call on_event(domain_name) on the event loop for every lifecycle event."""
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+_event_thread = None
+
+
+def _start_libvirt_event_loop():
+    global _event_thread
+    if _event_thread is not None:
+        return
+
+    def run():
+        while True:
+            libvirt.virEventRunDefaultImpl()
+
+    libvirt.virEventRegisterDefaultImpl()
+    _event_thread = threading.Thread(target=run, name='libvirt-events', daemon=True)
+    _event_thread.start()
+
+
+class VirshBackend(VMBackend):
+    """Fallback backend that forks virsh, one process per call."""
+
+    name = 'virsh'
+
+    def __init__(self, uri=None):
+        self._base = ['virsh'] + (['-c', uri] if uri else [])
+
+    async def _virsh(self, *args, on_output=None):
+        try:
+            return (await executor.check_output(self._base + list(args), family='virsh', on_output=on_output)).decode()
+        except subprocess.CalledProcessError as e:
+            message = executor.error_text(e)
+            if 'failed to get domain' in message or 'Domain not found' in message:
+                raise VMNotFound(message) from e
+            raise VMError(message) from e
+
+    async def _domstats(self, *names):
+        output = await self._virsh('domstats', '--raw', '--state', '--vcpu', '--balloon', *names)
+        domains = []
+        name, stats = None, {}
+        for line in output.splitlines():
+            line = line.strip()
+            if line.startswith('Domain:'):
+                if name is not None:
+                    domains.append(_domain_from_stats(name, stats))
+                name, stats = line.split(':', 1)[1].strip().strip("'"), {}
+            elif '=' in line:
+                key, value = line.split('=', 1)
+                stats[key] = value
+        if name is not None:
+            domains.append(_domain_from_stats(name, stats))
+        return domains
+
+    async def list_domains(self):
+        return await self._domstats()
+
+    async def domain_info(self, name):
+        domains = await self._domstats(name)
+        if not domains:
+            raise VMNotFound(f'Domain {name} not found')
+        return domains[0]
+
+    async def start(self, name, on_output=None):
+        await self._virsh('start', name, on_output=on_output)
+
+    async def shutdown(self, name, on_output=None):
+        await self._virsh('shutdown', name, on_output=on_output)
+
+    async def reboot(self, name, on_output=None):
+        await self._virsh('reboot', name, on_output=on_output)
+
+
+class LibvirtBackend(VMBackend):
+    """Talks to libvirtd over a pool of long-lived connections.
+
+    libvirt calls block, so they run in worker threads, each borrowing a
+    connection from the pool. Dead connections are reopened on next use.
+    """
+
+    name = 'libvirt'
+    supports_events = True
+
+    def __init__(self, uri='qemu:///system', pool_size=4):
+        if libvirt is None:
+            raise VMError('libvirt python bindings are not installed')
+        self.uri = uri
+        self._event_conn = None
+        self._pool = asyncio.Queue()
+        for _ in range(pool_size):
+            self._pool.put_nowait(None)
+        self._stats = libvirt.VIR_DOMAIN_STATS_STATE | libvirt.VIR_DOMAIN_STATS_VCPU | libvirt.VIR_DOMAIN_STATS_BALLOON
+
+    def _connection(self, conn):
+        if conn is not None and conn.isAlive():
+            return conn
+        logger.info(f'Opening libvirt connection to {self.uri}.')
+        return libvirt.open(self.uri)
+
+    async def _call(self, func, *args):
+        conn = await self._pool.get()
+        try:
+            conn = await asyncio.to_thread(self._connection, conn)
+            return await asyncio.to_thread(func, conn, *args)
+        except libvirt.libvirtError as e:
+            if e.get_error_code() == libvirt.VIR_ERR_NO_DOMAIN:
+                raise VMNotFound(e.get_error_message() or str(e)) from e
+            raise VMError(e.get_error_message() or str(e)) from e
+        finally:
+            self._pool.put_nowait(conn)
+
+    def _list_domains(self, conn):
+        return [_domain_from_stats(dom.name(), stats) for dom, stats in conn.getAllDomainStats(self._stats)]
+
+    def _domain_info(self, conn, name):
+        dom = conn.lookupByName(name)
+        stats = conn.domainListGetStats([dom], self._stats)[0][1]
+        return _domain_from_stats(dom.name(), stats)
+
+    async def list_domains(self):
+        return await self._call(self._list_domains)
+
+    async def domain_info(self, name):
+        return await self._call(self._domain_info, name)
+
+    async def start(self, name, on_output=None):
+        await self._call(lambda conn: conn.lookupByName(name).create())
+
+    async def shutdown(self, name, on_output=None):
+        await self._call(lambda conn: conn.lookupByName(name).shutdown())
+
+    async def reboot(self, name, on_output=None):
+        await self._call(lambda conn: conn.lookupByName(name).reboot(0))
+
+    async def watch(self, on_event, on_lost=None):
+        loop = asyncio.get_running_loop()
+
+        def lifecycle(conn, dom, event, detail, opaque):
+            loop.call_soon_threadsafe(on_event, dom.name())
+
+        def closed(conn, reason, opaque):
+            logger.warning(f'libvirt event connection closed (reason {reason}).')
+            if on_lost is not None:
+                loop.call_soon_threadsafe(on_lost)
+
+        def register():
+            _start_libvirt_event_loop()
+            conn = libvirt.open(self.uri)
+            conn.domainEventRegisterAny(None, libvirt.VIR_DOMAIN_EVENT_ID_LIFECYCLE, lifecycle, None)
+            conn.registerCloseCallback(closed, None)
+            conn.setKeepAlive(5, 3)
+            return conn
+
+        try:
+            self._event_conn = await asyncio.to_thread(register)
+        except libvirt.libvirtError as e:
+            raise VMError(e.get_error_message() or str(e)) from e
+
+    async def close(self):
+        if self._event_conn is not None:
+            await asyncio.to_thread(self._event_conn.close)
+            self._event_conn = None
+        while not self._pool.empty():
+            conn = self._pool.get_nowait()
+            if conn is not None:
+                await asyncio.to_thread(conn.close)
+
+
+class FakeBackend(VMBackend):
+    """In-process hypervisor for tests and benchmarks."""
+
+    name = 'fake'
+    supports_events = True
+
+    def __init__(self, domains=None, latency=0.0):
+        if domains is None:
+            domains = [DomainInfo(f'vm{i:03d}', STATE_RUNNING if i % 3 else STATE_SHUTOFF, 2, 2097152) for i in range(10)]
+        self.domains = {dom.name: dom for dom in domains}
+        self.latency = latency
+        self._watchers = []
+
+    async def _lookup(self, name):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            return self.domains[name]
+        except KeyError:
+            raise VMNotFound(f"failed to get domain '{name}'") from None
+
+    def _set_state(self, dom, state):
+        self.domains[dom.name] = dom._replace(state=state, started=time.time() if state == STATE_RUNNING else None)
+        for on_event in self._watchers:
+            asyncio.get_running_loop().call_soon(on_event, dom.name)
+
+    async def watch(self, on_event, on_lost=None):
+        self._watchers.append(on_event)
+
+    async def list_domains(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return list(self.domains.values())
+
+    async def domain_info(self, name):
+        return await self._lookup(name)
+
+    async def start(self, name, on_output=None):
+        dom = await self._lookup(name)
+        if dom.state == STATE_RUNNING:
+            raise VMError('Requested operation is not valid: domain is already running')
+        self._set_state(dom, STATE_RUNNING)
+
+    async def shutdown(self, name, on_output=None):
+        dom = await self._lookup(name)
+        if dom.state != STATE_RUNNING:
+            raise VMError('Requested operation is not valid: domain is not running')
+        self._set_state(dom, STATE_SHUTOFF)
+
+    async def reboot(self, name, on_output=None):
+        dom = await self._lookup(name)
+        if dom.state != STATE_RUNNING:
+            raise VMError('Requested operation is not valid: domain is not running')
+
+
+def create_backend(kind=None, uri=None):
+    kind = kind or os.getenv('VM_BACKEND', 'auto')
+    uri = uri or os.getenv('LIBVIRT_URI', 'qemu:///system')
+    if kind == 'auto':
+        kind = 'libvirt' if libvirt is not None else 'virsh'
+    if kind == 'libvirt':
+        return LibvirtBackend(uri, pool_size=int(os.getenv('LIBVIRT_POOL_SIZE', '4')))
+    if kind == 'virsh':
+        return VirshBackend(os.getenv('LIBVIRT_URI'))
+    if kind == 'fake':
+        return FakeBackend()
+    raise ValueError(f'Unknown VM backend: {kind}')
+
+
+def format_memory(kib):
+    return f'{kib // 1024} MiB'
+
+
+def format_domain_table(domains):
+    width = max((len(dom.name) for dom in domains), default=4)
+    lines = [f'{"Name":<{width}}  {"State":<11}  vCPUs  Memory']
+    for dom in sorted(domains):
+        lines.append(f'{dom.name:<{width}}  {STATE_NAMES.get(dom.state, "unknown"):<11}  {dom.vcpus:>5}  {format_memory(dom.memory_kib)}')
+    return '\n'.join(lines)
+
+
+def format_domain_info(dom):
+    return (
+        f'Name:   {dom.name}\n'
+        f'State:  {STATE_NAMES.get(dom.state, "unknown")}\n'
+        f'vCPUs:  {dom.vcpus}\n'
+        f'Memory: {format_memory(dom.memory_kib)}'
+    )
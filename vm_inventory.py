@@ -0,0 +1,233 @@
+import asyncio
+import fnmatch
+import logging
+import time
+from collections import namedtuple
+
+from vm_backend import STATE_NAMES, STATE_RUNNING, DomainInfo, VMError, VMNotFound, format_memory
+
+logger = logging.getLogger(__name__)
+
+# `since` is the wall-clock time the current state was first observed, or None
+# if the domain was already in that state when the bot first saw it. `stale` is
+# set when a lookup of the domain failed and the entry may be out of date.
+VMEntry = namedtuple('VMEntry', DomainInfo._fields + ('since', 'stale'))
+
+
+class VMInventory:
+    """In-memory view of all domains on the hypervisor.
+
+    Kept fresh by lifecycle events when the backend supports them, and by an
+    adaptive poll otherwise: the poll interval doubles up to max_interval while
+    nothing changes and drops back to min_interval after a change. With events
+    active the poll only runs at max_interval as a safety net.
+
+    Full refreshes and per-domain refreshes take the same lock, so a listing
+    started before a lifecycle event cannot overwrite what the event fetched.
+    """
+
+    def __init__(self, backend, min_interval=2.0, max_interval=60.0):
+        self.backend = backend
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.events_active = False
+        self.updated_at = None
+        self._domains = {}
+        self._interval = min_interval
+        self._wakeup = asyncio.Event()
+        self._refresh_lock = asyncio.Lock()
+        self._task = None
+        self._domain_tasks = set()
+
+    async def start(self):
+        try:
+            await self.refresh()
+        except VMError as e:
+            logger.error(f'Initial VM inventory load failed: {e}')
+        if self.backend.supports_events:
+            try:
+                await self.backend.watch(self._on_event, self._on_events_lost)
+                self.events_active = True
+            except VMError as e:
+                logger.warning(f'VM lifecycle events unavailable, polling instead: {e}')
+        self._task = asyncio.create_task(self._poll())
+        logger.info(f'VM inventory started with {len(self._domains)} domains (events: {self.events_active}).')
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for task in self._domain_tasks:
+            task.cancel()
+        await asyncio.gather(*self._domain_tasks, return_exceptions=True)
+
+    @property
+    def source(self):
+        return 'events' if self.events_active else 'poll'
+
+    def age(self):
+        if self.updated_at is None:
+            return None
+        return time.monotonic() - self.updated_at
+
+    def _store(self, dom, now):
+        old = self._domains.get(dom.name)
+        if old is None:
+            since = None if self.updated_at is None else now
+        elif old.state != dom.state:
+            since = now
+        else:
+            since = old.since
+        self._domains[dom.name] = VMEntry(*dom, since, False)
+        return old is None or old.stale or old[:len(dom)] != tuple(dom)
+
+    async def refresh(self):
+        async with self._refresh_lock:
+            domains = await self.backend.list_domains()
+            now = time.time()
+            changed = False
+            seen = set()
+            for dom in domains:
+                seen.add(dom.name)
+                changed |= self._store(dom, now)
+            for name in self._domains.keys() - seen:
+                del self._domains[name]
+                changed = True
+            self.updated_at = time.monotonic()
+            return changed
+
+    async def refresh_domain(self, name):
+        async with self._refresh_lock:
+            try:
+                dom = await self.backend.domain_info(name)
+            except VMNotFound:
+                self._domains.pop(name, None)
+                return
+            except VMError as e:
+                # Keep what we knew; the next full refresh decides
+                logger.warning(f'Failed to refresh VM {name}: {e}')
+                old = self._domains.get(name)
+                if old is not None:
+                    self._domains[name] = old._replace(stale=True)
+                return
+            self._store(dom, time.time())
+
+    def _refresh_domain_soon(self, name):
+        task = asyncio.get_running_loop().create_task(self.refresh_domain(name))
+        self._domain_tasks.add(task)
+        task.add_done_callback(self._domain_task_done)
+
+    def _domain_task_done(self, task):
+        self._domain_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('VM refresh failed.', exc_info=task.exception())
+
+    async def ensure_loaded(self):
+        if self.updated_at is None:
+            await self.refresh()
+
+    def invalidate(self, name=None):
+        """Schedule a quick refresh, e.g. after a start/stop/reboot."""
+        self._interval = self.min_interval
+        if name is not None:
+            self._refresh_domain_soon(name)
+        self._wakeup.set()
+
+    def _on_event(self, name):
+        self._refresh_domain_soon(name)
+
+    def _on_events_lost(self):
+        self.events_active = False
+        self.invalidate()
+
+    async def _poll(self):
+        while True:
+            interval = self.max_interval if self.events_active else self._interval
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                changed = await self.refresh()
+            except VMError as e:
+                logger.error(f'VM inventory refresh failed: {e}')
+                continue
+            if changed:
+                self._interval = self.min_interval
+            else:
+                self._interval = min(self._interval * 2, self.max_interval)
+
+    def all(self):
+        return list(self._domains.values())
+
+    def get(self, name):
+        return self._domains.get(name)
+
+    def match(self, patterns):
+        """Return (entries, unmatched patterns) for names and shell-style globs."""
+        found = {}
+        unmatched = []
+        for pattern in patterns:
+            if any(ch in pattern for ch in '*?['):
+                names = fnmatch.filter(self._domains, pattern)
+            else:
+                names = [pattern] if pattern in self._domains else []
+            if not names:
+                unmatched.append(pattern)
+            for name in names:
+                found[name] = self._domains[name]
+        return list(found.values()), unmatched
+
+    def running(self):
+        return [entry for entry in self._domains.values() if entry.state == STATE_RUNNING]
+
+    def staleness(self):
+        age = self.age()
+        if age is None:
+            return 'Not loaded yet'
+        if self.events_active:
+            return f'Live via lifecycle events, last full sync {age:.1f}s ago'
+        return f'Updated {age:.1f}s ago (polling)'
+
+
+def format_duration(seconds):
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    if days:
+        return f'{days}d{hours}h'
+    if hours:
+        return f'{hours}h{minutes}m'
+    if minutes:
+        return f'{minutes}m{seconds}s'
+    return f'{seconds}s'
+
+
+def _uptime(entry, now):
+    if entry.state != STATE_RUNNING:
+        return '-'
+    started = entry.started or entry.since
+    if started is None:
+        return '?'
+    return format_duration(now - started)
+
+
+def format_entries(entries):
+    now = time.time()
+    width = max((len(entry.name) for entry in entries), default=4)
+    lines = [f'{"Name":<{width}}  {"State":<11}  vCPUs  {"Memory":>10}  Uptime']
+    for entry in sorted(entries, key=lambda entry: entry.name):
+        state = STATE_NAMES.get(entry.state, 'unknown') + ('*' if entry.stale else '')
+        lines.append(
+            f'{entry.name:<{width}}  {state:<11}  {entry.vcpus:>5}  '
+            f'{format_memory(entry.memory_kib):>10}  {_uptime(entry, now)}'
+        )
+    if any(entry.stale for entry in entries):
+        lines.append('* last lookup failed, state may be out of date')
+    return '\n'.join(lines)
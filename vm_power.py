@@ -0,0 +1,215 @@
+import asyncio
+import logging
+import os
+import time
+from collections import namedtuple
+
+from vm_backend import STATE_NAMES, STATE_RUNNING, STATE_SHUTOFF, VMError
+
+logger = logging.getLogger(__name__)
+
+# Domains acted on at once by a bulk operation, override per command with --parallel=N
+DEFAULT_PARALLEL = int(os.getenv('VM_POWER_PARALLEL', '4'))
+# Seconds to wait for a domain to reach its target state with --wait
+DEFAULT_TIMEOUT = float(os.getenv('VM_POWER_TIMEOUT', '120'))
+WAIT_POLL_INTERVAL = 1.0
+# Progress updates longer than this show status counts instead of the full table
+PROGRESS_LIMIT = 3000
+# Failed domains listed by name in a summarized progress update
+PROGRESS_FAILURES = 20
+
+ALL_RUNNING = '--all-running'
+STAGE_SEPARATOR = '--then'
+
+# action -> (backend method, state to wait for, progress title, verb for messages).
+# A rebooting domain stays running, so there is no state that shows the
+# reboot finished and --wait is refused for it.
+ACTIONS = {
+    'start': ('start', STATE_RUNNING, 'Starting', 'started'),
+    'shutdown': ('shutdown', STATE_SHUTOFF, 'Shutting down', 'shut down'),
+    'reboot': ('reboot', None, 'Rebooting', 'rebooted'),
+}
+
+PowerRequest = namedtuple('PowerRequest', 'stages wait timeout parallel')
+# status is one of pending, running, waiting, ok, skipped, failed
+PowerResult = namedtuple('PowerResult', 'stage name status detail duration')
+
+
+class PowerError(Exception):
+    pass
+
+
+def parse_request(args, action=None):
+    """Parse e.g. "web* api1 --then db* --wait --timeout=300 --parallel=8".
+
+    Each `--then` starts a new stage; a stage only starts once the previous
+    one has completed without failures. Waiting is rejected for an `action`
+    that has no state to wait for.
+    """
+    stages = [[]]
+    wait = False
+    timeout = DEFAULT_TIMEOUT
+    parallel = DEFAULT_PARALLEL
+    for arg in args:
+        option, _, value = arg.partition('=')
+        if arg == STAGE_SEPARATOR:
+            stages.append([])
+        elif arg == '--wait':
+            wait = True
+        elif option == '--timeout':
+            try:
+                timeout = float(value)
+            except ValueError:
+                raise PowerError(f'Invalid timeout: {value}') from None
+            wait = True
+        elif option == '--parallel':
+            if not value.isdigit() or int(value) < 1:
+                raise PowerError(f'Invalid parallelism: {value}')
+            parallel = int(value)
+        elif arg.startswith('--') and arg != ALL_RUNNING:
+            raise PowerError(f'Unknown option: {arg}')
+        else:
+            stages[-1].append(arg)
+    if not all(stages):
+        raise PowerError('Every stage needs at least one VM name, glob or --all-running.')
+    if wait and action in ACTIONS and ACTIONS[action][1] is None:
+        raise PowerError(f'--wait and --timeout are not supported for {action}, the domain stays running throughout.')
+    return PowerRequest(stages, wait, timeout, parallel)
+
+
+def select(inventory, patterns, taken=()):
+    """Return (names, unmatched) for one stage, leaving out names in `taken`."""
+    names = []
+    if ALL_RUNNING in patterns:
+        names.extend(sorted(entry.name for entry in inventory.running()))
+    entries, unmatched = inventory.match([pattern for pattern in patterns if pattern != ALL_RUNNING])
+    names.extend(sorted(entry.name for entry in entries))
+    return [name for name in dict.fromkeys(names) if name not in taken], unmatched
+
+
+class PowerOperation:
+    """Start, shut down or reboot many domains, stage by stage.
+
+    Within a stage up to `parallel` domains are acted on at once. With
+    `wait`, a domain only counts as done once it reports the target state
+    (checked every WAIT_POLL_INTERVAL seconds, up to `timeout`).
+    on_change() is called whenever a domain's status changes.
+    """
+
+    def __init__(self, backend, inventory, action, request, on_change=None, on_output=None):
+        if action not in ACTIONS:
+            raise PowerError(f'Unknown action: {action}')
+        if request.wait and ACTIONS[action][1] is None:
+            raise PowerError(f'Cannot wait for {action} to finish.')
+        self.backend = backend
+        self.inventory = inventory
+        self.action = action
+        self.request = request
+        self.results = {}
+        self.unmatched = []
+        self._on_change = on_change
+        self._on_output = on_output
+
+    def _set(self, stage, name, status, detail='', duration=None):
+        self.results[name] = PowerResult(stage, name, status, detail, duration)
+        if self._on_change is not None:
+            self._on_change()
+
+    def plan(self):
+        """Resolve every stage's patterns against the inventory."""
+        taken = {}
+        for stage, patterns in enumerate(self.request.stages, 1):
+            names, unmatched = select(self.inventory, patterns, taken)
+            self.unmatched.extend(unmatched)
+            for name in names:
+                taken[name] = stage
+                self.results[name] = PowerResult(stage, name, 'pending', '', None)
+        return taken
+
+    async def _wait_for(self, name, state, deadline):
+        while True:
+            dom = await self.backend.domain_info(name)
+            if dom.state == state:
+                return dom
+            if time.monotonic() >= deadline:
+                raise VMError(f'still {STATE_NAMES.get(dom.state, "unknown")} after {self.request.timeout:g}s')
+            await asyncio.sleep(WAIT_POLL_INTERVAL)
+
+    async def _act(self, stage, name, semaphore):
+        method, target, _, _ = ACTIONS[self.action]
+        entry = self.inventory.get(name)
+        async with semaphore:
+            started = time.monotonic()
+            if entry is not None and target is not None and entry.state == target:
+                self._set(stage, name, 'ok', f'already {STATE_NAMES[target]}', 0.0)
+                return True
+            self._set(stage, name, 'running')
+            try:
+                await getattr(self.backend, method)(name, on_output=self._on_output)
+                if self.request.wait:
+                    self._set(stage, name, 'waiting')
+                    await self._wait_for(name, target, started + self.request.timeout)
+            except VMError as e:
+                self._set(stage, name, 'failed', str(e), time.monotonic() - started)
+                return False
+            finally:
+                self.inventory.invalidate(name)
+            detail = STATE_NAMES[target] if self.request.wait else ''
+            self._set(stage, name, 'ok', detail, time.monotonic() - started)
+            return True
+
+    async def run(self):
+        """Run all stages; returns True if every domain succeeded."""
+        stages = {}
+        for name, result in self.results.items():
+            stages.setdefault(result.stage, []).append(name)
+        semaphore = asyncio.Semaphore(self.request.parallel)
+        ok = True
+        for stage in sorted(stages):
+            if not ok:
+                for name in stages[stage]:
+                    self._set(stage, name, 'skipped', 'an earlier stage failed')
+                continue
+            outcomes = await asyncio.gather(*(self._act(stage, name, semaphore) for name in stages[stage]))
+            ok = all(outcomes)
+        return ok and bool(self.results) and not self.unmatched
+
+
+def format_results(operation):
+    results = sorted(operation.results.values(), key=lambda result: (result.stage, result.name))
+    width = max([len(result.name) for result in results] + [4])
+    staged = len(operation.request.stages) > 1
+    lines = [f'{"Stage  " if staged else ""}{"Name":<{width}}  {"Result":<8}  {"Time":>6}  Detail']
+    for result in results:
+        duration = f'{result.duration:.1f}s' if result.duration is not None else '-'
+        stage = f'{result.stage:<5}  ' if staged else ''
+        lines.append(f'{stage}{result.name:<{width}}  {result.status:<8}  {duration:>6}  {result.detail}'.rstrip())
+    if operation.unmatched:
+        lines.append(f'Not found: {", ".join(operation.unmatched)}')
+    counts = {}
+    for result in results:
+        counts[result.status] = counts.get(result.status, 0) + 1
+    lines.append(', '.join(f'{count} {status}' for status, count in sorted(counts.items())) or 'No matching VMs.')
+    return '\n'.join(lines)
+
+
+def format_progress(operation, limit=PROGRESS_LIMIT):
+    """The results table, or status counts and failures when the table exceeds `limit`."""
+    text = format_results(operation)
+    if len(text) <= limit:
+        return text
+    counts = {}
+    failed = []
+    for result in sorted(operation.results.values(), key=lambda result: (result.stage, result.name)):
+        counts[result.status] = counts.get(result.status, 0) + 1
+        if result.status == 'failed':
+            failed.append(result)
+    lines = [f'{len(operation.results)} VMs: ' + ', '.join(f'{count} {status}' for status, count in sorted(counts.items()))]
+    if failed:
+        lines.append('Failed:')
+        lines.extend(f'{result.name}  {result.detail}'.rstrip() for result in failed[:PROGRESS_FAILURES])
+        if len(failed) > PROGRESS_FAILURES:
+            lines.append(f'... and {len(failed) - PROGRESS_FAILURES} more')
+    if operation.unmatched:
+        lines.append(f'Not found: {", ".join(operation.unmatched)}')
+    return '\n'.join(lines)[:limit]